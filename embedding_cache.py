@@ -0,0 +1,168 @@
+import os
+import sys
+import json
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+import portalocker
+
+# --- Configurar la codificación de la salida de la consola al inicio ---
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+except AttributeError:
+    pass
+except Exception as e:
+    print(f"WARNING: No se pudo reconfigurar la codificacion de la consola: {e}", flush=True)
+
+# --- Configuración ---
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_cache"))
+EMBEDDING_CACHE_LRU_SIZE = int(os.getenv("EMBEDDING_CACHE_LRU_SIZE", "4096")) # Nº de vectores en el LRU en memoria
+
+
+def normalizar_texto(text: str) -> str:
+    """
+    Normaliza el texto para la clave de caché: Unicode NFC y espacios colapsados.
+    No se cambian mayúsculas ni acentos, porque el modelo podría distinguirlos.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    """
+    Caché de embeddings en dos niveles:
+    1. LRU en memoria dentro del proceso.
+    2. Almacén en disco compartido entre procesos: un archivo float32 de filas de tamaño fijo
+       (leído con memory-map) y un índice SQLite clave -> fila.
+    La clave es (nombre del modelo, texto normalizado); cada modelo tiene su propio directorio,
+    así que cambiar EMBEDDING_MODEL_NAME invalida la caché automáticamente.
+    """
+
+    def __init__(self, model_name: str, dim: int, cache_dir: str = EMBEDDING_CACHE_DIR, lru_size: int = EMBEDDING_CACHE_LRU_SIZE):
+        self.model_name = model_name
+        self.dim = dim
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_memoria = 0
+        self.hits_disco = 0
+        self.misses = 0
+
+        slug = hashlib.sha1(f"{model_name}|{dim}".encode("utf-8")).hexdigest()[:12]
+        self.directorio = os.path.join(cache_dir, f"{model_name.replace('/', '_')}-{slug}")
+        os.makedirs(self.directorio, exist_ok=True)
+        self.vectores_path = os.path.join(self.directorio, "vectors.f32")
+        self.lock_path = os.path.join(self.directorio, ".lock")
+        self._verificar_meta()
+        self._db = sqlite3.connect(os.path.join(self.directorio, "index.sqlite"), check_same_thread=False, timeout=30)
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        self._db.commit()
+        self._mmap = None
+
+    def _verificar_meta(self):
+        """
+        Si el directorio pertenece a otro modelo/dimensión (no debería, pero por seguridad), se vacía.
+        """
+        meta_path = os.path.join(self.directorio, "meta.json")
+        meta = {"model_name": self.model_name, "dim": self.dim}
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                if json.load(f) == meta:
+                    return
+            print(f"WARNING: La caché de embeddings en '{self.directorio}' es de otro modelo. Vaciándola.", flush=True)
+        except (OSError, json.JSONDecodeError):
+            pass
+        for archivo in ("vectors.f32", "index.sqlite"):
+            try:
+                os.remove(os.path.join(self.directorio, archivo))
+            except OSError:
+                pass
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+    @staticmethod
+    def _clave(text: str) -> str:
+        return hashlib.sha1(normalizar_texto(text).encode("utf-8")).hexdigest()
+
+    def _leer_fila(self, row: int):
+        filas_necesarias = row + 1
+        if self._mmap is None or self._mmap.shape[0] < filas_necesarias:
+            # El archivo ha crecido (otro proceso o este mismo ha añadido filas): volver a mapearlo
+            filas = os.path.getsize(self.vectores_path) // (self.dim * 4)
+            if filas < filas_necesarias:
+                return None
+            self._mmap = np.memmap(self.vectores_path, dtype=np.float32, mode="r", shape=(filas, self.dim))
+        return np.array(self._mmap[row])
+
+    def _recordar(self, clave: str, vector):
+        self._lru[clave] = vector
+        self._lru.move_to_end(clave)
+        if len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def get(self, text: str):
+        """
+        Devuelve el vector (np.ndarray float32) si está en caché, o None.
+        """
+        clave = self._clave(text)
+        with self._lock:
+            vector = self._lru.get(clave)
+            if vector is not None:
+                self._lru.move_to_end(clave)
+                self.hits_memoria += 1
+                return vector
+            fila = self._db.execute("SELECT row FROM embeddings WHERE key = ?", (clave,)).fetchone()
+            vector = self._leer_fila(fila[0]) if fila else None
+            if vector is None:
+                self.misses += 1
+                return None
+            self.hits_disco += 1
+            self._recordar(clave, vector)
+            return vector
+
+    def put(self, text: str, vector):
+        self.put_many([text], [vector])
+
+    def put_many(self, texts: list, vectors):
+        """
+        Guarda varios vectores en memoria y en disco con una sola escritura.
+        """
+        vectores = np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dim)
+        claves = [self._clave(t) for t in texts]
+        with self._lock:
+            for clave, vector in zip(claves, vectores):
+                self._recordar(clave, vector)
+            try:
+                with portalocker.Lock(self.lock_path, timeout=10):
+                    existentes = {k for (k,) in self._db.execute(
+                        f"SELECT key FROM embeddings WHERE key IN ({','.join('?' * len(claves))})", claves)}
+                    nuevos = [(c, v) for c, v in dict(zip(claves, vectores)).items() if c not in existentes]
+                    if not nuevos:
+                        return
+                    with open(self.vectores_path, "ab") as f:
+                        bytes_fila = self.dim * 4
+                        resto = f.tell() % bytes_fila
+                        if resto: # Fila incompleta de una escritura interrumpida: rellenar hasta alinear
+                            f.write(b"\0" * (bytes_fila - resto))
+                        primera_fila = f.tell() // bytes_fila
+                        f.write(np.stack([v for _, v in nuevos]).tobytes())
+                    self._db.executemany("INSERT OR REPLACE INTO embeddings (key, row) VALUES (?, ?)",
+                                         [(c, primera_fila + i) for i, (c, _) in enumerate(nuevos)])
+                    self._db.commit()
+            except Exception as e:
+                # La caché en disco es una optimización: si falla, seguimos con el LRU en memoria
+                print(f"WARNING: No se pudo escribir en la caché de embeddings en disco: {e}", flush=True)
+
+    def estadisticas(self) -> dict:
+        total = self.hits_memoria + self.hits_disco + self.misses
+        return {
+            "hits_memoria": self.hits_memoria,
+            "hits_disco": self.hits_disco,
+            "misses": self.misses,
+            "hit_rate": (self.hits_memoria + self.hits_disco) / total if total else 0.0,
+            "en_memoria": len(self._lru),
+        }
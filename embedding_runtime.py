@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+# --- Configurar la codificación de la salida de la consola al inicio ---
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+except AttributeError:
+    pass
+except Exception as e:
+    print(f"WARNING: No se pudo reconfigurar la codificacion de la consola: {e}", flush=True)
+
+# --- Configuración ---
+# Runtime del codificador de frases:
+#   "torch"     -> SentenceTransformer sobre PyTorch (el comportamiento original)
+#   "onnx"      -> ONNX Runtime con el modelo exportado en float32 (sin importar torch)
+#   "onnx_int8" -> ONNX Runtime con el modelo cuantizado dinámicamente a int8 (el más ligero)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+# Directorio local con el modelo empaquetado (lo crea 'python embedding_runtime.py export'). Si existe, no se consulta el hub.
+EMBEDDING_MODEL_DIR = os.getenv("EMBEDDING_MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "all-MiniLM-L6-v2"))
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0")) # Hilos de inferencia (0 = lo que decida la librería)
+# Calentar el codificador en segundo plano al arrancar main.py (mientras se captura la pantalla y se planifica)
+EMBEDDING_WARMUP = os.getenv("EMBEDDING_WARMUP", "true").lower() == "true"
+EMBEDDING_PARITY_MIN = float(os.getenv("EMBEDDING_PARITY_MIN", "0.99")) # Coseno mínimo con los vectores ya guardados
+
+ARCHIVOS_ONNX = {
+    "onnx": os.path.join("onnx", "model.onnx"),
+    "onnx_int8": os.path.join("onnx", "model_qint8_avx2.onnx"),
+}
+EMBEDDING_BACKENDS_VALIDOS = ("torch",) + tuple(ARCHIVOS_ONNX)
+
+
+class OnnxSentenceEncoder:
+    """
+    Codificador de frases sobre ONNX Runtime y 'tokenizers', equivalente a SentenceTransformer.encode
+    para modelos tipo MiniLM (mean pooling + normalización), pero sin cargar PyTorch.
+    """
+
+    def __init__(self, model_dir: str, file_name: str, threads: int = EMBEDDING_THREADS):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.model_dir = model_dir
+        max_seq_length = 256
+        try:
+            with open(os.path.join(model_dir, "sentence_bert_config.json"), "r", encoding="utf-8") as f:
+                max_seq_length = json.load(f).get("max_seq_length", max_seq_length)
+        except OSError:
+            pass
+        try:
+            with open(os.path.join(model_dir, "modules.json"), "r", encoding="utf-8") as f:
+                self.normalizar = any(m.get("type", "").endswith("Normalize") for m in json.load(f))
+        except OSError:
+            self.normalizar = True
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_seq_length)
+        self.tokenizer.enable_padding()
+
+        opciones = onnxruntime.SessionOptions()
+        if threads > 0:
+            opciones.intra_op_num_threads = threads
+            opciones.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(os.path.join(model_dir, file_name), opciones, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.dimension = dimension_del_modelo(model_dir) or self.encode("dimension").shape[-1]
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, sentences, batch_size: int = 32, **kwargs):
+        """
+        Devuelve un np.ndarray float32: (dim,) para un texto o (n, dim) para una lista, como SentenceTransformer.
+        """
+        unico = isinstance(sentences, str)
+        textos = [sentences] if unico else list(sentences)
+        salida = []
+        for inicio in range(0, len(textos), batch_size):
+            codificados = self.tokenizer.encode_batch(textos[inicio:inicio + batch_size])
+            entradas = {
+                "input_ids": np.array([c.ids for c in codificados], dtype=np.int64),
+                "attention_mask": np.array([c.attention_mask for c in codificados], dtype=np.int64),
+                "token_type_ids": np.array([c.type_ids for c in codificados], dtype=np.int64),
+            }
+            tokens = self.session.run(None, {k: v for k, v in entradas.items() if k in self.input_names})[0]
+            mascara = entradas["attention_mask"][:, :, None].astype(np.float32)
+            vectores = (tokens * mascara).sum(axis=1) / np.clip(mascara.sum(axis=1), 1e-9, None) # Mean pooling
+            if self.normalizar:
+                vectores /= np.clip(np.linalg.norm(vectores, axis=1, keepdims=True), 1e-12, None)
+            salida.append(vectores.astype(np.float32))
+        vectores = np.vstack(salida) if salida else np.zeros((0, self.dimension), dtype=np.float32)
+        return vectores[0] if unico else vectores
+
+
+def dimension_del_modelo(model_dir: str):
+    """
+    Dimensión de los embeddings leída de la configuración del modelo empaquetado (sin cargarlo), o None.
+    """
+    try:
+        with open(os.path.join(model_dir, "1_Pooling", "config.json"), "r", encoding="utf-8") as f:
+            return json.load(f)["word_embedding_dimension"]
+    except (OSError, KeyError, json.JSONDecodeError):
+        return None
+
+
+def cargar_modelo(model_name: str, backend: str = EMBEDDING_BACKEND, model_dir: str = EMBEDDING_MODEL_DIR, threads: int = EMBEDDING_THREADS):
+    """
+    Carga el codificador con el runtime indicado. Usa el directorio local si existe (sin consultar el hub);
+    con "torch" y sin directorio local se descarga 'model_name' como antes.
+    """
+    if backend not in EMBEDDING_BACKENDS_VALIDOS:
+        raise ValueError(f"EMBEDDING_BACKEND='{backend}' no es valido. Opciones: {', '.join(EMBEDDING_BACKENDS_VALIDOS)}")
+    inicio = time.monotonic()
+    local = os.path.isdir(model_dir)
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        if threads > 0:
+            import torch
+            torch.set_num_threads(threads)
+        # local_files_only solo afecta a esta carga (HF_HUB_OFFLINE impediría descargar otros modelos en el proceso y sus hijos)
+        modelo = SentenceTransformer(model_dir if local else model_name, device='cpu', local_files_only=local)
+    else:
+        if not os.path.exists(os.path.join(model_dir, ARCHIVOS_ONNX[backend])):
+            raise FileNotFoundError(f"No existe '{os.path.join(model_dir, ARCHIVOS_ONNX[backend])}'. "
+                                    f"Genéralo con: python embedding_runtime.py export{' --int8' if backend == 'onnx_int8' else ''}")
+        modelo = OnnxSentenceEncoder(model_dir, ARCHIVOS_ONNX[backend], threads)
+    print(f"INFO: Codificador de embeddings '{backend}' cargado desde {model_dir if local else model_name} "
+          f"en {time.monotonic() - inicio:.2f} s.", flush=True)
+    return modelo
+
+
+def calentar(modelo) -> float:
+    """
+    Primera inferencia en vacío (reserva de memoria, compilación de kernels) para que la primera
+    consulta real no la pague. Devuelve los segundos que ha tardado.
+    """
+    inicio = time.monotonic()
+    modelo.encode(["calentamiento del modelo", "icono de inicio"])
+    duracion = time.monotonic() - inicio
+    print(f"INFO: Codificador de embeddings calentado en {duracion:.2f} s.", flush=True)
+    return duracion
+
+
+def verificar_paridad(modelo, puntos: list, umbral: float = EMBEDDING_PARITY_MIN) -> dict:
+    """
+    Compara los vectores guardados en la colección con los que produce 'modelo' para los mismos textos.
+    'puntos' son registros con vector y payload['description']. Si el coseno mínimo no llega al umbral,
+    los puntos existentes dejarían de ser comparables con las consultas nuevas.
+    """
+    pares = []
+    for p in puntos:
+        vector = p.vector.get("") if isinstance(p.vector, dict) else p.vector # Con vectores con nombre, el de texto es ""
+        if vector and (p.payload or {}).get("description"):
+            pares.append((p, vector))
+    puntos = [p for p, _ in pares]
+    if not puntos:
+        print("WARNING: No hay puntos con vector y descripción para comprobar la paridad.", flush=True)
+        return {"muestras": 0, "ok": True}
+    guardados = np.asarray([v for _, v in pares], dtype=np.float32)
+    nuevos = np.asarray(modelo.encode([p.payload["description"] for p in puntos]), dtype=np.float32)
+    guardados /= np.linalg.norm(guardados, axis=1, keepdims=True)
+    nuevos /= np.linalg.norm(nuevos, axis=1, keepdims=True)
+    cosenos = (guardados * nuevos).sum(axis=1)
+    resultado = {
+        "muestras": len(puntos),
+        "coseno_min": round(float(cosenos.min()), 5),
+        "coseno_medio": round(float(cosenos.mean()), 5),
+        "ok": bool(cosenos.min() >= umbral),
+    }
+    nivel = "INFO" if resultado["ok"] else "ERROR"
+    print(f"{nivel}: Paridad del codificador '{EMBEDDING_BACKEND}' con la colección: {resultado} (umbral {umbral})", flush=True)
+    return resultado
+
+
+def exportar(model_name: str, model_dir: str = EMBEDDING_MODEL_DIR, int8: bool = False):
+    """
+    Empaqueta el modelo en 'model_dir' para trabajar sin hub: pesos de PyTorch, tokenizer,
+    exportación ONNX y, opcionalmente, la variante cuantizada a int8. Requiere sentence-transformers[onnx].
+    Al terminar carga el directorio con cada runtime y compara sus vectores con los de PyTorch.
+    """
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    # Primero los pesos de PyTorch: save_pretrained del modelo ONNX solo escribe el .onnx, el tokenizer y la configuración,
+    # y cargar_modelo("torch") usa este directorio en cuanto existe
+    SentenceTransformer(model_name, device='cpu').save_pretrained(model_dir)
+    print(f"INFO: Modelo '{model_name}' (PyTorch) guardado en '{model_dir}'.", flush=True)
+    modelo = SentenceTransformer(model_name, device='cpu', backend="onnx")
+    modelo.save_pretrained(model_dir)
+    print(f"INFO: Modelo '{model_name}' exportado a ONNX en '{model_dir}'.", flush=True)
+    if int8:
+        export_dynamic_quantized_onnx_model(modelo, "avx2", model_dir)
+        print(f"INFO: Variante int8 guardada en '{os.path.join(model_dir, ARCHIVOS_ONNX['onnx_int8'])}'.", flush=True)
+
+    textos = ["icono de inicio", "botón de aceptar"]
+    referencia = np.asarray(cargar_modelo(model_name, backend="torch", model_dir=model_dir).encode(textos), dtype=np.float32)
+    for backend in ("onnx", "onnx_int8") if int8 else ("onnx",):
+        vectores = np.asarray(cargar_modelo(model_name, backend=backend, model_dir=model_dir).encode(textos), dtype=np.float32)
+        coseno = float(np.min(np.sum(referencia * vectores, axis=1) /
+                              (np.linalg.norm(referencia, axis=1) * np.linalg.norm(vectores, axis=1))))
+        nivel = "INFO" if coseno >= EMBEDDING_PARITY_MIN else "WARNING"
+        print(f"{nivel}: '{backend}' cargado desde '{model_dir}': coseno mínimo con PyTorch {coseno:.4f}.", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Empaquetado y prueba del codificador de embeddings.")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+    parser_export = subparsers.add_parser("export", help="Descarga el modelo y lo guarda (con su exportación ONNX) en EMBEDDING_MODEL_DIR.")
+    parser_export.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    parser_export.add_argument("--int8", action="store_true", help="Genera también la variante cuantizada a int8.")
+    parser_warmup = subparsers.add_parser("warmup", help="Carga el codificador configurado y mide la carga y la primera inferencia.")
+    parser_warmup.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    args = parser.parse_args()
+
+    if args.comando == "export":
+        exportar(args.model, int8=args.int8)
+    else:
+        calentar(cargar_modelo(args.model))
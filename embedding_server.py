@@ -0,0 +1,282 @@
+import os
+import sys
+import time
+import queue
+import secrets
+import argparse
+import tempfile
+import threading
+from multiprocessing.connection import Listener, Client, AuthenticationError
+
+import numpy as np
+
+# --- Configurar la codificación de la salida de la consola al inicio ---
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+except AttributeError:
+    pass
+except Exception as e:
+    print(f"WARNING: No se pudo reconfigurar la codificacion de la consola: {e}", flush=True)
+
+import embedding_runtime
+
+# --- Configuración ---
+# Servidor local de embeddings: un único proceso carga el modelo y atiende a main.py, a los subprocesos de
+# analizar_iconos.py y a la interfaz Streamlit, en lugar de que cada uno cargue su propia copia.
+# Se arranca con: python embedding_server.py. Si no está arrancado, cada proceso usa su modelo local como antes.
+EMBEDDING_SERVER_ENABLED = os.getenv("EMBEDDING_SERVER_ENABLED", "true").lower() == "true"
+# Socket Unix en Linux/macOS; en Windows, tubería con nombre (el equivalente local, sin red)
+_FAMILIA = "AF_PIPE" if sys.platform == "win32" else "AF_UNIX"
+_DIRECCION_POR_DEFECTO = r"\\.\pipe\plcaid_embeddings" if sys.platform == "win32" else os.path.join(tempfile.gettempdir(), "plcaid_embeddings.sock")
+EMBEDDING_SERVER_ADDRESS = os.getenv("EMBEDDING_SERVER_ADDRESS", _DIRECCION_POR_DEFECTO)
+# Clave de autenticación de las conexiones: multiprocessing.connection deserializa (pickle) lo que recibe, así que
+# la clave es lo único que impide a otro proceso local ejecutar código en el servidor (en Windows la tubería con
+# nombre no tiene permisos de archivo). Es aleatoria por instalación y se guarda en un archivo que solo puede leer
+# el usuario; el servidor la crea al arrancar y los clientes la leen. EMBEDDING_SERVER_AUTHKEY la sustituye.
+EMBEDDING_SERVER_KEY_FILE = os.getenv("EMBEDDING_SERVER_KEY_FILE", os.path.join(
+    os.getenv("KM_LOCAL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "local_kb")), "embedding_server.key"))
+_CLAVES_INSEGURAS = {b"", b"plcaid-embeddings"} # La antigua clave fija por defecto es pública
+
+
+def obtener_clave(crear: bool = False) -> bytes | None:
+    """
+    Clave de autenticación del servidor: EMBEDDING_SERVER_AUTHKEY o la del archivo de la instalación.
+    Con 'crear', si el archivo no existe se genera una clave aleatoria (permisos 600). Sin clave devuelve None.
+    """
+    clave = os.getenv("EMBEDDING_SERVER_AUTHKEY")
+    if clave:
+        return clave.encode("utf-8")
+    try:
+        with open(EMBEDDING_SERVER_KEY_FILE, "r", encoding="ascii") as f:
+            return bytes.fromhex(f.read().strip())
+    except FileNotFoundError:
+        if not crear:
+            return None
+    except (OSError, ValueError) as e:
+        print(f"WARNING: No se pudo leer la clave del servidor de embeddings en {EMBEDDING_SERVER_KEY_FILE}: {e}", flush=True)
+        return None
+    os.makedirs(os.path.dirname(EMBEDDING_SERVER_KEY_FILE), exist_ok=True)
+    clave = secrets.token_bytes(32)
+    try:
+        descriptor = os.open(EMBEDDING_SERVER_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError: # Otro proceso la ha creado a la vez
+        return obtener_clave()
+    with os.fdopen(descriptor, "w", encoding="ascii") as f:
+        f.write(clave.hex())
+    print(f"INFO: Clave del servidor de embeddings generada en {EMBEDDING_SERVER_KEY_FILE}.", flush=True)
+    return clave
+# Micro-lotes: las peticiones que llegan en esta ventana se codifican juntas en una sola pasada del modelo
+EMBEDDING_SERVER_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_SERVER_BATCH_WINDOW_MS", "5"))
+EMBEDDING_SERVER_MAX_BATCH = int(os.getenv("EMBEDDING_SERVER_MAX_BATCH", "128")) # Textos por pasada como máximo
+EMBEDDING_SERVER_TIMEOUT = float(os.getenv("EMBEDDING_SERVER_TIMEOUT", "30")) # Segundos de espera de una respuesta
+# Tras un fallo de conexión, el cliente no vuelve a intentarlo hasta pasados estos segundos (usa el modelo local)
+EMBEDDING_SERVER_RETRY_SECONDS = float(os.getenv("EMBEDDING_SERVER_RETRY_SECONDS", "30"))
+
+
+class _Peticion:
+    def __init__(self, textos: list):
+        self.textos = textos
+        self.vectores = None
+        self.error = None
+        self.lista = threading.Event()
+
+
+class ServidorEmbeddings:
+    """
+    Dueño de la única copia del modelo. Cada conexión se atiende en su hilo; un hilo agrupador junta las
+    peticiones que llegan dentro de la ventana de micro-lote y las codifica en una sola llamada al modelo.
+    """
+
+    def __init__(self, model_name: str, backend: str = embedding_runtime.EMBEDDING_BACKEND,
+                 direccion: str = EMBEDDING_SERVER_ADDRESS, ventana_ms: float = EMBEDDING_SERVER_BATCH_WINDOW_MS,
+                 max_lote: int = EMBEDDING_SERVER_MAX_BATCH):
+        self.model_name = model_name
+        self.backend = backend
+        self.direccion = direccion
+        self.ventana = ventana_ms / 1000.0
+        self.max_lote = max_lote
+        self.modelo = embedding_runtime.cargar_modelo(model_name, backend=backend)
+        self.dimension = self.modelo.get_sentence_embedding_dimension()
+        self._cola = queue.Queue()
+        self.lotes = 0
+        self.textos = 0
+
+    def _agrupador(self):
+        while True:
+            peticiones = [self._cola.get()]
+            pendientes = len(peticiones[0].textos)
+            limite = time.monotonic() + self.ventana
+            while pendientes < self.max_lote:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    peticion = self._cola.get(timeout=restante)
+                except queue.Empty:
+                    break
+                peticiones.append(peticion)
+                pendientes += len(peticion.textos)
+
+            textos = [texto for peticion in peticiones for texto in peticion.textos]
+            try:
+                vectores = np.asarray(self.modelo.encode(textos, batch_size=self.max_lote), dtype=np.float32)
+                inicio = 0
+                for peticion in peticiones:
+                    peticion.vectores = vectores[inicio:inicio + len(peticion.textos)]
+                    inicio += len(peticion.textos)
+            except Exception as e:
+                print(f"ERROR: Fallo al codificar un lote de {len(textos)} textos: {e}", flush=True)
+                for peticion in peticiones:
+                    peticion.error = str(e)
+            self.lotes += 1
+            self.textos += len(textos)
+            for peticion in peticiones:
+                peticion.lista.set()
+
+    def _responder(self, mensaje: dict) -> dict:
+        if mensaje.get("op") == "info":
+            return {"ok": True, "model": self.model_name, "backend": self.backend, "dimension": self.dimension,
+                    "lotes": self.lotes, "textos": self.textos}
+        if mensaje.get("op") != "encode":
+            return {"ok": False, "error": f"Operación desconocida: {mensaje.get('op')}"}
+        if (mensaje.get("model"), mensaje.get("backend")) != (self.model_name, self.backend):
+            # Vectores de otro modelo o runtime no son intercambiables: el cliente debe usar su modelo local
+            return {"ok": False, "incompatible": True,
+                    "error": f"El servidor sirve '{self.model_name}' ({self.backend}), no '{mensaje.get('model')}' ({mensaje.get('backend')})"}
+        peticion = _Peticion(list(mensaje.get("texts") or []))
+        if peticion.textos:
+            self._cola.put(peticion)
+            peticion.lista.wait()
+        if peticion.error:
+            return {"ok": False, "error": peticion.error}
+        vectores = peticion.vectores if peticion.vectores is not None else np.zeros((0, self.dimension), dtype=np.float32)
+        return {"ok": True, "vectors": vectores}
+
+    def _atender(self, conexion):
+        with conexion:
+            while True:
+                try:
+                    mensaje = conexion.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    conexion.send(self._responder(mensaje))
+                except (EOFError, OSError):
+                    return
+
+    def servir(self):
+        clave = obtener_clave(crear=True)
+        if clave is None or clave in _CLAVES_INSEGURAS or len(clave) < 16:
+            print("ERROR: El servidor de embeddings necesita una clave privada de al menos 16 bytes (no la antigua clave por defecto). "
+                  f"Quita EMBEDDING_SERVER_AUTHKEY para usar la generada en {EMBEDDING_SERVER_KEY_FILE}.", flush=True)
+            return
+        if os.name != "nt" and not os.getenv("EMBEDDING_SERVER_AUTHKEY") and os.stat(EMBEDDING_SERVER_KEY_FILE).st_mode & 0o077:
+            os.chmod(EMBEDDING_SERVER_KEY_FILE, 0o600) # Que ningún otro usuario pueda leerla
+        if _FAMILIA == "AF_UNIX" and os.path.exists(self.direccion):
+            if ClienteEmbeddings(self.model_name, self.backend, self.direccion).info() is not None:
+                print(f"ERROR: Ya hay un servidor de embeddings escuchando en {self.direccion}.", flush=True)
+                return
+            os.remove(self.direccion) # Socket de un servidor anterior que no se cerró limpiamente
+        listener = Listener(self.direccion, family=_FAMILIA, authkey=clave)
+        if _FAMILIA == "AF_UNIX":
+            os.chmod(self.direccion, 0o600)
+        threading.Thread(target=self._agrupador, name="embeddings-lotes", daemon=True).start()
+        print(f"INFO: Servidor de embeddings '{self.model_name}' ({self.backend}) escuchando en {self.direccion} "
+              f"(ventana {self.ventana * 1000:.0f} ms, lote máximo {self.max_lote}).", flush=True)
+        try:
+            while True:
+                try:
+                    conexion = listener.accept()
+                except (AuthenticationError, OSError) as e:
+                    print(f"WARNING: Conexión rechazada en el servidor de embeddings: {e}", flush=True)
+                    continue
+                threading.Thread(target=self._atender, args=(conexion,), daemon=True).start()
+        except KeyboardInterrupt:
+            print("INFO: Servidor de embeddings detenido.", flush=True)
+        finally:
+            listener.close()
+
+
+class ClienteEmbeddings:
+    """
+    Cliente del servidor de embeddings, con una conexión persistente por proceso (serializada con un lock).
+    Devuelve None en lugar de lanzar si el servidor no está disponible, para que el llamador use su modelo local.
+    """
+
+    def __init__(self, model_name: str, backend: str = embedding_runtime.EMBEDDING_BACKEND, direccion: str = EMBEDDING_SERVER_ADDRESS):
+        self.model_name = model_name
+        self.backend = backend
+        self.direccion = direccion
+        self._conexion = None
+        self._lock = threading.Lock()
+        self._reintentar_en = 0.0
+        self._incompatible = False
+
+    def _conectar(self):
+        if self._incompatible or time.monotonic() < self._reintentar_en:
+            return None
+        clave = obtener_clave()
+        if clave is None: # Sin clave no hay servidor arrancado en esta instalación
+            self._reintentar_en = time.monotonic() + EMBEDDING_SERVER_RETRY_SECONDS
+            return None
+        try:
+            self._conexion = Client(self.direccion, family=_FAMILIA, authkey=clave)
+            print(f"INFO: Usando el servidor de embeddings compartido en {self.direccion}.", flush=True)
+        except (OSError, EOFError, AuthenticationError):
+            self._conexion = None
+            self._reintentar_en = time.monotonic() + EMBEDDING_SERVER_RETRY_SECONDS
+        return self._conexion
+
+    def _pedir(self, mensaje: dict):
+        with self._lock:
+            conexion = self._conexion or self._conectar()
+            if conexion is None:
+                return None
+            try:
+                conexion.send(mensaje)
+                if not conexion.poll(EMBEDDING_SERVER_TIMEOUT):
+                    raise TimeoutError(f"sin respuesta en {EMBEDDING_SERVER_TIMEOUT:.0f} s")
+                respuesta = conexion.recv()
+            except (OSError, EOFError, TimeoutError) as e:
+                print(f"WARNING: Se perdió la conexión con el servidor de embeddings ({e}). Se usará el modelo local.", flush=True)
+                conexion.close()
+                self._conexion = None
+                self._reintentar_en = time.monotonic() + EMBEDDING_SERVER_RETRY_SECONDS
+                return None
+        if not respuesta.get("ok"):
+            print(f"WARNING: El servidor de embeddings respondió con un error: {respuesta.get('error')}", flush=True)
+            if respuesta.get("incompatible"):
+                self._incompatible = True
+            return None
+        return respuesta
+
+    def info(self) -> dict | None:
+        return self._pedir({"op": "info"})
+
+    def dimension(self) -> int | None:
+        """Dimensión de los vectores del servidor, o None si no hay servidor o sirve otro modelo."""
+        respuesta = self.info()
+        if respuesta is None or (respuesta["model"], respuesta["backend"]) != (self.model_name, self.backend):
+            return None
+        return respuesta["dimension"]
+
+    def encode(self, textos: list):
+        """Matriz float32 (len(textos) x dimensión) calculada por el servidor, o None si hay que usar el modelo local."""
+        respuesta = self._pedir({"op": "encode", "model": self.model_name, "backend": self.backend, "texts": list(textos)})
+        return None if respuesta is None else respuesta["vectors"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor local de embeddings compartido entre procesos.")
+    parser.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--address", default=EMBEDDING_SERVER_ADDRESS, help="Ruta del socket Unix (o nombre de la tubería en Windows).")
+    parser.add_argument("--window-ms", type=float, default=EMBEDDING_SERVER_BATCH_WINDOW_MS, help="Ventana de micro-lote en milisegundos.")
+    parser.add_argument("--max-batch", type=int, default=EMBEDDING_SERVER_MAX_BATCH, help="Textos por pasada del modelo como máximo.")
+    parser.add_argument("--no-warmup", action="store_true", help="No hacer la inferencia de calentamiento al arrancar.")
+    args = parser.parse_args()
+
+    servidor = ServidorEmbeddings(args.model, direccion=args.address, ventana_ms=args.window_ms, max_lote=args.max_batch)
+    if not args.no_warmup:
+        embedding_runtime.calentar(servidor.modelo)
+    servidor.servir()
@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import threading
+
+import numpy as np
+
+# --- Configurar la codificación de la salida de la consola al inicio ---
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+except AttributeError:
+    pass
+except Exception as e:
+    print(f"WARNING: No se pudo reconfigurar la codificacion de la consola: {e}", flush=True)
+
+# --- Configuración ---
+# Embedding visual de los recortes de referencia (segundo vector con nombre de la colección de elementos UI).
+# Permite buscar un recorte de la pantalla directamente contra las referencias, sin describirlo antes con un LLM.
+# Desactivado por defecto: el primer alta carga CLIP (cientos de MB) en el proceso que escribe en la colección.
+IMAGE_EMBEDDING_ENABLED = os.getenv("IMAGE_EMBEDDING_ENABLED", "false").lower() == "true"
+# Modelo CLIP de sentence-transformers (o ruta a una copia local). Corre en CPU.
+IMAGE_EMBEDDING_MODEL = os.getenv("IMAGE_EMBEDDING_MODEL", "clip-ViT-B-32")
+# Dimensión del vector; se necesita para crear la colección sin cargar el modelo (512 para clip-ViT-B-32)
+IMAGE_EMBEDDING_DIM = int(os.getenv("IMAGE_EMBEDDING_DIM", "512"))
+IMAGE_EMBEDDING_BATCH_SIZE = int(os.getenv("IMAGE_EMBEDDING_BATCH_SIZE", "16"))
+IMAGE_VECTOR_NAME = "image"
+
+_modelo = None
+_modelo_lock = threading.Lock()
+
+
+def obtener_modelo():
+    """Devuelve el modelo de embeddings de imagen, cargándolo la primera vez (seguro entre hilos)."""
+    global _modelo
+    if _modelo is None:
+        with _modelo_lock:
+            if _modelo is None:
+                from sentence_transformers import SentenceTransformer
+                inicio = time.monotonic()
+                _modelo = SentenceTransformer(IMAGE_EMBEDDING_MODEL, device='cpu', local_files_only=os.path.isdir(IMAGE_EMBEDDING_MODEL))
+                print(f"INFO: Modelo de embeddings de imagen '{IMAGE_EMBEDDING_MODEL}' cargado en CPU en {time.monotonic() - inicio:.2f} s.", flush=True)
+    return _modelo
+
+
+def _a_pil(imagen):
+    """
+    Acepta una ruta, una matriz BGR de OpenCV o una imagen PIL y devuelve una imagen PIL RGB.
+    """
+    from PIL import Image
+
+    if isinstance(imagen, Image.Image):
+        return imagen.convert("RGB")
+    if isinstance(imagen, str):
+        return Image.open(imagen).convert("RGB")
+    matriz = np.asarray(imagen)
+    if matriz.ndim == 2:
+        return Image.fromarray(matriz).convert("RGB")
+    return Image.fromarray(np.ascontiguousarray(matriz[:, :, 2::-1])) # BGR(A) -> RGB
+
+
+def embed_imagenes(imagenes: list) -> list:
+    """
+    Embeddings de varias imágenes (rutas, matrices BGR o imágenes PIL) en una sola pasada del modelo.
+    Devuelve una lista de vectores en el mismo orden ([] para las imágenes que no se hayan podido leer).
+    """
+    vectores = [[] for _ in imagenes]
+    legibles, indices = [], []
+    for i, imagen in enumerate(imagenes):
+        try:
+            legibles.append(_a_pil(imagen))
+            indices.append(i)
+        except Exception as e:
+            print(f"WARNING: No se pudo leer la imagen {imagen if isinstance(imagen, str) else i} para su embedding: {e}", flush=True)
+    if legibles:
+        try:
+            resultado = obtener_modelo().encode(legibles, batch_size=IMAGE_EMBEDDING_BATCH_SIZE)
+            for i, vector in zip(indices, resultado):
+                vectores[i] = np.asarray(vector, dtype=np.float32).tolist()
+        except Exception as e:
+            print(f"ERROR: Fallo al calcular embeddings de {len(legibles)} imágenes: {e}", flush=True)
+    return vectores
+
+
+def embed_imagen(imagen) -> list:
+    """Embedding de una sola imagen; [] si no se ha podido calcular."""
+    return embed_imagenes([imagen])[0]
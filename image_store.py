@@ -0,0 +1,186 @@
+import os
+import sys
+import time
+import shutil
+import hashlib
+
+import cv2
+
+# --- Configurar la codificación de la salida de la consola al inicio ---
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+except AttributeError:
+    pass
+except Exception as e:
+    print(f"WARNING: No se pudo reconfigurar la codificacion de la consola: {e}", flush=True)
+
+# --- Configuración ---
+project_root = os.path.dirname(os.path.abspath(__file__))
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", os.path.join(project_root, "qdrant_ui_cache"))
+# Los archivos sin referencias más recientes que esto no se borran (pueden pertenecer a una escritura en curso)
+IMAGE_STORE_GC_GRACE = float(os.getenv("IMAGE_STORE_GC_GRACE", "3600"))
+# Reconciliar el almacén con la colección al arrancar main.py (como mucho una vez cada IMAGE_STORE_GC_INTERVAL_HOURS)
+IMAGE_STORE_GC_ON_STARTUP = os.getenv("IMAGE_STORE_GC_ON_STARTUP", "true").lower() == "true"
+IMAGE_STORE_GC_INTERVAL_HOURS = float(os.getenv("IMAGE_STORE_GC_INTERVAL_HOURS", "24"))
+
+_LONGITUD_HASH = 64 # sha256 en hexadecimal; los archivos antiguos (uuid4.hex) tienen 32
+
+
+def hash_de_pixeles(imagen) -> str:
+    """
+    Hash del contenido de la imagen (dimensiones + píxeles BGR), independiente de la codificación del archivo.
+    """
+    h = hashlib.sha256()
+    h.update(repr(imagen.shape).encode("ascii"))
+    h.update(imagen.tobytes())
+    return h.hexdigest()
+
+
+def ruta_de_hash(image_hash: str) -> str:
+    return os.path.join(IMAGE_STORE_DIR, f"{image_hash}.png")
+
+
+def ruta_relativa(path: str) -> str:
+    """
+    Ruta relativa a la raíz del proyecto, que es como se guarda en el payload (main.py la une con project_root).
+    Si el almacén está fuera del proyecto (IMAGE_STORE_DIR), se deja la ruta absoluta.
+    """
+    try:
+        relativa = os.path.relpath(path, project_root)
+    except ValueError: # Otra unidad en Windows
+        return path
+    return path if relativa.startswith("..") else relativa
+
+
+def ruta_absoluta(path: str) -> str:
+    return path if os.path.isabs(path) else os.path.join(project_root, path)
+
+
+def es_nombre_de_hash(filename: str) -> bool:
+    nombre, extension = os.path.splitext(filename)
+    return extension == ".png" and len(nombre) == _LONGITUD_HASH and all(c in "0123456789abcdef" for c in nombre)
+
+
+def guardar_imagen(src_path: str) -> tuple:
+    """
+    Guarda la imagen en el almacén direccionado por contenido y devuelve (image_hash, ruta absoluta).
+    Si ya existe una imagen con los mismos píxeles, no se escribe nada y se reutiliza.
+    """
+    imagen = cv2.imread(src_path)
+    if imagen is None:
+        raise ValueError(f"No se pudo leer la imagen '{src_path}'")
+    image_hash = hash_de_pixeles(imagen)
+    destino = ruta_de_hash(image_hash)
+    if os.path.exists(destino):
+        print(f"INFO: Imagen ya presente en el almacén (deduplicada): {os.path.basename(destino)}", flush=True)
+        return image_hash, destino
+    os.makedirs(IMAGE_STORE_DIR, exist_ok=True)
+    tmp_path = f"{destino}.{os.getpid()}.tmp.png"
+    if src_path.lower().endswith(".png"):
+        shutil.copy(src_path, tmp_path)
+    else:
+        cv2.imwrite(tmp_path, imagen)
+    os.replace(tmp_path, destino) # Escritura atómica: nunca queda un archivo a medias con el nombre definitivo
+    print(f"INFO: Imagen guardada en el almacén: {os.path.basename(destino)}", flush=True)
+    return image_hash, destino
+
+
+def contar_referencias(km) -> dict:
+    """
+    Recorre la colección de elementos UI y devuelve {image_hash: [point_id, ...]}.
+    Los puntos sin image_hash se agrupan bajo la clave None.
+    """
+    referencias = {}
+    for point in _recorrer_puntos(km):
+        referencias.setdefault((point.payload or {}).get("image_hash"), []).append(point.id)
+    return referencias
+
+
+def _recorrer_puntos(km, por_pagina: int = 256):
+    offset = None
+    while True:
+        puntos, offset = km.client.scroll(collection_name=km.COLLECTION_NAME_UI_ELEMENTS, limit=por_pagina, offset=offset,
+                                          with_payload=True, with_vectors=False)
+        yield from puntos
+        if offset is None:
+            break
+
+
+def _hashes_en_diario() -> set:
+    """Imágenes referenciadas por altas que aún están en el diario de escrituras (todavía no en Qdrant)."""
+    try:
+        import kb_journal
+    except ImportError:
+        return set()
+    hashes = set()
+    for _, entrada in kb_journal.pendientes():
+        args = (entrada or {}).get("args", {})
+        metadata = args.get("metadata") or {}
+        payload = args.get("payload") or {}
+        for image_hash in (metadata.get("image_hash"), payload.get("image_hash")):
+            if image_hash:
+                hashes.add(image_hash)
+    return hashes
+
+
+def reconciliar(km, dry_run: bool = False, grace: float = IMAGE_STORE_GC_GRACE) -> dict:
+    """
+    Reconcilia el almacén de imágenes con la colección de elementos UI:
+    - Puntos antiguos (imagen con nombre uuid, sin image_hash): su imagen se importa al almacén y se actualiza el payload.
+    - Puntos cuya imagen ya no existe: se les quita image_path/image_hash, de modo que main.py los trate como
+      fallo de caché normal en lugar de descubrirlo al ir a hacer clic.
+    - Archivos del almacén sin ninguna referencia (y más antiguos que 'grace' segundos): se borran.
+    Devuelve un resumen con el número de cambios de cada tipo.
+    """
+    inicio = time.monotonic()
+    resumen = {"puntos": 0, "migrados": 0, "reparados": 0, "archivos_borrados": 0, "bytes_liberados": 0}
+    referenciados = _hashes_en_diario()
+
+    for point in _recorrer_puntos(km):
+        resumen["puntos"] += 1
+        payload = point.payload or {}
+        image_hash = payload.get("image_hash")
+        image_path = payload.get("image_path")
+
+        if image_hash and os.path.exists(ruta_de_hash(image_hash)):
+            referenciados.add(image_hash)
+            if image_path and ruta_absoluta(image_path) == ruta_de_hash(image_hash):
+                continue
+            nuevos = {"image_path": ruta_relativa(ruta_de_hash(image_hash))} # El archivo está, pero la ruta no apunta a él
+        elif image_path and os.path.exists(ruta_absoluta(image_path)):
+            try:
+                image_hash = hash_de_pixeles(cv2.imread(ruta_absoluta(image_path)))
+            except Exception as e:
+                print(f"WARNING: No se pudo leer la imagen '{image_path}' del punto {point.id}: {e}", flush=True)
+                continue
+            referenciados.add(image_hash)
+            if not dry_run:
+                guardar_imagen(ruta_absoluta(image_path))
+            nuevos = {"image_path": ruta_relativa(ruta_de_hash(image_hash)), "image_hash": image_hash}
+            resumen["migrados"] += 1
+        elif image_path or image_hash:
+            print(f"WARNING: La imagen del punto {point.id} ('{image_path}') no existe. Se marca para volver a aprenderla.", flush=True)
+            nuevos = {"image_path": None, "image_hash": None}
+            resumen["reparados"] += 1
+        else:
+            continue
+
+        if not dry_run:
+            km.client.set_payload(collection_name=km.COLLECTION_NAME_UI_ELEMENTS, payload=nuevos, points=[point.id], wait=True)
+
+    if os.path.isdir(IMAGE_STORE_DIR):
+        ahora = time.time()
+        for filename in os.listdir(IMAGE_STORE_DIR):
+            path = os.path.join(IMAGE_STORE_DIR, filename)
+            if not os.path.isfile(path) or ahora - os.path.getmtime(path) < grace:
+                continue
+            if es_nombre_de_hash(filename) and filename[:-4] in referenciados:
+                continue
+            resumen["archivos_borrados"] += 1
+            resumen["bytes_liberados"] += os.path.getsize(path)
+            if not dry_run:
+                os.remove(path)
+
+    print(f"INFO: Almacén de imágenes reconciliado en {time.monotonic() - inicio:.2f} s{' (simulación)' if dry_run else ''}: {resumen}", flush=True)
+    return resumen
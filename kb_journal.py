@@ -0,0 +1,312 @@
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+from datetime import datetime
+
+import portalocker
+
+# --- Configurar la codificación de la salida de la consola al inicio ---
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+except AttributeError:
+    pass
+except Exception as e:
+    print(f"WARNING: No se pudo reconfigurar la codificacion de la consola: {e}", flush=True)
+
+# --- Configuración ---
+# Si está activo, las escrituras en la base de conocimiento se anotan en un diario local y se
+# envían a Qdrant en segundo plano, en lugar de bloquear el clic esperando al servidor.
+KB_JOURNAL_ENABLED = os.getenv("KB_JOURNAL_ENABLED", "true").lower() == "true"
+KB_JOURNAL_DIR = os.getenv("KB_JOURNAL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "kb_journal"))
+KB_JOURNAL_FLUSH_INTERVAL = float(os.getenv("KB_JOURNAL_FLUSH_INTERVAL", "2")) # Segundos entre vaciados
+KB_JOURNAL_BATCH_SIZE = int(os.getenv("KB_JOURNAL_BATCH_SIZE", "100")) # Entradas por vaciado
+KB_JOURNAL_MAX_BACKOFF = float(os.getenv("KB_JOURNAL_MAX_BACKOFF", "60")) # Espera máxima entre reintentos (s)
+KB_JOURNAL_MAX_ATTEMPTS = int(os.getenv("KB_JOURNAL_MAX_ATTEMPTS", "20")) # Después, el lote se aparta a failed.jsonl
+KB_JOURNAL_COMPACT_BYTES = int(os.getenv("KB_JOURNAL_COMPACT_BYTES", str(1024 * 1024))) # Vaciar el diario al superar este tamaño
+
+JOURNAL_PATH = os.path.join(KB_JOURNAL_DIR, "journal.jsonl")
+OFFSET_PATH = os.path.join(KB_JOURNAL_DIR, "committed.offset")
+FAILED_PATH = os.path.join(KB_JOURNAL_DIR, "failed.jsonl")
+LOCK_PATH = os.path.join(KB_JOURNAL_DIR, ".lock")
+WORKER_LOCK_PATH = os.path.join(KB_JOURNAL_DIR, ".worker.lock")
+
+# Operaciones admitidas (cada una se aplica con la función por lotes equivalente de knowledge_manager)
+OPERACIONES = ("add_ui_element", "update_ui_element_payload", "add_task_flow")
+
+
+def _leer_offset() -> int:
+    try:
+        with open(OFFSET_PATH, "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def _escribir_offset(offset: int):
+    tmp_path = OFFSET_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(str(offset))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, OFFSET_PATH) # Escritura atómica
+
+
+def encolar(op: str, **args) -> str:
+    """
+    Anota una operación sobre la base de conocimiento en el diario (append + fsync) y vuelve enseguida.
+    Las operaciones deben ser idempotentes: por eso los IDs de punto se generan aquí, antes de escribir,
+    y un reintento tras un fallo o reinicio vuelve a escribir el mismo punto.
+    Devuelve el ID de la entrada del diario.
+    """
+    if op not in OPERACIONES:
+        raise ValueError(f"Operacion de diario desconocida: {op}")
+    os.makedirs(KB_JOURNAL_DIR, exist_ok=True)
+    entrada = {"id": uuid.uuid4().hex, "op": op, "args": args, "timestamp": datetime.now().isoformat()}
+    linea = (json.dumps(entrada, ensure_ascii=False) + "\n").encode("utf-8")
+    with portalocker.Lock(LOCK_PATH, timeout=10):
+        with open(JOURNAL_PATH, "ab") as f:
+            # Si una escritura anterior se interrumpió a mitad de línea, empezar en una línea nueva
+            if f.tell() > 0:
+                with open(JOURNAL_PATH, "rb") as r:
+                    r.seek(-1, os.SEEK_END)
+                    if r.read(1) != b"\n":
+                        f.write(b"\n")
+            f.write(linea)
+            f.flush()
+            os.fsync(f.fileno())
+    print(f"INFO: Operacion '{op}' anotada en el diario de la base de conocimiento.", flush=True)
+    return entrada["id"]
+
+
+def encolar_ui_element(description: str, element_type: str, image_path: str = None, ocr_text: str = None,
+                       metadata: dict = None, point_id: str = None) -> str:
+    """
+    Versión diferida de knowledge_manager.add_ui_element. Devuelve el ID del punto, que ya es
+    definitivo aunque el punto aún no esté en Qdrant.
+    """
+    point_id = point_id or uuid.uuid4().hex
+    encolar("add_ui_element", point_id=point_id, description=description, element_type=element_type,
+            image_path=image_path, ocr_text=ocr_text, metadata=metadata)
+    return point_id
+
+
+def pendientes(limite: int = None) -> list:
+    """
+    Devuelve las entradas aún no aplicadas como tuplas (offset_final, entrada), en orden.
+    Una última línea incompleta (escritura interrumpida) se ignora hasta que se complete.
+    """
+    resultado = []
+    try:
+        with open(JOURNAL_PATH, "rb") as f:
+            f.seek(_leer_offset())
+            while limite is None or len(resultado) < limite:
+                linea = f.readline()
+                if not linea or not linea.endswith(b"\n"):
+                    break
+                if linea.strip():
+                    try:
+                        resultado.append((f.tell(), json.loads(linea)))
+                        continue
+                    except json.JSONDecodeError:
+                        print(f"WARNING: Linea corrupta en el diario de la base de conocimiento. Se omite: {linea[:80]!r}", flush=True)
+                resultado.append((f.tell(), None))
+    except OSError:
+        pass
+    return resultado
+
+
+def _aplicar_grupo(km, op: str, entradas: list):
+    """
+    Aplica un grupo de entradas consecutivas de la misma operación con una sola llamada por lotes.
+    Lanza una excepción si el servidor no completó la escritura, para que se reintente.
+    """
+    if op == "add_ui_element":
+        ids = km.add_ui_elements([e["args"] for e in entradas], verify=False)
+        if not any(ids):
+            raise RuntimeError("add_ui_elements no escribio ningun punto")
+    elif op == "add_task_flow":
+        ids = km.add_task_flows([e["args"] for e in entradas])
+        if not any(ids):
+            raise RuntimeError("add_task_flows no escribio ningun punto")
+    elif op == "update_ui_element_payload":
+        for e in entradas:
+            if not km.update_ui_element_payload(e["args"]["point_id"], e["args"]["payload"]):
+                raise RuntimeError(f"No se pudo actualizar el payload de {e['args']['point_id']}")
+
+
+def _compactar_si_procede():
+    """
+    Cuando todo el diario está aplicado y ha crecido lo suficiente, se trunca (bajo el mismo lock que las escrituras).
+    """
+    with portalocker.Lock(LOCK_PATH, timeout=10):
+        try:
+            tamano = os.path.getsize(JOURNAL_PATH)
+        except OSError:
+            return
+        if tamano >= KB_JOURNAL_COMPACT_BYTES and _leer_offset() >= tamano:
+            # Primero el offset: si el proceso se cae entre los dos pasos, se reaplica el diario (idempotente)
+            # en lugar de saltarse las entradas nuevas
+            _escribir_offset(0)
+            with open(JOURNAL_PATH, "wb"):
+                pass
+            print("INFO: Diario de la base de conocimiento compactado.", flush=True)
+
+
+class JournalWorker:
+    """
+    Hilo en segundo plano que vacía el diario hacia la base de conocimiento por lotes. Agrupa las
+    entradas consecutivas de la misma operación, reintenta con espera exponencial si Qdrant está
+    lento o caído y solo avanza el offset confirmado cuando la escritura se completa, de modo que
+    nada se pierde si el proceso se cae. Solo un proceso a la vez vacía el diario.
+    """
+
+    def __init__(self, km, intervalo: float = KB_JOURNAL_FLUSH_INTERVAL):
+        self.km = km
+        self.intervalo = intervalo
+        self._stop = threading.Event()
+        self._despertar = threading.Event()
+        self._thread = None
+        self._worker_lock = None
+        self._intentos = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> bool:
+        if self.running:
+            return True
+        os.makedirs(KB_JOURNAL_DIR, exist_ok=True)
+        try:
+            self._worker_lock = portalocker.Lock(WORKER_LOCK_PATH, timeout=0, fail_when_locked=True)
+            self._worker_lock.acquire()
+        except portalocker.exceptions.LockException:
+            print("INFO: Otro proceso ya está vaciando el diario de la base de conocimiento.", flush=True)
+            self._worker_lock = None
+            return False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="KBJournalWorker", daemon=True)
+        self._thread.start()
+        print(f"INFO: Worker del diario de la base de conocimiento iniciado (cada {self.intervalo} s).", flush=True)
+        return True
+
+    def stop(self, vaciar: bool = True, timeout: float = 10.0):
+        """
+        Detiene el worker. Con vaciar=True intenta aplicar lo pendiente antes de salir (sin pasar de 'timeout').
+        """
+        self._stop.set()
+        self._despertar.set()
+        if self._thread:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        if vaciar and self._worker_lock: # Solo el proceso que tiene el lock del worker escribe el offset
+            limite = time.monotonic() + timeout
+            try:
+                while time.monotonic() < limite and self.vaciar():
+                    pass
+            except Exception as e:
+                print(f"WARNING: No se pudo vaciar el diario al salir. Se reintentará en la próxima ejecución: {e}", flush=True)
+        if self._worker_lock:
+            self._worker_lock.release()
+            self._worker_lock = None
+
+    def avisar(self):
+        """Pide un vaciado inmediato (p. ej. justo después de encolar)."""
+        self._despertar.set()
+
+    def vaciar(self) -> int:
+        """
+        Aplica un lote de entradas pendientes. Devuelve cuántas se aplicaron (0 si no había nada).
+        """
+        lote = pendientes(KB_JOURNAL_BATCH_SIZE)
+        if not lote:
+            _compactar_si_procede()
+            return 0
+        try:
+            i = 0
+            while i < len(lote):
+                offset_final, entrada = lote[i]
+                if entrada is None or entrada.get("op") not in OPERACIONES:
+                    _escribir_offset(offset_final) # Línea corrupta u operación desconocida: saltarla
+                    i += 1
+                    continue
+                grupo = [entrada]
+                while i + len(grupo) < len(lote) and lote[i + len(grupo)][1] and lote[i + len(grupo)][1].get("op") == entrada["op"]:
+                    grupo.append(lote[i + len(grupo)][1])
+                _aplicar_grupo(self.km, entrada["op"], grupo)
+                i += len(grupo)
+                _escribir_offset(lote[i - 1][0])
+            self._intentos = 0
+            print(f"INFO: {len(lote)} operaciones del diario aplicadas a la base de conocimiento.", flush=True)
+            return len(lote)
+        except Exception:
+            self._intentos += 1
+            if self._intentos >= KB_JOURNAL_MAX_ATTEMPTS:
+                self._apartar(lote)
+                self._intentos = 0
+            raise
+
+    def _apartar(self, lote: list):
+        """
+        Mueve a failed.jsonl las entradas que fallan una y otra vez, para que no bloqueen el resto del diario.
+        """
+        inicio = _leer_offset()
+        aparcadas = [e for off, e in lote if off > inicio and e is not None]
+        with open(FAILED_PATH, "a", encoding="utf-8") as f:
+            for entrada in aparcadas:
+                f.write(json.dumps(entrada, ensure_ascii=False) + "\n")
+        _escribir_offset(lote[-1][0])
+        print(f"ERROR: {len(aparcadas)} operaciones del diario fallaron {KB_JOURNAL_MAX_ATTEMPTS} veces. Apartadas en '{FAILED_PATH}'.", flush=True)
+
+    def _run(self):
+        espera = self.intervalo
+        while not self._stop.is_set():
+            self._despertar.wait(espera)
+            self._despertar.clear()
+            if self._stop.is_set():
+                break
+            try:
+                while self.vaciar() and not self._stop.is_set():
+                    pass
+                espera = self.intervalo
+            except Exception as e:
+                espera = min(max(espera, 1.0) * 2, KB_JOURNAL_MAX_BACKOFF)
+                print(f"WARNING: No se pudo vaciar el diario de la base de conocimiento ({e}). Reintento en {espera:.0f} s.", flush=True)
+
+
+_worker = None
+
+
+def get_worker(km, start: bool = KB_JOURNAL_ENABLED):
+    """
+    Devuelve el worker del proceso (creándolo si hace falta). Con start=True lo arranca.
+    """
+    global _worker
+    if _worker is None:
+        _worker = JournalWorker(km)
+    if start:
+        _worker.start()
+    return _worker
+
+
+if __name__ == "__main__":
+    # Vaciado manual del diario: python kb_journal.py
+    import knowledge_manager
+
+    print(f"INFO: {len(pendientes())} operaciones pendientes en '{JOURNAL_PATH}'.", flush=True)
+    worker = JournalWorker(knowledge_manager)
+    total = 0
+    try:
+        while True:
+            aplicadas = worker.vaciar()
+            if not aplicadas:
+                break
+            total += aplicadas
+    except Exception as e:
+        print(f"ERROR: Fallo al vaciar el diario: {e}", flush=True)
+        sys.exit(1)
+    print(f"INFO: {total} operaciones aplicadas.", flush=True)
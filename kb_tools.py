@@ -0,0 +1,744 @@
+import os
+import sys
+import json
+import time
+import ntpath
+import tarfile
+import asyncio
+import argparse
+import tempfile
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from qdrant_client.http import models
+
+# --- Configurar la codificación de la salida de la consola al inicio ---
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+except AttributeError:
+    pass
+except Exception as e:
+    print(f"WARNING: No se pudo reconfigurar la codificacion de la consola: {e}", flush=True)
+
+import knowledge_manager as km
+import image_store
+import embedding_runtime
+
+
+KB_COMPACT_THRESHOLD = float(os.getenv("KB_COMPACT_THRESHOLD", "0.95")) # Similitud coseno a partir de la cual dos elementos son el mismo
+KB_IMPORT_WORKERS = int(os.getenv("KB_IMPORT_WORKERS", "4")) # Upserts en paralelo al importar (solo contra el servidor Qdrant)
+_FORMATO_SNAPSHOT = 1
+# Limpieza por uso: se borran los elementos sin usar en KB_EVICT_DAYS días y se degradan los que fallan a menudo
+KB_EVICT_DAYS = float(os.getenv("KB_EVICT_DAYS", "90"))
+KB_DEMOTE_MIN_FAILURES = int(os.getenv("KB_DEMOTE_MIN_FAILURES", "3"))
+KB_DEMOTE_RELIABILITY = float(os.getenv("KB_DEMOTE_RELIABILITY", "0.35")) # Fiabilidad por debajo de la cual se degrada
+# Un elemento ya degradado que acumula este número de fallos (y sigue por debajo de la fiabilidad) se borra
+KB_EVICT_MIN_FAILURES = int(os.getenv("KB_EVICT_MIN_FAILURES", str(2 * KB_DEMOTE_MIN_FAILURES)))
+# Frecuencia de la limpieza automática al arrancar main.py (0 = solo manual con 'kb_tools.py evict')
+KB_CLEANUP_INTERVAL_HOURS = float(os.getenv("KB_CLEANUP_INTERVAL_HOURS", "24"))
+_MARCA_LIMPIEZA = os.path.join(km.KM_LOCAL_PATH, ".ultima_limpieza_uso")
+_MARCA_RECONCILIACION = os.path.join(km.KM_LOCAL_PATH, ".ultima_reconciliacion_imagenes")
+
+
+def _recorrer(collection_name: str, with_vectors: bool = False, por_pagina: int = 256):
+    offset = None
+    while True:
+        pagina, offset = km.client.scroll(collection_name=collection_name, limit=por_pagina, offset=offset,
+                                          with_payload=True, with_vectors=with_vectors)
+        yield from pagina
+        if offset is None:
+            return
+
+
+def _todos_los_puntos(collection_name: str, with_vectors: bool = False, por_pagina: int = 256) -> list:
+    return list(_recorrer(collection_name, with_vectors, por_pagina))
+
+
+def _grupos_de_duplicados(vectores: np.ndarray, umbral: float, bloque: int = 1024) -> list:
+    """
+    Agrupa (union-find) los índices cuyos vectores tienen similitud coseno >= umbral.
+    La matriz de similitudes se calcula por bloques para no ocupar n² de memoria.
+    """
+    padre = list(range(len(vectores)))
+
+    def raiz(i):
+        while padre[i] != i:
+            padre[i] = padre[padre[i]]
+            i = padre[i]
+        return i
+
+    normas = np.linalg.norm(vectores, axis=1, keepdims=True)
+    vectores = vectores / np.where(normas > 0, normas, 1.0)
+    for inicio in range(0, len(vectores), bloque):
+        similitudes = vectores[inicio:inicio + bloque] @ vectores.T
+        for i, j in zip(*np.nonzero(similitudes >= umbral)):
+            a, b = raiz(inicio + int(i)), raiz(int(j))
+            if a != b:
+                padre[b] = a
+    grupos = {}
+    for i in range(len(vectores)):
+        grupos.setdefault(raiz(i), []).append(i)
+    return [g for g in grupos.values() if len(g) > 1]
+
+
+def _prioridad_superviviente(point):
+    """Se conserva el punto con imagen existente y, entre ellos, el más reciente."""
+    payload = point.payload or {}
+    image_path = payload.get("image_path")
+    tiene_imagen = bool(image_path) and os.path.exists(image_store.ruta_absoluta(image_path))
+    return (tiene_imagen, payload.get("timestamp", ""))
+
+
+def compactar_duplicados(umbral: float = KB_COMPACT_THRESHOLD, dry_run: bool = False) -> dict:
+    """
+    Fusiona los elementos UI casi duplicados (mismo tipo y aplicación, similitud coseno >= umbral) creados
+    antes de los IDs deterministas. En cada grupo se conserva un punto, se le añaden las descripciones de
+    los demás como 'aliases' y se borran el resto. Las imágenes que queden sin referencias las limpia 'gc'.
+    """
+    puntos = _todos_los_puntos(km.COLLECTION_NAME_UI_ELEMENTS, with_vectors=True)
+    por_clase = {}
+    for point in puntos:
+        payload = point.payload or {}
+        por_clase.setdefault((payload.get("type"), payload.get("app")), []).append(point)
+
+    resumen = {"puntos": len(puntos), "grupos": 0, "borrados": 0}
+    for (tipo, app), clase in por_clase.items():
+        vectores = np.asarray([km.vector_de_texto(p) for p in clase], dtype=np.float32)
+        for grupo in _grupos_de_duplicados(vectores, umbral):
+            miembros = sorted((clase[i] for i in grupo), key=_prioridad_superviviente, reverse=True)
+            superviviente, duplicados = miembros[0], miembros[1:]
+            descripciones = {(p.payload or {}).get("description") for p in miembros}
+            aliases = sorted(d for d in descripciones | set((superviviente.payload or {}).get("aliases", []))
+                             if d and d != (superviviente.payload or {}).get("description"))
+            print(f"INFO: [{tipo}/{app or '-'}] '{(superviviente.payload or {}).get('description')}' absorbe {len(duplicados)} duplicados: "
+                  f"{[(p.payload or {}).get('description') for p in duplicados]}", flush=True)
+            resumen["grupos"] += 1
+            resumen["borrados"] += len(duplicados)
+            if dry_run:
+                continue
+            if aliases:
+                km.client.set_payload(collection_name=km.COLLECTION_NAME_UI_ELEMENTS, payload={"aliases": aliases},
+                                      points=[superviviente.id], wait=True)
+            km.client.delete(collection_name=km.COLLECTION_NAME_UI_ELEMENTS,
+                             points_selector=models.PointIdsList(points=[p.id for p in duplicados]), wait=True)
+
+    print(f"INFO: Compactación de elementos UI{' (simulación)' if dry_run else ''}: {resumen}", flush=True)
+    return resumen
+
+
+def migrar_perfil(perfil: str, dry_run: bool = False):
+    """
+    Aplica un perfil de almacenamiento a la colección de elementos UI existente sin recrearla:
+    Qdrant reconstruye en segundo plano la cuantización, el HNSW y el almacenamiento de los vectores,
+    y la colección sigue atendiendo búsquedas mientras tanto.
+    """
+    config = km.PERFILES_COLECCION[perfil]
+    actual = km.client.get_collection(collection_name=km.COLLECTION_NAME_UI_ELEMENTS)
+    print(f"INFO: Configuración actual de '{km.COLLECTION_NAME_UI_ELEMENTS}': {getattr(actual, 'config', actual)}", flush=True)
+    cambios = {
+        "vectors_config": {nombre: models.VectorParamsDiff(on_disk=config["on_disk"])
+                           for nombre in km.vectores_de_coleccion(km.COLLECTION_NAME_UI_ELEMENTS)},
+        "hnsw_config": config["hnsw_config"] or models.HnswConfigDiff(on_disk=False),
+        "quantization_config": config["quantization_config"] or models.Disabled.DISABLED,
+    }
+    print(f"INFO: Cambios para el perfil '{perfil}': {cambios}", flush=True)
+    if dry_run:
+        return
+    if not hasattr(km.client, "update_collection"):
+        print(f"WARNING: El backend '{km.KM_BACKEND}' no admite perfiles de almacenamiento (búsqueda exacta en memoria). Nada que migrar.", flush=True)
+        return
+    km.client.update_collection(collection_name=km.COLLECTION_NAME_UI_ELEMENTS, **cambios)
+    print(f"INFO: Perfil '{perfil}' aplicado. Usa KM_COLLECTION_PROFILE={perfil} para que las búsquedas usen sus parámetros.", flush=True)
+
+
+def _reconstruir_con_vector_imagen():
+    """
+    Qdrant no permite añadir un vector con nombre a una colección existente: se copia la colección de elementos UI
+    a una de respaldo, se recrea con la configuración actual (texto + imagen) y se vuelven a subir los puntos.
+    Si algo falla a mitad, los puntos siguen en la colección de respaldo.
+    """
+    respaldo = f"{km.COLLECTION_NAME_UI_ELEMENTS}_respaldo"
+    puntos = _todos_los_puntos(km.COLLECTION_NAME_UI_ELEMENTS, with_vectors=True)
+    structs = [models.PointStruct(id=p.id, vector={"": km.vector_de_texto(p)}, payload=p.payload or {}) for p in puntos]
+    if km.client.collection_exists(collection_name=respaldo):
+        km.client.delete_collection(collection_name=respaldo)
+    km.client.create_collection(collection_name=respaldo,
+                                vectors_config=models.VectorParams(size=km.EMBEDDING_DIM, distance=models.Distance.COSINE))
+    if structs and not km._upsert_por_lotes(respaldo, structs):
+        raise RuntimeError(f"No se pudo copiar la colección a '{respaldo}'. No se ha modificado nada.")
+    km.client.delete_collection(collection_name=km.COLLECTION_NAME_UI_ELEMENTS)
+    km.create_collections()
+    if structs and not km._upsert_por_lotes(km.COLLECTION_NAME_UI_ELEMENTS, structs):
+        raise RuntimeError(f"No se pudieron restaurar los puntos. Siguen en la colección '{respaldo}'.")
+    km.client.delete_collection(collection_name=respaldo)
+    print(f"INFO: Colección '{km.COLLECTION_NAME_UI_ELEMENTS}' recreada con el vector de imagen ({len(structs)} puntos).", flush=True)
+
+
+def añadir_vectores_imagen(dry_run: bool = False, todos: bool = False) -> dict:
+    """
+    Calcula el vector de imagen de los elementos UI que tienen imagen de referencia y aún no lo tienen
+    (o de todos, con 'todos', p. ej. tras cambiar IMAGE_EMBEDDING_MODEL). Si la colección es anterior al
+    vector de imagen, primero la recrea con él.
+    """
+    if not km.image_embedding.IMAGE_EMBEDDING_ENABLED:
+        print("ERROR: IMAGE_EMBEDDING_ENABLED=false. Actívalo para usar vectores de imagen.", flush=True)
+        return {}
+    if km.IMAGE_VECTOR_NAME not in km.vectores_de_coleccion(km.COLLECTION_NAME_UI_ELEMENTS):
+        print(f"INFO: La colección '{km.COLLECTION_NAME_UI_ELEMENTS}' no tiene vector de imagen: hay que recrearla.", flush=True)
+        if dry_run:
+            return {"recrear": True}
+        _reconstruir_con_vector_imagen()
+
+    pendientes = []
+    for point in _todos_los_puntos(km.COLLECTION_NAME_UI_ELEMENTS, with_vectors=True):
+        vector_imagen = point.vector.get(km.IMAGE_VECTOR_NAME) if isinstance(point.vector, dict) else None
+        if (point.payload or {}).get("image_path") and (todos or not vector_imagen or not any(vector_imagen)):
+            pendientes.append(point)
+    resumen = {"pendientes": len(pendientes), "actualizados": 0}
+    if not dry_run:
+        lote = km.image_embedding.IMAGE_EMBEDDING_BATCH_SIZE
+        for inicio in range(0, len(pendientes), lote):
+            grupo = pendientes[inicio:inicio + lote]
+            vectores = km._vectores_imagen([p.payload["image_path"] for p in grupo])
+            actualizar = [models.PointVectors(id=p.id, vector={km.IMAGE_VECTOR_NAME: v}) for p, v in zip(grupo, vectores) if v]
+            if actualizar:
+                km.client.update_vectors(collection_name=km.COLLECTION_NAME_UI_ELEMENTS, points=actualizar, wait=True)
+            resumen["actualizados"] += len(actualizar)
+    print(f"INFO: Vectores de imagen de elementos UI{' (simulación)' if dry_run else ''}: {resumen}", flush=True)
+    return resumen
+
+
+def _esperar_indexado(collection_name: str, timeout: float = 300.0):
+    inicio = time.monotonic()
+    while time.monotonic() - inicio < timeout:
+        info = km.client.get_collection(collection_name=collection_name)
+        if getattr(info, "status", models.CollectionStatus.GREEN) == models.CollectionStatus.GREEN: # El almacén NumPy no indexa
+            return
+        time.sleep(0.5)
+    print(f"WARNING: '{collection_name}' sigue optimizándose tras {timeout:.0f} s. Los resultados pueden no ser representativos.", flush=True)
+
+
+def benchmark_perfiles(perfiles: list, n_consultas: int = 200, limit: int = 10, sinteticos: int = 0, ruido: float = 0.05) -> list:
+    """
+    Compara recall@k y latencia de búsqueda entre perfiles. Copia los vectores de la colección de elementos UI
+    (más 'sinteticos' vectores aleatorios, para simular una biblioteca mayor) a una colección temporal por perfil
+    y lanza las mismas consultas (vectores existentes con ruido) contra todas. La verdad de referencia es la
+    búsqueda exacta en NumPy.
+    """
+    rng = np.random.default_rng(0)
+    vectores = [km.vector_de_texto(p) for p in _todos_los_puntos(km.COLLECTION_NAME_UI_ELEMENTS, with_vectors=True) if p.vector]
+    base = np.asarray(vectores, dtype=np.float32).reshape(-1, km.EMBEDDING_DIM)
+    if sinteticos:
+        base = np.vstack([base, rng.standard_normal((sinteticos, km.EMBEDDING_DIM)).astype(np.float32)])
+    if len(base) == 0:
+        print("ERROR: No hay vectores para el benchmark. Usa --synthetic N.", flush=True)
+        return []
+    base /= np.linalg.norm(base, axis=1, keepdims=True)
+    consultas = base[rng.integers(0, len(base), n_consultas)] + rng.normal(0, ruido, (n_consultas, km.EMBEDDING_DIM)).astype(np.float32)
+    consultas /= np.linalg.norm(consultas, axis=1, keepdims=True)
+    k = min(limit, len(base))
+    verdad = np.argsort(-(consultas @ base.T), axis=1)[:, :k]
+
+    resultados = []
+    for perfil in perfiles:
+        coleccion = f"bench_{perfil}"
+        if km.client.collection_exists(collection_name=coleccion):
+            km.client.delete_collection(collection_name=coleccion)
+        km.client.create_collection(collection_name=coleccion, **km.configuracion_coleccion(perfil))
+        try:
+            for inicio in range(0, len(base), km.KM_UPSERT_BATCH_SIZE):
+                km.client.upsert(collection_name=coleccion, wait=True, points=[
+                    models.PointStruct(id=inicio + i, vector={"": v.tolist()}, payload={})
+                    for i, v in enumerate(base[inicio:inicio + km.KM_UPSERT_BATCH_SIZE])])
+            _esperar_indexado(coleccion)
+
+            latencias, aciertos = [], 0
+            for consulta, esperados in zip(consultas, verdad):
+                t0 = time.perf_counter()
+                hits = km.client.query_points(collection_name=coleccion, query=consulta.tolist(), limit=k,
+                                              search_params=km.parametros_busqueda(perfil), with_payload=False).points
+                latencias.append((time.perf_counter() - t0) * 1000)
+                aciertos += len({int(h.id) for h in hits} & set(esperados.tolist()))
+            resultado = {
+                "perfil": perfil,
+                "vectores": len(base),
+                f"recall@{k}": round(aciertos / (k * n_consultas), 4),
+                "p50_ms": round(float(np.percentile(latencias, 50)), 2),
+                "p95_ms": round(float(np.percentile(latencias, 95)), 2),
+            }
+            print(f"INFO: {resultado}", flush=True)
+            resultados.append(resultado)
+        finally:
+            km.client.delete_collection(collection_name=coleccion)
+    return resultados
+
+
+def _percentiles(latencias: list) -> dict:
+    return {"p50_ms": round(float(np.percentile(latencias, 50)), 2), "p95_ms": round(float(np.percentile(latencias, 95)), 2)}
+
+
+def medir_transportes(transportes: list, n_puntos: int = 500, n_consultas: int = 200, concurrencia: int = 8) -> list:
+    """
+    Compara la latencia de REST y gRPC contra el servidor Qdrant con el patrón de knowledge_manager: upserts de un
+    punto con wait=True (aprender un elemento), upserts en lote, consultas con filtro por 'type' y payload, y las
+    mismas consultas lanzadas de 'concurrencia' en 'concurrencia' con el cliente asíncrono. Usa una colección temporal.
+    """
+    if km.KM_BACKEND != "qdrant":
+        print(f"ERROR: El benchmark de transporte necesita el servidor Qdrant (KM_BACKEND actual: {km.KM_BACKEND}).", flush=True)
+        return []
+    rng = np.random.default_rng(0)
+    vectores = rng.standard_normal((n_puntos, km.EMBEDDING_DIM)).astype(np.float32)
+    vectores /= np.linalg.norm(vectores, axis=1, keepdims=True)
+    consultas = vectores[rng.integers(0, n_puntos, n_consultas)].tolist()
+    tipos = ["icono", "botón", "campo_entrada", "pestaña"]
+    coleccion = "bench_transporte"
+
+    def punto(i):
+        return models.PointStruct(id=i, vector={"": vectores[i].tolist()},
+                                  payload={"description": f"elemento {i}", "type": tipos[i % len(tipos)]})
+
+    def filtro(i):
+        return models.Filter(must=[models.FieldCondition(key="type", match=models.MatchValue(value=tipos[i % len(tipos)]))])
+
+    async def consultas_concurrentes(cliente_async):
+        semaforo = asyncio.Semaphore(concurrencia)
+
+        async def una(i, consulta):
+            async with semaforo:
+                await cliente_async.query_points(collection_name=coleccion, query=consulta, query_filter=filtro(i), limit=5, with_payload=True)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(una(i, c) for i, c in enumerate(consultas)))
+        total = time.perf_counter() - t0
+        await cliente_async.close()
+        return total
+
+    resultados = []
+    for transporte in transportes:
+        cliente = km.crear_cliente("qdrant", transporte=transporte)
+        if cliente.collection_exists(collection_name=coleccion):
+            cliente.delete_collection(collection_name=coleccion)
+        cliente.create_collection(collection_name=coleccion, **km.configuracion_coleccion())
+        try:
+            individuales = []
+            for i in range(min(n_puntos, 100)):
+                t0 = time.perf_counter()
+                cliente.upsert(collection_name=coleccion, points=[punto(i)], wait=True)
+                individuales.append((time.perf_counter() - t0) * 1000)
+            t0 = time.perf_counter()
+            for inicio in range(0, n_puntos, km.KM_UPSERT_BATCH_SIZE):
+                cliente.upsert(collection_name=coleccion, wait=True,
+                               points=[punto(i) for i in range(inicio, min(inicio + km.KM_UPSERT_BATCH_SIZE, n_puntos))])
+            lote_s = time.perf_counter() - t0
+
+            busquedas = []
+            for i, consulta in enumerate(consultas):
+                t0 = time.perf_counter()
+                cliente.query_points(collection_name=coleccion, query=consulta, query_filter=filtro(i), limit=5, with_payload=True)
+                busquedas.append((time.perf_counter() - t0) * 1000)
+            concurrente_s = asyncio.run(consultas_concurrentes(km.crear_cliente("qdrant", transporte=transporte, asincrono=True)))
+
+            resultado = {
+                "transporte": transporte,
+                "upsert_1": _percentiles(individuales),
+                "upsert_lote_puntos_s": round(n_puntos / lote_s, 1),
+                "busqueda": _percentiles(busquedas),
+                f"busqueda_async_x{concurrencia}_qps": round(n_consultas / concurrente_s, 1),
+            }
+            print(f"INFO: {resultado}", flush=True)
+            resultados.append(resultado)
+        finally:
+            cliente.delete_collection(collection_name=coleccion)
+            cliente.close()
+    return resultados
+
+
+def comprobar_paridad(muestras: int = 200, umbral: float = embedding_runtime.EMBEDDING_PARITY_MIN) -> dict:
+    """
+    Vuelve a codificar (sin caché) las descripciones de una muestra de elementos UI con el runtime configurado
+    y las compara con los vectores guardados. Hay que pasarla antes de cambiar EMBEDDING_BACKEND en producción.
+    """
+    puntos = _todos_los_puntos(km.COLLECTION_NAME_UI_ELEMENTS, with_vectors=True)
+    if len(puntos) > muestras:
+        indices = np.random.default_rng(0).choice(len(puntos), size=muestras, replace=False)
+        puntos = [puntos[i] for i in indices]
+    return embedding_runtime.verificar_paridad(km.obtener_modelo(), puntos, umbral=umbral)
+
+
+def _nombre_imagen(payload: dict) -> str | None:
+    """
+    Nombre de la imagen de referencia dentro de la instantánea: el hash de contenido si lo hay o, para puntos
+    antiguos, el nombre del archivo (las rutas pueden ser absolutas de Windows, de ahí ntpath, que admite / y \\).
+    """
+    if payload.get("image_hash"):
+        return f"{payload['image_hash']}.png"
+    if payload.get("image_path"):
+        return ntpath.basename(payload["image_path"])
+    return None
+
+
+def _ruta_local_imagen(payload: dict) -> str | None:
+    if payload.get("image_hash") and os.path.exists(image_store.ruta_de_hash(payload["image_hash"])):
+        return image_store.ruta_de_hash(payload["image_hash"])
+    if payload.get("image_path"):
+        if os.path.exists(image_store.ruta_absoluta(payload["image_path"])):
+            return image_store.ruta_absoluta(payload["image_path"])
+        # Ruta absoluta de otro equipo (p. ej. C:\Users\...\qdrant_ui_cache\x.png): buscarla en el almacén local
+        en_almacen = os.path.join(image_store.IMAGE_STORE_DIR, ntpath.basename(payload["image_path"]))
+        if os.path.exists(en_almacen):
+            return en_almacen
+    return None
+
+
+def _vectores_a_exportar(vector):
+    """Vectores de un punto para la instantánea, sin los vectores con nombre vacíos (el almacén NumPy los rellena con ceros)."""
+    if isinstance(vector, dict):
+        return {nombre: v for nombre, v in vector.items() if v and any(v)}
+    return {"": vector}
+
+
+def _añadir_miembro(tar, nombre: str, archivo):
+    """Añade un archivo abierto (posicionado al final) al tar con el nombre indicado."""
+    info = tarfile.TarInfo(nombre)
+    info.size = archivo.tell()
+    info.mtime = time.time()
+    archivo.seek(0)
+    tar.addfile(info, archivo)
+
+
+def exportar_base(destino: str, con_imagenes: bool = True) -> dict:
+    """
+    Vuelca la base de conocimiento (elementos UI y flujos de tareas, con vectores y payloads) y las imágenes
+    de referencia a un único .tar.gz. Los puntos se leen por páginas y se escriben línea a línea (JSONL),
+    así que la memoria no crece con el tamaño de la colección. Orden dentro del archivo: manifest.json,
+    images/, y los JSONL de cada colección, para que la importación pueda procesarlo en un solo paso.
+    """
+    inicio = time.monotonic()
+    try:
+        import kb_journal
+        if kb_journal.pendientes():
+            print(f"WARNING: Hay {len(kb_journal.pendientes())} escrituras en el diario que aún no están en la colección y no se exportarán. "
+                  "Ejecuta 'python kb_journal.py' antes para incluirlas.", flush=True)
+    except ImportError:
+        pass
+
+    colecciones = [km.COLLECTION_NAME_UI_ELEMENTS, km.COLLECTION_NAME_TASK_FLOWS]
+    manifiesto = {
+        "formato": _FORMATO_SNAPSHOT,
+        "fecha": datetime.now().isoformat(),
+        "embedding_model": km.EMBEDDING_MODEL_NAME,
+        "embedding_dim": km.EMBEDDING_DIM,
+        "image_embedding_model": km.image_embedding.IMAGE_EMBEDDING_MODEL if km.tiene_vector_imagen() else None,
+        "image_embedding_dim": km.image_embedding.IMAGE_EMBEDDING_DIM if km.tiene_vector_imagen() else None,
+        "colecciones": {c: km.client.count(collection_name=c, exact=True).count for c in colecciones},
+    }
+
+    imagenes, faltan = {}, 0
+    if con_imagenes:
+        for point in _recorrer(km.COLLECTION_NAME_UI_ELEMENTS):
+            payload = point.payload or {}
+            nombre = _nombre_imagen(payload)
+            if not nombre or nombre in imagenes:
+                continue
+            ruta = _ruta_local_imagen(payload)
+            if ruta:
+                imagenes[nombre] = ruta
+            else:
+                faltan += 1
+    manifiesto["imagenes"] = len(imagenes)
+
+    with tarfile.open(destino, "w:gz") as tar:
+        with tempfile.TemporaryFile() as tmp:
+            tmp.write(json.dumps(manifiesto, ensure_ascii=False, indent=2).encode("utf-8"))
+            _añadir_miembro(tar, "manifest.json", tmp)
+        for nombre, ruta in imagenes.items():
+            tar.add(ruta, arcname=f"images/{nombre}")
+        for coleccion in colecciones:
+            with tempfile.TemporaryFile() as tmp:
+                for point in _recorrer(coleccion, with_vectors=True):
+                    linea = {"id": point.id, "vector": _vectores_a_exportar(point.vector), "payload": point.payload or {}}
+                    tmp.write(json.dumps(linea, ensure_ascii=False).encode("utf-8") + b"\n")
+                _añadir_miembro(tar, f"{coleccion}.jsonl", tmp)
+
+    resumen = dict(manifiesto["colecciones"], imagenes=len(imagenes), imagenes_no_encontradas=faltan,
+                   bytes=os.path.getsize(destino))
+    print(f"INFO: Base de conocimiento exportada a '{destino}' en {time.monotonic() - inicio:.2f} s: {resumen}", flush=True)
+    return resumen
+
+
+def _vector_a_importar(coleccion: str, vectores: dict, con_imagen: bool):
+    if coleccion != km.COLLECTION_NAME_UI_ELEMENTS:
+        return vectores[""]
+    if con_imagen and vectores.get(km.IMAGE_VECTOR_NAME):
+        return {"": vectores[""], km.IMAGE_VECTOR_NAME: vectores[km.IMAGE_VECTOR_NAME]}
+    return {"": vectores[""]}
+
+
+def _payload_a_importar(payload: dict, imagenes: set) -> dict:
+    """Reescribe image_path para que apunte al almacén de imágenes de este equipo."""
+    nombre = _nombre_imagen(payload)
+    if not nombre:
+        return payload
+    if nombre in imagenes:
+        return dict(payload, image_path=image_store.ruta_relativa(os.path.join(image_store.IMAGE_STORE_DIR, nombre)))
+    # Sin imagen en la instantánea: se trata como fallo de caché y se vuelve a aprender (igual que 'gc')
+    return dict(payload, image_path=None, image_hash=None)
+
+
+def importar_base(origen: str, reemplazar: bool = False, workers: int = KB_IMPORT_WORKERS) -> dict:
+    """
+    Carga una instantánea creada con exportar_base. Las imágenes se copian al almacén de imágenes (sin pisar
+    las que ya existan), image_path se reescribe hacia él y los puntos se suben en lotes de KM_UPSERT_BATCH_SIZE,
+    varios a la vez contra el servidor Qdrant. Con IDs deterministas, importar sobre una base existente fusiona:
+    los elementos comunes se actualizan en lugar de duplicarse. Con 'reemplazar' se vacían antes las colecciones.
+    """
+    inicio = time.monotonic()
+    if km.KM_BACKEND != "qdrant":
+        workers = 1 # Los almacenes embebidos serializan las escrituras de todas formas
+    resumen = {"imagenes": 0, "imagenes_existentes": 0}
+    imagenes = set()
+    with tarfile.open(origen, "r|gz") as tar, ThreadPoolExecutor(max_workers=workers) as pool:
+        manifiesto = None
+        for miembro in tar:
+            if miembro.name == "manifest.json":
+                manifiesto = json.load(tar.extractfile(miembro))
+                if manifiesto.get("formato") != _FORMATO_SNAPSHOT:
+                    raise ValueError(f"Formato de instantánea no soportado: {manifiesto.get('formato')}")
+                if manifiesto["embedding_model"] != km.EMBEDDING_MODEL_NAME or manifiesto["embedding_dim"] != km.EMBEDDING_DIM:
+                    raise ValueError(f"La instantánea usa el modelo '{manifiesto['embedding_model']}' ({manifiesto['embedding_dim']} dim.) "
+                                     f"y esta instalación '{km.EMBEDDING_MODEL_NAME}' ({km.EMBEDDING_DIM} dim.): los vectores no son compatibles.")
+                con_imagen = (km.tiene_vector_imagen() and manifiesto.get("image_embedding_model") == km.image_embedding.IMAGE_EMBEDDING_MODEL
+                              and manifiesto.get("image_embedding_dim") == km.image_embedding.IMAGE_EMBEDDING_DIM)
+                if km.tiene_vector_imagen() and not con_imagen:
+                    print("WARNING: La instantánea no trae vectores de imagen compatibles. Calcúlalos después con: python kb_tools.py image-vectors", flush=True)
+                print(f"INFO: Instantánea del {manifiesto['fecha']}: {manifiesto['colecciones']}, {manifiesto.get('imagenes', 0)} imágenes.", flush=True)
+                if reemplazar:
+                    for coleccion in manifiesto["colecciones"]:
+                        if km.client.collection_exists(collection_name=coleccion):
+                            km.client.delete_collection(collection_name=coleccion)
+                    km.create_collections()
+            elif manifiesto is None:
+                raise ValueError(f"'{origen}' no es una instantánea de la base de conocimiento (falta manifest.json al principio).")
+            elif miembro.name.startswith("images/") and miembro.isfile():
+                nombre = os.path.basename(miembro.name)
+                destino = os.path.join(image_store.IMAGE_STORE_DIR, nombre)
+                imagenes.add(nombre)
+                if os.path.exists(destino):
+                    resumen["imagenes_existentes"] += 1
+                    continue
+                os.makedirs(image_store.IMAGE_STORE_DIR, exist_ok=True)
+                tmp_path = f"{destino}.{os.getpid()}.tmp.png"
+                with open(tmp_path, "wb") as f: # mtime actual: 'gc' no la borra mientras se importan los puntos
+                    f.write(tar.extractfile(miembro).read())
+                os.replace(tmp_path, destino)
+                resumen["imagenes"] += 1
+            elif miembro.name.endswith(".jsonl"):
+                coleccion = miembro.name[:-len(".jsonl")]
+                if coleccion not in manifiesto["colecciones"]:
+                    continue
+                pendientes, lote, total = [], [], 0
+                for linea in tar.extractfile(miembro):
+                    punto = json.loads(linea)
+                    lote.append(models.PointStruct(id=punto["id"], vector=_vector_a_importar(coleccion, punto["vector"], con_imagen),
+                                                   payload=_payload_a_importar(punto["payload"], imagenes)))
+                    if len(lote) >= km.KM_UPSERT_BATCH_SIZE:
+                        pendientes.append(pool.submit(km._upsert_por_lotes, coleccion, lote))
+                        total += len(lote)
+                        lote = []
+                    if len(pendientes) >= 2 * workers: # No acumular en memoria más lotes de los que se están subiendo
+                        if not all(f.result() for f in pendientes):
+                            raise RuntimeError(f"Fallo al subir puntos a '{coleccion}'.")
+                        pendientes = []
+                if lote:
+                    pendientes.append(pool.submit(km._upsert_por_lotes, coleccion, lote))
+                    total += len(lote)
+                if not all(f.result() for f in pendientes):
+                    raise RuntimeError(f"Fallo al subir puntos a '{coleccion}'.")
+                resumen[coleccion] = total
+
+    print(f"INFO: Instantánea '{origen}' importada en {time.monotonic() - inicio:.2f} s: {resumen}", flush=True)
+    return resumen
+
+
+def limpiar_por_uso(dias: float = KB_EVICT_DAYS, dry_run: bool = False) -> dict:
+    """
+    Limpieza de elementos UI según sus estadísticas de uso:
+    - Sin usar en 'dias' días: se borran; probablemente son de un diseño de pantalla que ya no existe.
+      Los elementos sin 'last_used' (anteriores al registro de uso) no se borran: se les pone 'last_used' = ahora,
+      de modo que empiezan a contar desde la primera limpieza en lugar de desde su fecha de creación.
+    - Con al menos KB_DEMOTE_MIN_FAILURES fallos y fiabilidad < KB_DEMOTE_RELIABILITY: se marcan 'demoted' (pierden
+      posiciones en las búsquedas; un clic correcto les quita la marca).
+    - Ya degradados que llegan a KB_EVICT_MIN_FAILURES fallos sin mejorar: se borran.
+    Las imágenes que queden sin referencias las limpia 'gc'.
+    """
+    km.vaciar_uso() # Que los eventos de este proceso cuenten
+    limite = time.time() - dias * 86400
+    resumen = {"puntos": 0, "sin_registro_de_uso": 0, "caducados": 0, "degradados": 0, "borrados_por_fallos": 0}
+    borrar, degradar, sin_uso = [], [], []
+    for point in _recorrer(km.COLLECTION_NAME_UI_ELEMENTS):
+        payload = point.payload or {}
+        resumen["puntos"] += 1
+        ultimo = payload.get("last_used")
+        fallos = payload.get("usage_failures", 0)
+        poco_fiable = km.fiabilidad(payload) < KB_DEMOTE_RELIABILITY
+        if not ultimo:
+            resumen["sin_registro_de_uso"] += 1
+            sin_uso.append(point.id)
+        elif ultimo < limite:
+            resumen["caducados"] += 1
+            borrar.append(point.id)
+        elif payload.get("demoted") and poco_fiable and fallos >= KB_EVICT_MIN_FAILURES:
+            resumen["borrados_por_fallos"] += 1
+            borrar.append(point.id)
+        elif not payload.get("demoted") and poco_fiable and fallos >= KB_DEMOTE_MIN_FAILURES:
+            resumen["degradados"] += 1
+            degradar.append(point.id)
+            print(f"INFO: Degradado '{payload.get('description')}' ({fallos} fallos, {payload.get('usage_successes', 0)} éxitos).", flush=True)
+    if not dry_run:
+        if sin_uso:
+            km.client.set_payload(collection_name=km.COLLECTION_NAME_UI_ELEMENTS, payload={"last_used": time.time()}, points=sin_uso, wait=True)
+        if degradar:
+            km.client.set_payload(collection_name=km.COLLECTION_NAME_UI_ELEMENTS, payload={"demoted": True}, points=degradar, wait=True)
+        if borrar:
+            km.client.delete(collection_name=km.COLLECTION_NAME_UI_ELEMENTS, points_selector=models.PointIdsList(points=borrar), wait=True)
+        os.makedirs(os.path.dirname(_MARCA_LIMPIEZA), exist_ok=True)
+        with open(_MARCA_LIMPIEZA, "w", encoding="utf-8") as f:
+            f.write(datetime.now().isoformat())
+    print(f"INFO: Limpieza por uso de elementos UI{' (simulación)' if dry_run else ''}: {resumen}", flush=True)
+    return resumen
+
+
+def limpiar_por_uso_si_toca() -> dict | None:
+    """Ejecuta limpiar_por_uso si han pasado KB_CLEANUP_INTERVAL_HOURS desde la última vez (para main.py)."""
+    if KB_CLEANUP_INTERVAL_HOURS <= 0:
+        return None
+    if os.path.exists(_MARCA_LIMPIEZA) and time.time() - os.path.getmtime(_MARCA_LIMPIEZA) < KB_CLEANUP_INTERVAL_HOURS * 3600:
+        return None
+    return limpiar_por_uso()
+
+
+def reconciliar_imagenes(dry_run: bool = False, grace: float = image_store.IMAGE_STORE_GC_GRACE) -> dict:
+    """Reconcilia el almacén de imágenes con la colección y, si no es una simulación, anota cuándo se hizo."""
+    resumen = image_store.reconciliar(km, dry_run=dry_run, grace=grace)
+    if not dry_run:
+        os.makedirs(os.path.dirname(_MARCA_RECONCILIACION), exist_ok=True)
+        with open(_MARCA_RECONCILIACION, "w", encoding="utf-8") as f:
+            f.write(datetime.now().isoformat())
+    return resumen
+
+
+def reconciliar_imagenes_si_toca() -> dict | None:
+    """Ejecuta reconciliar_imagenes si han pasado IMAGE_STORE_GC_INTERVAL_HOURS desde la última vez (para main.py)."""
+    if not image_store.IMAGE_STORE_GC_ON_STARTUP or image_store.IMAGE_STORE_GC_INTERVAL_HOURS <= 0:
+        return None
+    if os.path.exists(_MARCA_RECONCILIACION) and time.time() - os.path.getmtime(_MARCA_RECONCILIACION) < image_store.IMAGE_STORE_GC_INTERVAL_HOURS * 3600:
+        return None
+    return reconciliar_imagenes()
+
+
+def comando_gc(args):
+    reconciliar_imagenes(dry_run=args.dry_run, grace=args.grace)
+
+
+def comando_compact(args):
+    compactar_duplicados(umbral=args.threshold, dry_run=args.dry_run)
+
+
+def comando_migrate(args):
+    migrar_perfil(args.profile, dry_run=args.dry_run)
+
+
+def comando_bench(args):
+    benchmark_perfiles(args.profiles.split(","), n_consultas=args.queries, limit=args.limit, sinteticos=args.synthetic)
+
+
+def comando_image_vectors(args):
+    añadir_vectores_imagen(dry_run=args.dry_run, todos=args.all)
+
+
+def comando_export(args):
+    exportar_base(args.file, con_imagenes=not args.no_images)
+
+
+def comando_import(args):
+    importar_base(args.file, reemplazar=args.replace, workers=args.workers)
+
+
+def comando_evict(args):
+    limpiar_por_uso(dias=args.days, dry_run=args.dry_run)
+
+
+def comando_transport_bench(args):
+    medir_transportes([t.strip() for t in args.transports.split(",") if t.strip()], n_puntos=args.points,
+                      n_consultas=args.queries, concurrencia=args.concurrency)
+
+
+def comando_parity(args):
+    if not comprobar_paridad(muestras=args.samples, umbral=args.threshold)["ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Herramientas de mantenimiento de la base de conocimiento.")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    parser_gc = subparsers.add_parser("gc", help="Reconcilia el almacén de imágenes con la colección de elementos UI (migra, repara y borra huérfanos).")
+    parser_gc.add_argument("--dry-run", action="store_true", help="Solo informa de lo que haría, sin cambiar nada.")
+    parser_gc.add_argument("--grace", type=float, default=image_store.IMAGE_STORE_GC_GRACE,
+                           help="No borrar archivos sin referencias más recientes que estos segundos.")
+    parser_gc.set_defaults(func=comando_gc)
+
+    parser_compact = subparsers.add_parser("compact", help="Fusiona elementos UI casi duplicados (similitud coseno) en un solo punto.")
+    parser_compact.add_argument("--threshold", type=float, default=KB_COMPACT_THRESHOLD, help="Similitud coseno mínima para considerar duplicados.")
+    parser_compact.add_argument("--dry-run", action="store_true", help="Solo informa de los grupos que fusionaría.")
+    parser_compact.set_defaults(func=comando_compact)
+
+    parser_migrate = subparsers.add_parser("migrate", help="Aplica un perfil de almacenamiento (cuantización, on-disk, HNSW) a la colección existente.")
+    parser_migrate.add_argument("profile", choices=list(km.PERFILES_COLECCION), help="Perfil a aplicar.")
+    parser_migrate.add_argument("--dry-run", action="store_true", help="Solo muestra la configuración actual y los cambios.")
+    parser_migrate.set_defaults(func=comando_migrate)
+
+    parser_bench = subparsers.add_parser("bench", help="Mide recall@k y latencia de búsqueda de cada perfil sobre colecciones temporales.")
+    parser_bench.add_argument("--profiles", default=",".join(km.PERFILES_COLECCION), help="Perfiles separados por comas.")
+    parser_bench.add_argument("--queries", type=int, default=200, help="Número de consultas.")
+    parser_bench.add_argument("--limit", type=int, default=10, help="k de recall@k.")
+    parser_bench.add_argument("--synthetic", type=int, default=0, help="Vectores aleatorios añadidos para simular una biblioteca mayor.")
+    parser_bench.set_defaults(func=comando_bench)
+
+    parser_image = subparsers.add_parser("image-vectors", help="Añade el vector de imagen a la colección (si falta) y lo calcula para los elementos con imagen.")
+    parser_image.add_argument("--all", action="store_true", help="Recalcula también los que ya tienen vector de imagen.")
+    parser_image.add_argument("--dry-run", action="store_true", help="Solo informa de lo que haría.")
+    parser_image.set_defaults(func=comando_image_vectors)
+
+    parser_export = subparsers.add_parser("export", help="Exporta elementos UI, flujos de tareas e imágenes de referencia a un .tar.gz.")
+    parser_export.add_argument("file", help="Archivo de destino (.tar.gz).")
+    parser_export.add_argument("--no-images", action="store_true", help="No incluir las imágenes de referencia.")
+    parser_export.set_defaults(func=comando_export)
+
+    parser_import = subparsers.add_parser("import", help="Carga una instantánea creada con 'export' (fusionando con la base actual).")
+    parser_import.add_argument("file", help="Instantánea (.tar.gz).")
+    parser_import.add_argument("--replace", action="store_true", help="Vacía las colecciones antes de importar.")
+    parser_import.add_argument("--workers", type=int, default=KB_IMPORT_WORKERS, help="Lotes de upsert en paralelo.")
+    parser_import.set_defaults(func=comando_import)
+
+    parser_evict = subparsers.add_parser("evict", help="Borra los elementos UI sin usar en N días y degrada los que fallan a menudo.")
+    parser_evict.add_argument("--days", type=float, default=KB_EVICT_DAYS, help="Días sin uso tras los que se borra un elemento.")
+    parser_evict.add_argument("--dry-run", action="store_true", help="Solo informa de lo que haría.")
+    parser_evict.set_defaults(func=comando_evict)
+
+    parser_parity = subparsers.add_parser("parity", help="Comprueba que el codificador configurado (EMBEDDING_BACKEND) reproduce los vectores guardados.")
+    parser_parity.add_argument("--samples", type=int, default=200, help="Elementos a comprobar.")
+    parser_parity.add_argument("--threshold", type=float, default=embedding_runtime.EMBEDDING_PARITY_MIN, help="Coseno mínimo aceptable.")
+    parser_parity.set_defaults(func=comando_parity)
+
+    parser_transport = subparsers.add_parser("transport-bench", help="Compara la latencia de REST y gRPC (y del cliente asíncrono) contra el servidor Qdrant.")
+    parser_transport.add_argument("--transports", default="rest,grpc", help="Transportes separados por comas.")
+    parser_transport.add_argument("--points", type=int, default=500, help="Puntos de la colección temporal.")
+    parser_transport.add_argument("--queries", type=int, default=200, help="Número de consultas.")
+    parser_transport.add_argument("--concurrency", type=int, default=8, help="Consultas simultáneas con el cliente asíncrono.")
+    parser_transport.set_defaults(func=comando_transport_bench)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -1,14 +1,19 @@
 import os
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, AsyncQdrantClient
 # Importar modelos específicos de http.models para compatibilidad con versiones recientes
 from qdrant_client.http import models # <-- CAMBIO AQUI: Importar 'models' de qdrant_client.http
-from sentence_transformers import SentenceTransformer
 from datetime import datetime
 import uuid
 import sys
 from dotenv import load_dotenv
+import re
 import json
 import traceback
+import unicodedata
+import threading
+import time
+import atexit
+import asyncio
 
 # --- Configurar la codificación de la salida de la consola al inicio ---
 try:
@@ -25,48 +30,352 @@ load_dotenv()
 # --- Configuración ---
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
+# Transporte del cliente del servidor Qdrant:
+#   "rest" -> HTTP/JSON (el comportamiento original)
+#   "grpc" -> gRPC (prefer_grpc) sobre QDRANT_GRPC_PORT: mensajes binarios y una conexión HTTP/2 persistente
+KM_QDRANT_TRANSPORT = os.getenv("KM_QDRANT_TRANSPORT", "rest").lower()
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+KM_QDRANT_TIMEOUT = int(os.getenv("KM_QDRANT_TIMEOUT", "30"))
+
+# Backend del almacén vectorial:
+#   "qdrant"       -> servidor Qdrant (QDRANT_URL / QDRANT_API_KEY), el comportamiento original
+#   "qdrant_local" -> Qdrant embebido en modo local sobre KM_LOCAL_PATH, sin servidor
+#   "numpy"        -> matriz NumPy en disco (memory-map) con búsqueda coseno exacta (local_vector_store.py)
+KM_BACKEND = os.getenv("KM_BACKEND", "qdrant").lower()
+KM_LOCAL_PATH = os.getenv("KM_LOCAL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "local_kb"))
+# Backend embebido al que recurrir si el servidor Qdrant no responde (vacío = salir con error, como antes)
+KM_OFFLINE_FALLBACK = os.getenv("KM_OFFLINE_FALLBACK", "").lower()
+KM_BACKENDS_VALIDOS = ("qdrant", "qdrant_local", "numpy")
+
+# Verificación de escrituras leyendo el punto de vuelta justo después del upsert (un round trip extra por lote)
+KM_VERIFY_WRITES = os.getenv("KM_VERIFY_WRITES", "false").lower() == "true"
+KM_EMBED_BATCH_SIZE = int(os.getenv("KM_EMBED_BATCH_SIZE", "64")) # Textos por llamada al modelo de embeddings
+KM_UPSERT_BATCH_SIZE = int(os.getenv("KM_UPSERT_BATCH_SIZE", "256")) # Puntos por petición de upsert
+
+# Perfil de almacenamiento de la colección de elementos UI (ver PERFILES_COLECCION):
+#   "default" -> float32 en RAM, HNSW por defecto (el comportamiento original)
+#   "ondisk"  -> vectores y grafo HNSW en disco (memory-map), sin cuantización
+#   "scalar"  -> vectores originales en disco + copia int8 en RAM (4x menos memoria), con rescoring
+#   "binary"  -> vectores originales en disco + copia binaria en RAM (32x menos), con rescoring y más sobremuestreo
+KM_COLLECTION_PROFILE = os.getenv("KM_COLLECTION_PROFILE", "default").lower()
+
+# Búsqueda híbrida (léxica + vectorial) de elementos UI:
+#   "rrf"      -> fusión por rango recíproco de la lista densa y la lista con coincidencia de texto
+#   "weighted" -> KM_HYBRID_WEIGHT * coseno + (1 - KM_HYBRID_WEIGHT) * fracción de palabras de la consulta encontradas
+#   "off"      -> solo búsqueda densa, como antes
+KM_HYBRID_SEARCH = os.getenv("KM_HYBRID_SEARCH", "rrf").lower()
+KM_HYBRID_RRF_K = int(os.getenv("KM_HYBRID_RRF_K", "60"))
+KM_HYBRID_WEIGHT = float(os.getenv("KM_HYBRID_WEIGHT", "0.7"))
+# Un resultado con coincidencia léxica completa (todas las palabras significativas de la consulta, o la descripción
+# o un alias exactos) se acepta con este coseno mínimo aunque no llegue al umbral denso normal
+KM_HYBRID_LEXICAL_THRESHOLD = float(os.getenv("KM_HYBRID_LEXICAL_THRESHOLD", "0.45"))
+KM_HYBRID_PREFETCH = int(os.getenv("KM_HYBRID_PREFETCH", "10")) # Candidatos por cada lista antes de fusionar
+# Campos del payload con índice de texto que participan en la parte léxica
+KM_LEXICAL_FIELDS = ("description", "ocr_text", "aliases")
+# Palabras vacías y palabras genéricas de interfaz: compartir "acceso directo" o "aplicación" no dice que sea el mismo elemento
+_PALABRAS_VACIAS = {"de", "del", "la", "las", "el", "los", "en", "con", "para", "por", "un", "una", "y", "o", "al", "a",
+                    "icono", "boton", "botón", "acceso", "directo", "aplicacion", "aplicación", "app", "programa",
+                    "pestana", "pestaña", "campo", "entrada", "texto", "ventana", "menu", "menú", "enlace", "elemento"}
+
+# Aplicación a la que pertenecen los elementos aprendidos (forma parte del ID determinista; vacío = sin distinguir)
+KM_APPLICATION = os.getenv("KM_APPLICATION", "")
+# Espacio de nombres de los IDs deterministas (uuid5). No cambiarlo: los IDs existentes dejarían de coincidir.
+KM_ID_NAMESPACE = uuid.UUID("6f1d2c3e-8a4b-5c6d-9e7f-0a1b2c3d4e5f")
+
+# Búsqueda acotada al contexto de la pantalla (aplicación, clase de ventana, SO/tema, resolución; ver ui_context.py).
+# Se prueba cada nivel de KM_CONTEXT_LEVELS en orden (campos separados por comas, niveles por ';') y, si no hay
+# resultados, se pasa al siguiente; el último recurso siempre es la búsqueda sin contexto, como antes.
+KM_CONTEXT_SEARCH = os.getenv("KM_CONTEXT_SEARCH", "true").lower() == "true"
+KM_CONTEXT_LEVELS = [tuple(c.strip() for c in nivel.split(",") if c.strip())
+                     for nivel in os.getenv("KM_CONTEXT_LEVELS", "app,window_class,os,theme,resolution;app,window_class;app").split(";")]
+
+# Estadísticas de uso de los elementos UI (usage_hits / usage_successes / usage_failures / last_used / demoted en el payload).
+# Los eventos se acumulan en memoria y se escriben en una sola petición cada KM_USAGE_FLUSH_EVERY eventos y al salir.
+KM_USAGE_FLUSH_EVERY = int(os.getenv("KM_USAGE_FLUSH_EVERY", "20"))
+# Peso de la fiabilidad ((éxitos + 1) / (éxitos + fallos + 2)) en el orden de los resultados (0 = no se usa)
+KM_USAGE_WEIGHT = float(os.getenv("KM_USAGE_WEIGHT", "1.0"))
+KM_USAGE_RERANK_EXTRA = int(os.getenv("KM_USAGE_RERANK_EXTRA", "3")) # Candidatos extra que se piden para poder reordenar
+KM_USAGE_DEMOTE_FACTOR = float(os.getenv("KM_USAGE_DEMOTE_FACTOR", "0.5")) # Penalización de los elementos degradados
+EVENTOS_USO = {"hit": "usage_hits", "success": "usage_successes", "failure": "usage_failures"}
+CAMPOS_USO = tuple(EVENTOS_USO.values()) + ("last_used", "demoted") # Se conservan al volver a aprender un elemento
+
+# Similitud coseno mínima entre un recorte de pantalla y una imagen de referencia para darlo por el mismo elemento
+KM_IMAGE_MATCH_THRESHOLD = float(os.getenv("KM_IMAGE_MATCH_THRESHOLD", "0.9"))
 
 COLLECTION_NAME_UI_ELEMENTS = "ui_elements"
 COLLECTION_NAME_TASK_FLOWS = "task_flows"
 EMBEDDING_MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
 
-# Verificar que las variables de Qdrant están configuradas
-if not QDRANT_URL:
+# Consultas típicas: top-1..10 filtradas por 'type'. payload_m crea enlaces por tipo en el grafo para que
+# el filtro no degrade la búsqueda; hnsw_ef=64 sobra para ese k y mantiene la latencia baja.
+_HNSW_PERFILES = models.HnswConfigDiff(m=16, ef_construct=128, payload_m=16)
+PERFILES_COLECCION = {
+    "default": {"on_disk": False, "hnsw_config": None, "quantization_config": None, "search_params": None},
+    "ondisk": {
+        "on_disk": True,
+        "hnsw_config": models.HnswConfigDiff(m=16, ef_construct=128, payload_m=16, on_disk=True),
+        "quantization_config": None,
+        "search_params": models.SearchParams(hnsw_ef=64),
+    },
+    "scalar": {
+        "on_disk": True,
+        "hnsw_config": _HNSW_PERFILES,
+        "quantization_config": models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)),
+        "search_params": models.SearchParams(hnsw_ef=64, quantization=models.QuantizationSearchParams(rescore=True, oversampling=2.0)),
+    },
+    "binary": {
+        "on_disk": True,
+        "hnsw_config": _HNSW_PERFILES,
+        "quantization_config": models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True)),
+        # Con 384 dimensiones la cuantización binaria pierde bastante: se compensa sobremuestreando más
+        "search_params": models.SearchParams(hnsw_ef=64, quantization=models.QuantizationSearchParams(rescore=True, oversampling=4.0)),
+    },
+}
+
+if KM_COLLECTION_PROFILE not in PERFILES_COLECCION:
+    print(f"ERROR: KM_COLLECTION_PROFILE='{KM_COLLECTION_PROFILE}' no es valido. Opciones: {', '.join(PERFILES_COLECCION)}", flush=True)
+    sys.exit(1)
+
+if KM_BACKEND not in KM_BACKENDS_VALIDOS:
+    print(f"ERROR: KM_BACKEND='{KM_BACKEND}' no es valido. Opciones: {', '.join(KM_BACKENDS_VALIDOS)}", flush=True)
+    sys.exit(1)
+
+# Verificar que las variables de Qdrant están configuradas (solo hacen falta para el servidor)
+if KM_BACKEND == "qdrant" and not QDRANT_URL:
     print("ERROR: La variable de entorno QDRANT_URL no está configurada en .env", flush=True)
     sys.exit(1)
-if not QDRANT_API_KEY:
+if KM_BACKEND == "qdrant" and not QDRANT_API_KEY:
     print("ERROR: La variable de entorno QDRANT_API_KEY no está configurada en .env. Es crucial para la autenticación de Qdrant.", flush=True)
     sys.stdout.flush()
     sys.exit(1)
 
 # Inicializar el modelo de embeddings
+# El runtime (torch / onnx / onnx_int8) se elige con EMBEDDING_BACKEND (ver embedding_runtime.py). Si el modelo
+# está empaquetado en EMBEDDING_MODEL_DIR, la dimensión se lee de su configuración y la carga se aplaza hasta
+# la primera codificación (o hasta calentar_modelo()), de modo que importar este módulo no cuesta la carga.
+import embedding_runtime
+EMBEDDING_BACKEND = embedding_runtime.EMBEDDING_BACKEND
+embedding_model = None
+_embedding_model_lock = threading.Lock()
+
+def obtener_modelo():
+    """Devuelve el codificador de embeddings, cargándolo la primera vez (seguro entre hilos)."""
+    global embedding_model
+    if embedding_model is None:
+        with _embedding_model_lock:
+            if embedding_model is None:
+                embedding_model = embedding_runtime.cargar_modelo(EMBEDDING_MODEL_NAME)
+    return embedding_model
+
+# Servidor de embeddings compartido (embedding_server.py): si está arrancado, este proceso no carga su propio modelo
+import embedding_server
+servidor_embeddings = None
+if embedding_server.EMBEDDING_SERVER_ENABLED:
+    servidor_embeddings = embedding_server.ClienteEmbeddings(EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND)
+
+def codificar(textos: list):
+    """
+    Embeddings de 'textos' como matriz: con el servidor compartido si responde y, si no, con el modelo local.
+    """
+    if servidor_embeddings is not None:
+        vectores = servidor_embeddings.encode(textos)
+        if vectores is not None:
+            return vectores
+    return obtener_modelo().encode(textos, batch_size=KM_EMBED_BATCH_SIZE)
+
+def calentar_modelo() -> float:
+    """Carga el codificador y hace una inferencia de prueba, para que la primera consulta real no pague la latencia."""
+    if servidor_embeddings is not None and servidor_embeddings.info() is not None:
+        return 0.0 # El servidor compartido ya tiene el modelo cargado y caliente
+    return embedding_runtime.calentar(obtener_modelo())
+
 try:
-    embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME, device='cpu')
-    EMBEDDING_DIM = embedding_model.get_sentence_embedding_dimension()
-    print(f"INFO: Modelo de embeddings '{EMBEDDING_MODEL_NAME}' cargado en CPU. Dimensión: {EMBEDDING_DIM}", flush=True)
+    EMBEDDING_DIM = embedding_runtime.dimension_del_modelo(embedding_runtime.EMBEDDING_MODEL_DIR)
+    if EMBEDDING_DIM is None and servidor_embeddings is not None:
+        EMBEDDING_DIM = servidor_embeddings.dimension()
+    if EMBEDDING_DIM is None:
+        EMBEDDING_DIM = obtener_modelo().get_sentence_embedding_dimension()
+    print(f"INFO: Modelo de embeddings '{EMBEDDING_MODEL_NAME}' ({EMBEDDING_BACKEND}, CPU). Dimensión: {EMBEDDING_DIM}", flush=True)
     sys.stdout.flush()
 except Exception as e:
     print(f"ERROR: Error al cargar el modelo de embeddings: {e}", flush=True)
-    print("Asegúrate de tener 'sentence-transformers' instalado y de que el modelo se pueda descargar.", flush=True)
+    print("Asegúrate de tener 'sentence-transformers' (o 'onnxruntime' y 'tokenizers' para EMBEDDING_BACKEND=onnx) instalado y de que el modelo se pueda descargar.", flush=True)
     sys.stdout.flush()
     exit(1)
 
-# Inicializar el cliente de Qdrant
+import ui_context
+
+# Embeddings de imagen (segundo vector con nombre de los elementos UI, ver image_embedding.py)
+import image_embedding
+IMAGE_VECTOR_NAME = image_embedding.IMAGE_VECTOR_NAME
+# Si la colección de elementos UI tiene el vector de imagen (las antiguas no lo tienen). None = aún sin comprobar:
+# se comprueba en el primer uso (tiene_vector_imagen), sin cargar el modelo de imagen
+UI_IMAGE_VECTOR = None
+
+# Caché persistente de embeddings (LRU en memoria + almacén en disco compartido entre procesos)
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+embedding_cache = None
+if EMBEDDING_CACHE_ENABLED:
+    try:
+        from embedding_cache import EmbeddingCache
+        # Los vectores int8/ONNX no son idénticos bit a bit a los de torch: cada runtime tiene su propia caché
+        modelo_cache = EMBEDDING_MODEL_NAME if EMBEDDING_BACKEND == "torch" else f"{EMBEDDING_MODEL_NAME}@{EMBEDDING_BACKEND}"
+        embedding_cache = EmbeddingCache(modelo_cache, EMBEDDING_DIM)
+    except Exception as e:
+        print(f"WARNING: No se pudo abrir la caché de embeddings. Se calcularán siempre con el modelo: {e}", flush=True)
+
+def crear_cliente(backend: str, transporte: str = None, asincrono: bool = False):
+    """
+    Crea el cliente del almacén vectorial para el backend indicado. Todos exponen la misma API
+    (la de QdrantClient), así que el resto del módulo no distingue entre ellos.
+    Para el servidor Qdrant se puede elegir el transporte ("rest" / "grpc") y la variante AsyncQdrantClient.
+    """
+    if backend == "qdrant":
+        transporte = transporte or KM_QDRANT_TRANSPORT
+        if transporte not in ("rest", "grpc"):
+            raise ValueError(f"Transporte de Qdrant desconocido: {transporte} (opciones: rest, grpc)")
+        clase = AsyncQdrantClient if asincrono else QdrantClient
+        return clase(url=QDRANT_URL, api_key=QDRANT_API_KEY, timeout=KM_QDRANT_TIMEOUT,
+                     prefer_grpc=transporte == "grpc", grpc_port=QDRANT_GRPC_PORT)
+    if asincrono:
+        raise ValueError(f"El cliente asíncrono solo está disponible para el servidor Qdrant (backend actual: {backend})")
+    if backend == "qdrant_local":
+        return QdrantClient(path=os.path.join(KM_LOCAL_PATH, "qdrant"))
+    if backend == "numpy":
+        from local_vector_store import NumpyVectorStore
+        return NumpyVectorStore(os.path.join(KM_LOCAL_PATH, "numpy"))
+    raise ValueError(f"Backend de conocimiento desconocido: {backend}")
+
+# Inicializar el cliente del almacén vectorial
 try:
-    client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY, timeout=30)
+    client = crear_cliente(KM_BACKEND)
     client.get_collections()
-    print(f"INFO: Cliente Qdrant conectado a {QDRANT_URL} (con API Key)", flush=True)
+    if KM_BACKEND == "qdrant":
+        print(f"INFO: Cliente Qdrant conectado a {QDRANT_URL} (con API Key, transporte {KM_QDRANT_TRANSPORT})", flush=True)
+    else:
+        print(f"INFO: Almacén vectorial embebido '{KM_BACKEND}' abierto en {KM_LOCAL_PATH}", flush=True)
     sys.stdout.flush()
 except Exception as e:
-    print(f"ERROR: Error al conectar con Qdrant en {QDRANT_URL}: {e}", flush=True)
-    print("Asegúrate de que el servidor Qdrant esté corriendo y accesible, y que la QDRANT_API_KEY sea correcta.", flush=True)
-    sys.stdout.flush()
-    exit(1)
+    print(f"ERROR: Error al abrir el almacén vectorial '{KM_BACKEND}' ({QDRANT_URL if KM_BACKEND == 'qdrant' else KM_LOCAL_PATH}): {e}", flush=True)
+    if KM_BACKEND == "qdrant" and KM_OFFLINE_FALLBACK in ("qdrant_local", "numpy"):
+        print(f"WARNING: Qdrant no está accesible. Usando el almacén embebido '{KM_OFFLINE_FALLBACK}' en {KM_LOCAL_PATH}.", flush=True)
+        KM_BACKEND = KM_OFFLINE_FALLBACK
+        client = crear_cliente(KM_BACKEND)
+    else:
+        print("Asegúrate de que el servidor Qdrant esté corriendo y accesible, y que la QDRANT_API_KEY sea correcta (o configura KM_BACKEND/KM_OFFLINE_FALLBACK para trabajar sin servidor).", flush=True)
+        sys.stdout.flush()
+        exit(1)
+
+# Cliente asíncrono compartido (se crea con la primera llamada a obtener_cliente_async)
+_cliente_async = None
+_cliente_async_lock = threading.Lock()
+
+def obtener_cliente_async():
+    """
+    Devuelve el AsyncQdrantClient del proceso (mismo servidor y transporte que 'client'), creándolo la primera vez.
+    Como 'client', es una conexión compartida: los módulos la piden aquí en lugar de abrir la suya.
+    Las conexiones quedan ligadas al bucle de eventos en el que se usan por primera vez.
+    """
+    global _cliente_async
+    if _cliente_async is None:
+        with _cliente_async_lock:
+            if _cliente_async is None:
+                _cliente_async = crear_cliente(KM_BACKEND, asincrono=True)
+    return _cliente_async
+
+def _crear_indices_ui_elements():
+    """
+    Índices de payload de la colección de elementos UI: 'type' y los campos de contexto por palabra clave y texto completo
+    (palabras, en minúsculas, en disco) para los campos de KM_LEXICAL_FIELDS.
+    """
+    client.create_payload_index(
+        collection_name=COLLECTION_NAME_UI_ELEMENTS,
+        field_name="type", # Ejemplo: indexar por tipo de elemento
+        field_schema=models.PayloadSchemaType.KEYWORD
+    )
+    for field_name in ui_context.CONTEXT_FIELDS: # Las búsquedas se acotan primero al contexto actual
+        client.create_payload_index(
+            collection_name=COLLECTION_NAME_UI_ELEMENTS,
+            field_name=field_name,
+            field_schema=models.PayloadSchemaType.KEYWORD
+        )
+    # Estadísticas de uso: la limpieza periódica filtra por antigüedad y por elementos degradados
+    client.create_payload_index(collection_name=COLLECTION_NAME_UI_ELEMENTS, field_name="last_used", field_schema=models.PayloadSchemaType.FLOAT)
+    client.create_payload_index(collection_name=COLLECTION_NAME_UI_ELEMENTS, field_name="demoted", field_schema=models.PayloadSchemaType.BOOL)
+    for field_name in KM_LEXICAL_FIELDS:
+        client.create_payload_index(
+            collection_name=COLLECTION_NAME_UI_ELEMENTS,
+            field_name=field_name,
+            field_schema=models.TextIndexParams(
+                type=models.TextIndexType.TEXT,
+                tokenizer=models.TokenizerType.WORD,
+                lowercase=True,
+                on_disk=True # Almacenar en disco para datasets grandes
+            )
+        )
+
+def configuracion_coleccion(perfil: str = None) -> dict:
+    """
+    Argumentos de create_collection para la colección de elementos UI con el perfil indicado (o KM_COLLECTION_PROFILE).
+    """
+    config = PERFILES_COLECCION[perfil or KM_COLLECTION_PROFILE]
+    vector_texto = models.VectorParams(size=EMBEDDING_DIM, distance=models.Distance.COSINE, on_disk=config["on_disk"] or None)
+    argumentos = {"vectors_config": vector_texto}
+    if image_embedding.IMAGE_EMBEDDING_ENABLED:
+        # El vector de texto sigue siendo el vector sin nombre, así que las consultas existentes no cambian
+        argumentos["vectors_config"] = {
+            "": vector_texto,
+            IMAGE_VECTOR_NAME: models.VectorParams(size=image_embedding.IMAGE_EMBEDDING_DIM, distance=models.Distance.COSINE,
+                                                   on_disk=config["on_disk"] or None),
+        }
+    if config["hnsw_config"] is not None:
+        argumentos["hnsw_config"] = config["hnsw_config"]
+    if config["quantization_config"] is not None:
+        argumentos["quantization_config"] = config["quantization_config"]
+    return argumentos
+
+def parametros_busqueda(perfil: str = None):
+    """Parámetros de búsqueda (hnsw_ef, rescoring) del perfil; None para el perfil por defecto."""
+    return PERFILES_COLECCION[perfil or KM_COLLECTION_PROFILE]["search_params"]
+
+def vectores_de_coleccion(collection_name: str) -> set:
+    """Nombres de los vectores de una colección ("" es el vector sin nombre)."""
+    info = client.get_collection(collection_name=collection_name)
+    if isinstance(info, dict): # NumpyVectorStore
+        return set(info["vectors"])
+    vectores = info.config.params.vectors
+    return set(vectores) if isinstance(vectores, dict) else {""}
+
+def tiene_vector_imagen() -> bool:
+    """
+    Si la colección de elementos UI tiene el vector de imagen. Se consulta la configuración de la colección una
+    sola vez por proceso; si la colección aún no existe, se vuelve a intentar en la siguiente llamada.
+    """
+    global UI_IMAGE_VECTOR
+    if UI_IMAGE_VECTOR is None:
+        if not image_embedding.IMAGE_EMBEDDING_ENABLED:
+            UI_IMAGE_VECTOR = False
+        else:
+            try:
+                UI_IMAGE_VECTOR = IMAGE_VECTOR_NAME in vectores_de_coleccion(COLLECTION_NAME_UI_ELEMENTS)
+            except Exception as e:
+                print(f"WARNING: No se pudo comprobar si '{COLLECTION_NAME_UI_ELEMENTS}' tiene vector de imagen: {e}", flush=True)
+                return False
+            if not UI_IMAGE_VECTOR:
+                print(f"WARNING: La colección '{COLLECTION_NAME_UI_ELEMENTS}' no tiene el vector de imagen '{IMAGE_VECTOR_NAME}'. "
+                      "La búsqueda por imagen no estará disponible hasta ejecutar: python kb_tools.py image-vectors", flush=True)
+    return UI_IMAGE_VECTOR
+
+def vector_de_texto(point):
+    """Vector de texto de un punto leído con with_vectors=True (con vectores con nombre, Qdrant devuelve un dict)."""
+    return point.vector.get("") if isinstance(point.vector, dict) else point.vector
 
 def create_collections():
     """
     Crea las colecciones en Qdrant si no existen.
     """
+    global UI_IMAGE_VECTOR
     optimizers_config_dict = {
         "deleted_threshold": 0.2,
         "vacuum_min_vector_number": 100,
@@ -82,25 +391,19 @@ def create_collections():
 
 
     if not client.collection_exists(collection_name=COLLECTION_NAME_UI_ELEMENTS):
-        print(f"INFO: Colección '{COLLECTION_NAME_UI_ELEMENTS}' no existe. Creándola...", flush=True)
+        print(f"INFO: Colección '{COLLECTION_NAME_UI_ELEMENTS}' no existe. Creándola con el perfil '{KM_COLLECTION_PROFILE}'...", flush=True)
+        optimizers_ui = dict(optimizers_config_dict)
+        if PERFILES_COLECCION[KM_COLLECTION_PROFILE]["on_disk"]:
+            optimizers_ui.pop("memmap_threshold") # Con vectores on_disk el memory-map lo decide el perfil, no un umbral fijo
         client.create_collection(
             collection_name=COLLECTION_NAME_UI_ELEMENTS,
-            vectors_config=models.VectorParams(size=EMBEDDING_DIM, distance=models.Distance.COSINE),
-            optimizers_config=optimizers_config_dict
+            optimizers_config=optimizers_ui,
+            **configuracion_coleccion()
         )
         print(f"INFO: Colección '{COLLECTION_NAME_UI_ELEMENTS}' creada.", flush=True)
         # Importante: Añadir índices de payload para campos clave si los vas a usar en filtros
-        client.create_payload_index(
-            collection_name=COLLECTION_NAME_UI_ELEMENTS,
-            field_name="type", # Ejemplo: indexar por tipo de elemento
-            field_schema=models.FieldType.KEYWORD # <-- CAMBIO AQUI: models.FieldType
-        )
-        client.create_payload_index(
-            collection_name=COLLECTION_NAME_UI_ELEMENTS,
-            field_name="description", # Ejemplo: indexar por descripción para búsquedas exactas (no embeddings)
-            field_schema=models.FieldType.TEXT, # <-- CAMBIO AQUI: models.FieldType
-            optimizer_params={"on_disk": True} # Opcional: almacenar en disco para datasets grandes
-        )
+        # (el índice de texto de description/ocr_text/aliases es el que usa la parte léxica de la búsqueda híbrida)
+        _crear_indices_ui_elements()
         print(f"INFO: Índices de payload para '{COLLECTION_NAME_UI_ELEMENTS}' creados/verificados.", flush=True)
         sys.stdout.flush()
     else:
@@ -109,12 +412,14 @@ def create_collections():
         # Puedes verificar si los índices ya existen aquí y crearlos si no, aunque create_payload_index
         # suele ser idempotente (no falla si ya existe).
         try:
-            client.create_payload_index(collection_name=COLLECTION_NAME_UI_ELEMENTS, field_name="type", field_schema=models.FieldType.KEYWORD) # <-- CAMBIO AQUI: models.FieldType
-            client.create_payload_index(collection_name=COLLECTION_NAME_UI_ELEMENTS, field_name="description", field_schema=models.FieldType.TEXT, optimizer_params={"on_disk": True}) # <-- CAMBIO AQUI: models.FieldType
+            _crear_indices_ui_elements()
             print(f"INFO: Índices de payload para '{COLLECTION_NAME_UI_ELEMENTS}' verificados/creados (si faltaban).", flush=True)
         except Exception as e:
             print(f"WARNING: No se pudieron crear/verificar todos los índices de payload para '{COLLECTION_NAME_UI_ELEMENTS}': {e}", flush=True)
 
+    UI_IMAGE_VECTOR = None # La colección puede haberse creado (o recreado) ahora: volver a comprobarlo
+    tiene_vector_imagen()
+
 
     if not client.collection_exists(collection_name=COLLECTION_NAME_TASK_FLOWS):
         print(f"INFO: Colección '{COLLECTION_NAME_TASK_FLOWS}' no existe. Creándola...", flush=True)
@@ -130,81 +435,213 @@ def create_collections():
         print(f"INFO: Colección '{COLLECTION_NAME_TASK_FLOWS}' ya existe.", flush=True)
         sys.stdout.flush()
 
+def normalizar_descripcion(description: str) -> str:
+    """
+    Normaliza una descripción para construir IDs: Unicode NFC, minúsculas, sin comillas en los extremos y espacios colapsados.
+    """
+    return " ".join(unicodedata.normalize("NFC", description).lower().strip().strip("'\"").split())
+
+def id_determinista(description: str, element_type: str = None, application: str = None) -> str:
+    """
+    ID de punto derivado de (descripción normalizada, tipo, aplicación). Volver a aprender el mismo elemento
+    hace un upsert sobre el mismo punto en lugar de añadir un duplicado.
+    """
+    if application is None:
+        application = KM_APPLICATION
+    clave = "|".join([normalizar_descripcion(description), (element_type or "").lower(), application.lower()])
+    return uuid.uuid5(KM_ID_NAMESPACE, clave).hex
+
+def _payload_con_id(hit, score: float = None) -> dict:
+    """Payload de un resultado de búsqueda con su ID de punto (para poder actualizarlo después) y su puntuación."""
+    return dict(hit.payload or {}, id=str(hit.id), score=hit.score if score is None else score)
+
 def get_embedding(text: str):
     """
     Genera el embedding para un texto dado.
+    Si el texto ya se había codificado (en este u otro proceso), se devuelve desde la caché sin inferencia.
     """
     try:
-        return embedding_model.encode(text).tolist()
+        if embedding_cache is not None:
+            vector = embedding_cache.get(text)
+            if vector is not None:
+                return vector.tolist()
+        vector = codificar([text])[0]
+        if embedding_cache is not None:
+            embedding_cache.put(text, vector)
+        return vector.tolist()
     except Exception as e:
         print(f"ERROR: Fallo al obtener embedding para el texto '{text}': {e}", flush=True)
         traceback.print_exc() # Añadido para más detalles
         sys.stdout.flush()
         return []
 
-def add_ui_element(description: str, element_type: str, image_path: str = None, ocr_text: str = None, metadata: dict = None) -> str | None:
+def _ruta_imagen(image_path: str) -> str:
+    """Las rutas de imagen del payload son relativas a la raíz del proyecto (ver image_store.ruta_relativa)."""
+    return image_path if os.path.isabs(image_path) else os.path.join(os.path.dirname(os.path.abspath(__file__)), image_path)
+
+def _vectores_imagen(image_paths: list) -> list:
     """
-    Añade una descripción de elemento de UI a la colección de Qdrant.
-    Ahora devuelve el ID del punto creado.
+    Embeddings de imagen de las rutas indicadas (None o [] donde no haya imagen, o si la colección no tiene el vector de imagen).
     """
-    vector = get_embedding(description)
-    if not vector: # Asegurarse de que el embedding se generó correctamente
-        print(f"ERROR: No se pudo generar el vector de embedding para '{description}'. No se añadirá el elemento.", flush=True)
+    vectores = [[] for _ in image_paths]
+    indices = [i for i, path in enumerate(image_paths) if path and os.path.exists(_ruta_imagen(path))]
+    if not indices or not tiene_vector_imagen(): # Sin imágenes no hace falta ni consultar la colección ni cargar el modelo
+        return vectores
+    for i, vector in zip(indices, image_embedding.embed_imagenes([_ruta_imagen(image_paths[i]) for i in indices])):
+        vectores[i] = vector
+    return vectores
+
+def _vector_punto(vector_texto: list, vector_imagen: list) -> dict:
+    """
+    Vector de un PointStruct de elemento UI. Siempre en forma de dict: una colección con vectores con nombre
+    no acepta un vector suelto, y {"": vector} también vale para las colecciones con un único vector.
+    """
+    return {"": vector_texto, IMAGE_VECTOR_NAME: vector_imagen} if vector_imagen else {"": vector_texto}
+
+def get_embeddings(texts: list) -> list:
+    """
+    Genera los embeddings de varios textos con una sola pasada del modelo (por lotes de KM_EMBED_BATCH_SIZE).
+    Los textos ya cacheados no se vuelven a codificar. Devuelve una lista de vectores en el mismo orden
+    ([] para los textos que hayan fallado).
+    """
+    vectores = [None] * len(texts)
+    pendientes = []
+    for i, text in enumerate(texts):
+        vector = embedding_cache.get(text) if embedding_cache is not None else None
+        if vector is not None:
+            vectores[i] = vector.tolist()
+        else:
+            pendientes.append(i)
+    if pendientes:
+        try:
+            textos_pendientes = [texts[i] for i in pendientes]
+            nuevos = codificar(textos_pendientes)
+            if embedding_cache is not None:
+                embedding_cache.put_many(textos_pendientes, nuevos)
+            for i, vector in zip(pendientes, nuevos):
+                vectores[i] = vector.tolist()
+        except Exception as e:
+            print(f"ERROR: Fallo al obtener embeddings para {len(pendientes)} textos: {e}", flush=True)
+            traceback.print_exc()
+            sys.stdout.flush()
+    return [v if v is not None else [] for v in vectores]
+
+def _construir_filtro(filters: dict):
+    """
+    Convierte un diccionario {campo: valor} en un filtro de Qdrant (todas las condiciones deben cumplirse).
+    """
+    if not filters:
         return None
+    must_clauses = []
+    for key, value in filters.items():
+        must_clauses.append(models.FieldCondition(
+            key=key,
+            match=models.MatchValue(value=value)
+        ))
+    return models.Filter(must=must_clauses)
 
+def _upsert_por_lotes(collection_name: str, points: list, wait: bool = True) -> bool:
+    """
+    Sube los puntos en peticiones de hasta KM_UPSERT_BATCH_SIZE puntos. Devuelve True si todas se completaron.
+    """
+    for inicio in range(0, len(points), KM_UPSERT_BATCH_SIZE):
+        operation_info = client.upsert(
+            collection_name=collection_name,
+            points=points[inicio:inicio + KM_UPSERT_BATCH_SIZE],
+            wait=wait
+        )
+        if wait and operation_info.status != models.UpdateStatus.COMPLETED:
+            print(f"WARNING: Upsert por lotes en '{collection_name}' no completado. Estado: {operation_info.status}", flush=True)
+            return False
+    return True
+
+def _verificar_puntos(collection_name: str, point_ids: list):
+    """
+    Lee de vuelta los puntos recién escritos (una sola petición) y avisa de los que falten.
+    """
+    try:
+        recuperados = {str(p.id).replace("-", "") for p in client.retrieve(collection_name=collection_name, ids=point_ids, with_payload=False)}
+        faltan = [pid for pid in point_ids if pid.replace("-", "") not in recuperados]
+        if faltan:
+            print(f"WARNING QDRANT: {len(faltan)} de {len(point_ids)} puntos no se pudieron recuperar justo después de insertarlos: {faltan}", flush=True)
+        else:
+            print(f"DEBUG QDRANT: {len(point_ids)} puntos RECUPERADOS exitosamente justo después de insertarlos.", flush=True)
+    except Exception as retrieve_e:
+        print(f"ERROR QDRANT: Fallo al intentar recuperar los puntos recién insertados: {retrieve_e}", flush=True)
+
+def _payload_ui_element(description: str, element_type: str, image_path: str = None, ocr_text: str = None, metadata: dict = None) -> dict:
     payload = {
         "description": description,
         "type": element_type,
         "timestamp": datetime.now().isoformat()
     }
-    # Solo añade image_path si es proporcionado, podría ser una ruta temporal inicialmente
     if image_path:
         payload["image_path"] = image_path
     if ocr_text:
         payload["ocr_text"] = ocr_text
+    if KM_APPLICATION:
+        payload["app"] = KM_APPLICATION
     if metadata:
         payload.update(metadata)
+    return payload
+
+def _conservar_uso(points: list):
+    """
+    Copia CAMPOS_USO de los puntos que ya existen a los payloads nuevos (en el sitio), para que volver a aprender
+    un elemento con el mismo ID (p. ej. tras un clic fallido) no reinicie su historial de aciertos y fallos.
+    """
+    try:
+        actuales = {str(p.id).replace("-", ""): p.payload or {}
+                    for p in client.retrieve(collection_name=COLLECTION_NAME_UI_ELEMENTS, ids=[p.id for p in points], with_payload=True)}
+    except Exception as e:
+        print(f"WARNING: No se pudieron leer las estadísticas de uso de los elementos a actualizar: {e}", flush=True)
+        return
+    for point in points:
+        actual = actuales.get(str(point.id).replace("-", ""))
+        if actual:
+            point.payload.update({campo: actual[campo] for campo in CAMPOS_USO if campo in actual})
 
-    point_id = str(uuid.uuid4().hex) # Generamos el ID aquí
+def add_ui_element(description: str, element_type: str, image_path: str = None, ocr_text: str = None, metadata: dict = None,
+                   verify: bool = None, point_id: str = None) -> str | None:
+    """
+    Añade una descripción de elemento de UI a la colección de Qdrant.
+    Devuelve el ID del punto. Si no se indica 'point_id', se usa id_determinista(description, element_type, app),
+    así que añadir dos veces el mismo elemento actualiza el punto en lugar de duplicarlo.
+    La lectura de verificación tras el upsert solo se hace si verify (o KM_VERIFY_WRITES) es True.
+    """
+    if verify is None:
+        verify = KM_VERIFY_WRITES
+    vector = get_embedding(description)
+    if not vector: # Asegurarse de que el embedding se generó correctamente
+        print(f"ERROR: No se pudo generar el vector de embedding para '{description}'. No se añadirá el elemento.", flush=True)
+        return None
+
+    # Solo añade image_path si es proporcionado, podría ser una ruta temporal inicialmente
+    payload = _payload_ui_element(description, element_type, image_path, ocr_text, metadata)
+
+    point_id = point_id or id_determinista(description, element_type, (metadata or {}).get("app"))
 
     # --- PRINTS DE DEPURACIÓN AÑADIDOS ---
     print(f"DEBUG QDRANT (add_ui_element): Intentando añadir punto con ID: {point_id}")
     print(f"DEBUG QDRANT (add_ui_element): Payload a enviar: {payload}")
     # ------------------------------------
 
+    point = models.PointStruct(id=point_id, vector=_vector_punto(vector, _vectores_imagen([image_path])[0]), payload=payload)
+    _conservar_uso([point])
+
     try:
         operation_info = client.upsert(
             collection_name=COLLECTION_NAME_UI_ELEMENTS,
-            points=[
-                models.PointStruct( # <-- models.PointStruct está bien
-                    id=point_id,
-                    vector=vector,
-                    payload=payload
-                )
-            ],
+            points=[point],
             wait=True # Esperar a que la operación se complete
         )
         if operation_info.status == models.UpdateStatus.COMPLETED: # <-- models.UpdateStatus está bien
             print(f"INFO: Elemento UI '{description}' añadido/actualizado en Qdrant con ID: {point_id}.", flush=True)
             sys.stdout.flush()
 
-            # --- VERIFICACIÓN INMEDIATA DESPUÉS DE LA INSERCIÓN ---
-            try:
-                retrieved_point = client.retrieve(
-                    collection_name=COLLECTION_NAME_UI_ELEMENTS,
-                    ids=[point_id],
-                    with_payload=True
-                )
-                if retrieved_point:
-                    # CAMBIO AQUI: retrieve devuelve una lista, necesitamos el primer elemento
-                    if isinstance(retrieved_point, list) and len(retrieved_point) > 0:
-                        print(f"DEBUG QDRANT (add_ui_element): ¡Elemento {point_id} RECUPERADO exitosamente justo después de insertarlo! Payload: {retrieved_point[0].payload}")
-                    else:
-                        print(f"WARNING QDRANT (add_ui_element): ¡No se pudo recuperar el elemento {point_id} justo después de insertarlo o la respuesta no es una lista válida!")
-                else:
-                    print(f"WARNING QDRANT (add_ui_element): ¡No se pudo recuperar el elemento {point_id} justo después de insertarlo!")
-            except Exception as retrieve_e:
-                print(f"ERROR QDRANT (add_ui_element): Fallo al intentar recuperar por ID {point_id} inmediatamente: {retrieve_e}")
+            # --- VERIFICACIÓN INMEDIATA DESPUÉS DE LA INSERCIÓN (opcional) ---
+            if verify:
+                _verificar_puntos(COLLECTION_NAME_UI_ELEMENTS, [point_id])
             # ----------------------------------------------------
 
             return point_id
@@ -218,10 +655,162 @@ def add_ui_element(description: str, element_type: str, image_path: str = None,
         sys.stdout.flush()
         return None
 
-def search_ui_element(query_text: str, limit: int = 3, score_threshold: float = 0.3, filters: dict = None):
+def add_ui_elements(elements: list, verify: bool = None) -> list:
+    """
+    Añade varios elementos de UI de una vez: los embeddings se calculan en lote y los puntos se suben
+    con un único upsert (troceado en KM_UPSERT_BATCH_SIZE). Cada elemento es un dict con las mismas
+    claves que los argumentos de add_ui_element ('description', 'element_type', 'image_path', 'ocr_text', 'metadata', 'point_id').
+    Devuelve la lista de IDs en el mismo orden (None para los elementos que no se pudieron añadir).
+    """
+    if verify is None:
+        verify = KM_VERIFY_WRITES
+    if not elements:
+        return []
+    vectores = get_embeddings([e["description"] for e in elements])
+    vectores_imagen = _vectores_imagen([e.get("image_path") for e in elements])
+
+    point_ids = [None] * len(elements)
+    points = []
+    for i, (element, vector) in enumerate(zip(elements, vectores)):
+        if not vector:
+            print(f"ERROR: No se pudo generar el vector de embedding para '{element['description']}'. No se añadirá el elemento.", flush=True)
+            continue
+        element_type = element.get("element_type", element.get("type"))
+        point_ids[i] = element.get("point_id") or id_determinista(element["description"], element_type, (element.get("metadata") or {}).get("app"))
+        payload = _payload_ui_element(element["description"], element_type, element.get("image_path"),
+                                      element.get("ocr_text"), element.get("metadata"))
+        points.append(models.PointStruct(id=point_ids[i], vector=_vector_punto(vector, vectores_imagen[i]), payload=payload))
+    if not points:
+        return point_ids
+    _conservar_uso(points)
+
+    try:
+        if not _upsert_por_lotes(COLLECTION_NAME_UI_ELEMENTS, points):
+            return [None] * len(elements)
+        print(f"INFO: {len(points)} elementos UI añadidos/actualizados en Qdrant en lote.", flush=True)
+        if verify:
+            _verificar_puntos(COLLECTION_NAME_UI_ELEMENTS, [p.id for p in points])
+        return point_ids
+    except Exception as e:
+        print(f"ERROR: Fallo al añadir {len(points)} elementos UI en lote en Qdrant: {e}", flush=True)
+        traceback.print_exc()
+        sys.stdout.flush()
+        return [None] * len(elements)
+
+def fiabilidad(payload: dict) -> float:
+    """Proporción de clics correctos con un prior neutro: 0.5 para un elemento sin historial."""
+    return (payload.get("usage_successes", 0) + 1) / (payload.get("usage_successes", 0) + payload.get("usage_failures", 0) + 2)
+
+def _candidatos_con_uso(limit: int) -> int:
+    return limit + KM_USAGE_RERANK_EXTRA if KM_USAGE_WEIGHT > 0 else limit
+
+def _ordenar_por_uso(resultados: list) -> list:
+    """
+    Reordena los resultados por puntuación * fiabilidad^KM_USAGE_WEIGHT (y KM_USAGE_DEMOTE_FACTOR si está degradado),
+    para que un elemento de un diseño de pantalla antiguo que falla al hacer clic deje de ganar a los que funcionan.
+    """
+    if KM_USAGE_WEIGHT <= 0:
+        return resultados
+    def clave(payload):
+        factor = fiabilidad(payload) ** KM_USAGE_WEIGHT
+        if payload.get("demoted"):
+            factor *= KM_USAGE_DEMOTE_FACTOR
+        return payload.get("score", 0.0) * factor
+    return sorted(resultados, key=clave, reverse=True)
+
+_uso_pendiente = {}
+_uso_lock = threading.Lock()
+
+def registrar_uso(point_id: str, evento: str):
+    """
+    Anota un evento de uso de un elemento UI: "hit" (devuelto por una búsqueda y utilizado), "success" (el clic
+    funcionó) o "failure" (el clic falló). Solo se acumula en memoria; se escribe en lote con vaciar_uso().
+    """
+    if not point_id or evento not in EVENTOS_USO:
+        return
+    with _uso_lock:
+        pendiente = _uso_pendiente.setdefault(str(point_id), dict.fromkeys(EVENTOS_USO, 0))
+        pendiente[evento] += 1
+        pendiente["last_used"] = time.time()
+        total = sum(sum(p[e] for e in EVENTOS_USO) for p in _uso_pendiente.values())
+    if total >= KM_USAGE_FLUSH_EVERY:
+        vaciar_uso()
+
+def vaciar_uso() -> int:
+    """
+    Suma los eventos acumulados a los contadores del payload: una lectura de todos los puntos afectados y una
+    sola petición de escritura. Un éxito quita la marca de degradado. Devuelve el número de puntos actualizados.
+    """
+    with _uso_lock:
+        pendientes = dict(_uso_pendiente)
+        _uso_pendiente.clear()
+    if not pendientes:
+        return 0
+    try:
+        actuales = {str(p.id).replace("-", ""): p.payload or {}
+                    for p in client.retrieve(collection_name=COLLECTION_NAME_UI_ELEMENTS, ids=list(pendientes), with_payload=True)}
+        operaciones = []
+        for point_id, eventos in pendientes.items():
+            actual = actuales.get(point_id.replace("-", ""))
+            if actual is None:
+                continue # Borrado mientras tanto
+            nuevo = {campo: actual.get(campo, 0) + eventos[evento] for evento, campo in EVENTOS_USO.items()}
+            nuevo["last_used"] = max(eventos["last_used"], actual.get("last_used") or 0)
+            if eventos["success"] and actual.get("demoted"):
+                nuevo["demoted"] = False
+            operaciones.append((point_id, nuevo))
+        if hasattr(client, "batch_update_points"):
+            client.batch_update_points(collection_name=COLLECTION_NAME_UI_ELEMENTS, wait=False, update_operations=[
+                models.SetPayloadOperation(set_payload=models.SetPayload(payload=nuevo, points=[point_id]))
+                for point_id, nuevo in operaciones])
+        else:
+            for point_id, nuevo in operaciones:
+                client.set_payload(collection_name=COLLECTION_NAME_UI_ELEMENTS, payload=nuevo, points=[point_id], wait=False)
+        print(f"DEBUG QDRANT: Estadísticas de uso actualizadas para {len(operaciones)} elementos UI.", flush=True)
+        return len(operaciones)
+    except Exception as e:
+        print(f"WARNING: No se pudieron guardar las estadísticas de uso de {len(pendientes)} elementos UI: {e}", flush=True)
+        return 0
+
+atexit.register(vaciar_uso)
+
+def _niveles_de_filtro(filters: dict = None, context: dict = None) -> list:
+    """
+    Filtros a probar en orden: 'filters' más cada nivel de KM_CONTEXT_LEVELS con los valores de 'context'
+    (None = el contexto actual de la pantalla si KM_CONTEXT_SEARCH está activo, {} = sin contexto),
+    y por último 'filters' solo. Los niveles que quedan iguales al anterior se omiten.
+    """
+    if context is None:
+        context = ui_context.contexto_actual() if KM_CONTEXT_SEARCH else {}
+    niveles = []
+    for campos in KM_CONTEXT_LEVELS + [()]:
+        nivel = dict({c: context[c] for c in campos if context.get(c)}, **(filters or {}))
+        if not niveles or nivel != niveles[-1]:
+            niveles.append(nivel)
+    return niveles
+
+def _con_ampliacion(buscar, filters: dict = None, context: dict = None) -> list:
+    """
+    Ejecuta buscar(filtro_qdrant) con cada nivel de _niveles_de_filtro hasta que devuelva resultados.
+    """
+    niveles = _niveles_de_filtro(filters, context)
+    for n, nivel in enumerate(niveles):
+        resultados = buscar(_construir_filtro(nivel))
+        if resultados:
+            if n > 0:
+                print(f"DEBUG QDRANT: Sin resultados en el contexto {niveles[0]}. Encontrado ampliando a {nivel}.", flush=True)
+            return resultados
+    return []
+
+def search_ui_element(query_text: str, limit: int = 3, score_threshold: float = 0.3, filters: dict = None, context: dict = None):
     """
     Busca elementos de UI similares a la consulta, con filtros opcionales.
-    Retorna los payloads de los elementos encontrados.
+    Con KM_HYBRID_SEARCH activo combina la similitud del embedding con la coincidencia de texto
+    (description, ocr_text, aliases), de modo que una etiqueta exacta como "Aceptar" se encuentra
+    aunque su coseno no llegue al umbral.
+    La búsqueda se acota primero al contexto ('context' o el de la pantalla, ver _niveles_de_filtro) y solo
+    se amplía si no hay resultados, para no devolver el botón de otra aplicación.
+    Retorna los payloads de los elementos encontrados (con el ID de cada punto en 'id').
     """
     try:
         query_vector = get_embedding(query_text)
@@ -230,38 +819,260 @@ def search_ui_element(query_text: str, limit: int = 3, score_threshold: float =
             sys.stdout.flush()
             return []
 
-        # Construir el filtro si se proporciona
-        query_filter = None
         if filters:
-            must_clauses = []
-            for key, value in filters.items():
-                # CAMBIO AQUI: Usar FieldCondition y MatchValue de qdrant_client.http.models
-                must_clauses.append(models.FieldCondition(
-                    key=key,
-                    match=models.MatchValue(value=value)
-                ))
-            query_filter = models.Filter(must=must_clauses) # <-- CAMBIO AQUI: models.Filter
             print(f"DEBUG QDRANT (search_ui_element): Aplicando filtro: {filters}", flush=True)
+        candidatos = _candidatos_con_uso(limit)
 
+        def buscar(query_filter):
+            if KM_HYBRID_SEARCH != "off":
+                return _consulta_hibrida([query_text], [query_vector], candidatos, score_threshold, query_filter)[0]
 
-        # CAMBIO AQUI: Usar client.query_points en lugar de client.search (deprecated)
-        # La estructura de argumentos es ligeramente diferente
-        search_result = client.query_points(
-            collection_name=COLLECTION_NAME_UI_ELEMENTS,
-            vector=query_vector, # vector en lugar de query_vector
-            limit=limit,
-            score_threshold=score_threshold,
-            query_filter=query_filter, # Añadido el filtro
-            with_payload=True,
-            with_vectors=False
-        )
-        return [hit.payload for hit in search_result]
+            # CAMBIO AQUI: Usar client.query_points en lugar de client.search (deprecated)
+            # La estructura de argumentos es ligeramente diferente
+            search_result = client.query_points(
+                collection_name=COLLECTION_NAME_UI_ELEMENTS,
+                query=query_vector,
+                limit=candidatos,
+                score_threshold=score_threshold,
+                query_filter=query_filter, # Añadido el filtro
+                search_params=parametros_busqueda(),
+                with_payload=True,
+                with_vectors=False
+            )
+            return [_payload_con_id(hit) for hit in search_result.points]
+
+        return _ordenar_por_uso(_con_ampliacion(buscar, filters, context))[:limit]
     except Exception as e:
         print(f"ERROR: Fallo al buscar elementos UI en Qdrant: {e}", flush=True)
         traceback.print_exc() # Añadido para más detalles
         sys.stdout.flush()
         return []
 
+def _tokens_lexicos(text: str) -> list:
+    """Palabras significativas de la consulta (minúsculas, sin palabras vacías ni duplicados)."""
+    tokens = []
+    for token in re.findall(r"\w+", normalizar_descripcion(text)):
+        if len(token) >= 2 and token not in _PALABRAS_VACIAS and token not in tokens:
+            tokens.append(token)
+    return tokens
+
+def _filtro_lexico(tokens: list, query_filter=None):
+    """
+    Filtro que exige coincidencia de texto de al menos una palabra en alguno de KM_LEXICAL_FIELDS
+    (usa el índice de texto), además de las condiciones de 'query_filter'.
+    """
+    should = [models.FieldCondition(key=field, match=models.MatchText(text=token)) for field in KM_LEXICAL_FIELDS for token in tokens]
+    return models.Filter(must=query_filter.must if query_filter else None, should=should)
+
+def _puntuacion_lexica(tokens: list, payload: dict) -> float:
+    """Fracción de las palabras de la consulta que aparecen en los campos léxicos del payload."""
+    textos = []
+    for field in KM_LEXICAL_FIELDS:
+        valor = payload.get(field)
+        textos.extend(valor if isinstance(valor, list) else [valor])
+    palabras = set(re.findall(r"\w+", normalizar_descripcion(" ".join(str(t) for t in textos if t))))
+    return sum(1 for token in tokens if token in palabras) / len(tokens) if tokens else 0.0
+
+def _coincidencia_exacta(text: str, payload: dict) -> bool:
+    """Si la consulta es exactamente la descripción o uno de los alias del elemento (normalizados)."""
+    consulta = normalizar_descripcion(text)
+    aliases = payload.get("aliases") or []
+    return any(consulta == normalizar_descripcion(str(valor)) for valor in [payload.get("description")] + list(aliases) if valor)
+
+def _fusionar(densos: list, lexicos: list, tokens: list, limit: int, score_threshold: float, text: str = "") -> list:
+    """
+    Combina la lista densa y la léxica (ambas con el coseno como score) según KM_HYBRID_SEARCH.
+    Regla de aceptación: coseno >= score_threshold, o coincidencia léxica completa (todas las palabras significativas,
+    o la descripción/alias exactos) y coseno >= KM_HYBRID_LEXICAL_THRESHOLD. Una sola palabra en común no basta:
+    "acceso directo a Ollama" no debe aceptar "acceso directo a Postman".
+    """
+    candidatos, fusion = {}, {}
+    for lista in (densos, lexicos):
+        for rango, hit in enumerate(lista):
+            candidatos[hit.id] = hit
+            fusion[hit.id] = fusion.get(hit.id, 0.0) + 1.0 / (KM_HYBRID_RRF_K + rango + 1)
+    aceptados = []
+    for point_id, hit in candidatos.items():
+        lexica = _puntuacion_lexica(tokens, hit.payload or {})
+        if hit.score < score_threshold:
+            completa = lexica >= 1.0 or _coincidencia_exacta(text, hit.payload or {})
+            if not (completa and hit.score >= KM_HYBRID_LEXICAL_THRESHOLD):
+                continue
+        if KM_HYBRID_SEARCH == "weighted":
+            puntuacion = KM_HYBRID_WEIGHT * hit.score + (1.0 - KM_HYBRID_WEIGHT) * lexica
+        else:
+            puntuacion = fusion[point_id]
+        aceptados.append((puntuacion, hit))
+    aceptados.sort(key=lambda par: par[0], reverse=True)
+    return [_payload_con_id(hit, puntuacion) for puntuacion, hit in aceptados[:limit]]
+
+def _consulta_hibrida(query_texts: list, vectores: list, limit: int, score_threshold: float, query_filter=None) -> list:
+    """
+    Búsqueda híbrida de elementos UI: por cada consulta, una búsqueda densa normal y otra restringida a los
+    puntos con coincidencia de texto, todas en una sola petición por lotes. Después se fusionan en cliente.
+    Devuelve una lista de listas de payloads (con 'id'), una por consulta.
+    """
+    umbral_candidatos = min(score_threshold, KM_HYBRID_LEXICAL_THRESHOLD)
+    candidatos = max(limit, KM_HYBRID_PREFETCH)
+    requests, huecos = [], []
+    for text, vector in zip(query_texts, vectores):
+        tokens = _tokens_lexicos(text)
+        requests.append(models.QueryRequest(query=vector, filter=query_filter, limit=candidatos,
+                                            score_threshold=umbral_candidatos, with_payload=True, params=parametros_busqueda()))
+        if tokens:
+            requests.append(models.QueryRequest(query=vector, filter=_filtro_lexico(tokens, query_filter), limit=candidatos,
+                                                score_threshold=umbral_candidatos, with_payload=True, params=parametros_busqueda()))
+        huecos.append(tokens)
+    respuestas = iter(client.query_batch_points(collection_name=COLLECTION_NAME_UI_ELEMENTS, requests=requests))
+    resultados = []
+    for text, tokens in zip(query_texts, huecos):
+        densos = next(respuestas).points
+        lexicos = next(respuestas).points if tokens else []
+        resultados.append(_fusionar(densos, lexicos, tokens, limit, score_threshold, text))
+    return resultados
+
+def _buscar_en_lote(collection_name: str, query_texts: list, limit: int, score_threshold: float, query_filter=None,
+                    hibrida: bool = False) -> list:
+    """
+    Ejecuta varias búsquedas con una sola petición al endpoint de consultas en lote.
+    Devuelve una lista de listas de payloads, una por consulta y en el mismo orden.
+    """
+    if not query_texts:
+        return []
+    vectores = get_embeddings(query_texts)
+    indices = [i for i, v in enumerate(vectores) if v]
+    if len(indices) < len(query_texts):
+        print(f"ERROR: No se pudo generar embedding para {len(query_texts) - len(indices)} consultas de busqueda.", flush=True)
+    resultados = [[] for _ in query_texts]
+    if not indices:
+        return resultados
+    if hibrida:
+        for i, hits in zip(indices, _consulta_hibrida([query_texts[i] for i in indices], [vectores[i] for i in indices],
+                                                     limit, score_threshold, query_filter)):
+            resultados[i] = hits
+        return resultados
+    requests = [
+        models.QueryRequest(query=vectores[i], filter=query_filter, limit=limit, score_threshold=score_threshold, with_payload=True,
+                            params=parametros_busqueda() if collection_name == COLLECTION_NAME_UI_ELEMENTS else None)
+        for i in indices
+    ]
+    respuestas = client.query_batch_points(collection_name=collection_name, requests=requests)
+    for i, respuesta in zip(indices, respuestas):
+        resultados[i] = [_payload_con_id(hit) for hit in respuesta.points]
+    return resultados
+
+def search_ui_element_by_image(crop, limit: int = 1, score_threshold: float = KM_IMAGE_MATCH_THRESHOLD, filters: dict = None,
+                               context: dict = None) -> list:
+    """
+    Busca elementos de UI cuya imagen de referencia se parezca al recorte (ruta, matriz BGR de OpenCV o imagen PIL).
+    Es un embedding local de la imagen más una consulta al vector de imagen: no hace falta describir el recorte con un LLM.
+    Se acota al contexto igual que search_ui_element.
+    Retorna los payloads de los elementos encontrados (con el ID en 'id' y la similitud en 'image_score').
+    """
+    if not tiene_vector_imagen():
+        print("WARNING: La colección de elementos UI no tiene vector de imagen. Búsqueda por imagen no disponible.", flush=True)
+        return []
+    try:
+        query_vector = image_embedding.embed_imagen(crop)
+        if not query_vector:
+            print("ERROR: No se pudo generar el embedding del recorte para la búsqueda por imagen.", flush=True)
+            return []
+
+        def buscar(query_filter):
+            search_result = client.query_points(
+                collection_name=COLLECTION_NAME_UI_ELEMENTS,
+                query=query_vector,
+                using=IMAGE_VECTOR_NAME,
+                limit=_candidatos_con_uso(limit),
+                score_threshold=score_threshold,
+                query_filter=query_filter,
+                search_params=parametros_busqueda(),
+                with_payload=True,
+                with_vectors=False
+            )
+            return [dict(_payload_con_id(hit), image_score=hit.score) for hit in search_result.points]
+
+        return _ordenar_por_uso(_con_ampliacion(buscar, filters, context))[:limit]
+    except Exception as e:
+        print(f"ERROR: Fallo al buscar elementos UI por imagen en Qdrant: {e}", flush=True)
+        traceback.print_exc()
+        sys.stdout.flush()
+        return []
+
+def search_ui_elements(query_texts: list, limit: int = 3, score_threshold: float = 0.3, filters: dict = None,
+                       context: dict = None) -> list:
+    """
+    Versión en lote de search_ui_element: busca todas las consultas con un único round trip por nivel de contexto
+    (p. ej. todos los elementos de un plan); solo las consultas sin resultados pasan al nivel siguiente.
+    Retorna una lista de listas de payloads.
+    """
+    try:
+        resultados = [[] for _ in query_texts]
+        pendientes = list(range(len(query_texts)))
+        for nivel in _niveles_de_filtro(filters, context):
+            if not pendientes:
+                break
+            encontrados = _buscar_en_lote(COLLECTION_NAME_UI_ELEMENTS, [query_texts[i] for i in pendientes], _candidatos_con_uso(limit),
+                                          score_threshold, _construir_filtro(nivel), hibrida=KM_HYBRID_SEARCH != "off")
+            for i, hits in zip(pendientes, encontrados):
+                resultados[i] = _ordenar_por_uso(hits)[:limit]
+            pendientes = [i for i in pendientes if not resultados[i]]
+        return resultados
+    except Exception as e:
+        print(f"ERROR: Fallo al buscar {len(query_texts)} elementos UI en lote en Qdrant: {e}", flush=True)
+        traceback.print_exc()
+        sys.stdout.flush()
+        return [[] for _ in query_texts]
+
+async def search_ui_elements_async(query_texts: list, limit: int = 3, score_threshold: float = 0.3, filters: dict = None) -> list:
+    """
+    Variante asíncrona de search_ui_elements (solo búsqueda densa, sin ampliación de contexto) con el cliente
+    asíncrono compartido: los embeddings se calculan en un hilo y las consultas van en un solo lote sin bloquear el bucle.
+    Retorna una lista de listas de payloads.
+    """
+    if not query_texts:
+        return []
+    try:
+        vectores = await asyncio.to_thread(get_embeddings, query_texts)
+        indices = [i for i, v in enumerate(vectores) if v]
+        resultados = [[] for _ in query_texts]
+        if not indices:
+            return resultados
+        query_filter = _construir_filtro(filters)
+        requests = [
+            models.QueryRequest(query=vectores[i], filter=query_filter,
+                                limit=_candidatos_con_uso(limit), score_threshold=score_threshold, with_payload=True,
+                                params=parametros_busqueda())
+            for i in indices
+        ]
+        respuestas = await obtener_cliente_async().query_batch_points(collection_name=COLLECTION_NAME_UI_ELEMENTS, requests=requests)
+        for i, respuesta in zip(indices, respuestas):
+            resultados[i] = _ordenar_por_uso([_payload_con_id(hit) for hit in respuesta.points])[:limit]
+        return resultados
+    except Exception as e:
+        print(f"ERROR: Fallo al buscar {len(query_texts)} elementos UI en lote con el cliente asíncrono: {e}", flush=True)
+        traceback.print_exc()
+        sys.stdout.flush()
+        return [[] for _ in query_texts]
+
+def actualizar_vector_imagen(point_id: str, image_path: str) -> bool:
+    """
+    Recalcula el vector de imagen de un punto existente a partir de su imagen de referencia (sin tocar el de texto ni el payload).
+    """
+    vector = _vectores_imagen([image_path])[0]
+    if not vector:
+        return False
+    try:
+        client.update_vectors(
+            collection_name=COLLECTION_NAME_UI_ELEMENTS,
+            points=[models.PointVectors(id=point_id, vector={IMAGE_VECTOR_NAME: vector})],
+            wait=True
+        )
+        return True
+    except Exception as e:
+        print(f"ERROR: Fallo al actualizar el vector de imagen del elemento UI con ID '{point_id}': {e}", flush=True)
+        return False
+
 def update_ui_element_payload(point_id: str, new_payload_data: dict) -> bool:
     """
     Actualiza campos específicos del payload de un punto de UI existente en Qdrant.
@@ -286,6 +1097,8 @@ def update_ui_element_payload(point_id: str, new_payload_data: dict) -> bool:
         if operation_info.status == models.UpdateStatus.COMPLETED: # <-- models.UpdateStatus está bien
             print(f"INFO: Payload actualizado para el elemento UI con ID '{point_id}'.", flush=True)
             sys.stdout.flush()
+            if new_payload_data.get("image_path"):
+                actualizar_vector_imagen(point_id, new_payload_data["image_path"]) # La imagen de referencia ha cambiado
             return True
         print(f"WARNING: No se pudo actualizar el payload para el elemento UI con ID '{point_id}'. Estado: {operation_info.status}", flush=True)
         sys.stdout.flush()
@@ -344,10 +1157,50 @@ def add_task_flow(task_description: str, steps: list, metadata: dict = None):
         return None
 
 
+def add_task_flows(task_flows: list) -> list:
+    """
+    Añade varios flujos de tarea de una vez (embeddings en lote y un único upsert).
+    Cada flujo es un dict con 'task_description', 'steps' y opcionalmente 'metadata' y 'point_id'.
+    Devuelve la lista de IDs en el mismo orden (None para los que no se pudieron añadir).
+    """
+    if not task_flows:
+        return []
+    vectores = get_embeddings([f["task_description"] for f in task_flows])
+
+    point_ids = [None] * len(task_flows)
+    points = []
+    for i, (flujo, vector) in enumerate(zip(task_flows, vectores)):
+        if not vector:
+            print(f"ERROR: No se pudo generar el vector de embedding para la tarea '{flujo['task_description']}'. No se añadirá el flujo.", flush=True)
+            continue
+        payload = {
+            "task_description": flujo["task_description"],
+            "steps": flujo["steps"],
+            "timestamp": datetime.now().isoformat()
+        }
+        if flujo.get("metadata"):
+            payload.update(flujo["metadata"])
+        point_ids[i] = flujo.get("point_id") or str(uuid.uuid4().hex)
+        points.append(models.PointStruct(id=point_ids[i], vector=vector, payload=payload))
+    if not points:
+        return point_ids
+
+    try:
+        if not _upsert_por_lotes(COLLECTION_NAME_TASK_FLOWS, points):
+            return [None] * len(task_flows)
+        print(f"INFO: {len(points)} flujos de tarea añadidos/actualizados en Qdrant en lote.", flush=True)
+        return point_ids
+    except Exception as e:
+        print(f"ERROR: Fallo al añadir {len(points)} flujos de tarea en lote en Qdrant: {e}", flush=True)
+        traceback.print_exc()
+        sys.stdout.flush()
+        return [None] * len(task_flows)
+
+
 def search_task_flow(query_text: str, limit: int = 1, score_threshold: float = 0.6):
     """
     Busca flujos de tarea similares a la consulta.
-    Retorna los payloads de los flujos encontrados.
+    Retorna los payloads de los flujos encontrados (con el ID de cada punto en 'id').
     """
     try:
         query_vector = get_embedding(query_text)
@@ -359,19 +1212,39 @@ def search_task_flow(query_text: str, limit: int = 1, score_threshold: float = 0
         # CAMBIO AQUI: Usar client.query_points en lugar de client.search (deprecated)
         search_result = client.query_points( # Usamos el cliente global
             collection_name=COLLECTION_NAME_TASK_FLOWS,
-            query_embedding=query_vector, # query_embedding en lugar de query_vector
+            query=query_vector,
             limit=limit,
             score_threshold=score_threshold,
             with_payload=True, # Asegurarse de que el payload es devuelto
             with_vectors=False # No necesitamos los vectores en la busqueda
         )
-        return [hit.payload for hit in search_result]
+        return [_payload_con_id(hit) for hit in search_result.points]
     except Exception as e:
         print(f"ERROR: Fallo al buscar flujos de tarea en Qdrant: {e}", flush=True)
         traceback.print_exc()
         sys.stdout.flush()
         return []
 
+def search_task_flows(query_texts: list, limit: int = 1, score_threshold: float = 0.6) -> list:
+    """
+    Versión en lote de search_task_flow: una sola petición para todas las consultas.
+    Retorna una lista de listas de payloads.
+    """
+    try:
+        return _buscar_en_lote(COLLECTION_NAME_TASK_FLOWS, query_texts, limit, score_threshold)
+    except Exception as e:
+        print(f"ERROR: Fallo al buscar {len(query_texts)} flujos de tarea en lote en Qdrant: {e}", flush=True)
+        traceback.print_exc()
+        sys.stdout.flush()
+        return [[] for _ in query_texts]
+
+# Los almacenes embebidos no tienen un paso de despliegue aparte: crear las colecciones al importar
+if KM_BACKEND != "qdrant":
+    try:
+        create_collections()
+    except Exception as e:
+        print(f"WARNING: No se pudieron crear/verificar las colecciones en el almacén '{KM_BACKEND}': {e}", flush=True)
+
 # El bloque __main__ ya está correctamente adaptado a funciones globales
 if __name__ == "__main__":
     print("--- Inicializando Knowledge Manager ---", flush=True)
@@ -479,5 +1352,8 @@ if __name__ == "__main__":
         print("No se encontró un flujo de tarea similar.", flush=True)
     sys.stdout.flush()
 
+    if embedding_cache is not None:
+        print(f"INFO: Estadisticas de la cache de embeddings: {embedding_cache.estadisticas()}", flush=True)
+
     print("\n--- Knowledge Manager listo ---", flush=True)
     sys.stdout.flush()
\ No newline at end of file
@@ -0,0 +1,398 @@
+import os
+import re
+import sys
+import json
+import uuid
+import shutil
+import threading
+
+import numpy as np
+import portalocker
+from qdrant_client.http import models
+
+# --- Configurar la codificación de la salida de la consola al inicio ---
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+except AttributeError:
+    pass
+except Exception as e:
+    print(f"WARNING: No se pudo reconfigurar la codificacion de la consola: {e}", flush=True)
+
+# Palabras para los filtros MatchText (el tokenizador "word" de Qdrant separa por caracteres no alfanuméricos)
+_RE_PALABRA = re.compile(r"\w+")
+
+
+def _normalizar_id(point_id):
+    """
+    Normaliza los IDs igual que Qdrant: enteros tal cual, cadenas UUID (con o sin guiones) al formato canónico.
+    """
+    if isinstance(point_id, int):
+        return point_id
+    try:
+        return str(uuid.UUID(str(point_id)))
+    except ValueError:
+        return str(point_id)
+
+
+def _valor_campo(payload: dict, key: str):
+    """
+    Obtiene un campo del payload admitiendo claves anidadas con puntos ("context.app").
+    """
+    valor = payload
+    for parte in key.split("."):
+        if not isinstance(valor, dict) or parte not in valor:
+            return None
+        valor = valor[parte]
+    return valor
+
+
+def _cumple_condicion(point_id, payload: dict, condicion) -> bool:
+    if isinstance(condicion, models.Filter):
+        return _cumple_filtro(point_id, payload, condicion)
+    if isinstance(condicion, models.HasIdCondition):
+        return point_id in {_normalizar_id(i) for i in condicion.has_id}
+    if isinstance(condicion, models.IsEmptyCondition):
+        return _valor_campo(payload, condicion.is_empty.key) in (None, [], "")
+    if not isinstance(condicion, models.FieldCondition):
+        raise NotImplementedError(f"Condicion de filtro no soportada por el almacén local: {type(condicion).__name__}")
+
+    valor = _valor_campo(payload, condicion.key)
+    valores = valor if isinstance(valor, list) else [valor]
+    match = condicion.match
+    if isinstance(match, models.MatchValue):
+        return match.value in valores
+    if isinstance(match, models.MatchAny):
+        return any(v in match.any for v in valores)
+    if isinstance(match, models.MatchExcept):
+        return all(v not in match.except_ for v in valores)
+    if isinstance(match, models.MatchText):
+        # Como el tokenizador "word" de Qdrant: todas las palabras de la consulta deben aparecer como palabras completas
+        palabras = set(_RE_PALABRA.findall(" ".join(str(v) for v in valores if v is not None).lower()))
+        return set(_RE_PALABRA.findall(match.text.lower())) <= palabras
+    if condicion.range is not None:
+        if not isinstance(valor, (int, float)):
+            return False
+        r = condicion.range
+        return ((r.gt is None or valor > r.gt) and (r.gte is None or valor >= r.gte) and
+                (r.lt is None or valor < r.lt) and (r.lte is None or valor <= r.lte))
+    if condicion.datetime_range is not None or condicion.values_count is not None:
+        raise NotImplementedError("Condiciones de rango de fechas/número de valores no soportadas por el almacén local.")
+    return False
+
+
+def _cumple_filtro(point_id, payload: dict, filtro) -> bool:
+    if filtro is None:
+        return True
+    if filtro.must and not all(_cumple_condicion(point_id, payload, c) for c in filtro.must):
+        return False
+    if filtro.must_not and any(_cumple_condicion(point_id, payload, c) for c in filtro.must_not):
+        return False
+    if filtro.should and not any(_cumple_condicion(point_id, payload, c) for c in filtro.should):
+        return False
+    return True
+
+
+class _Coleccion:
+    """
+    Una colección en disco: una matriz float32 (.npy, abierta con memory-map) por vector con nombre,
+    más un JSON con los IDs y payloads. Los vectores se guardan normalizados, así que la similitud
+    coseno exacta es un simple producto matricial.
+    Cada escritura crea una nueva generación de archivos .npy (points.json indica cuál es la vigente),
+    porque en Windows no se puede reemplazar un archivo que otro proceso tiene mapeado en memoria.
+    """
+
+    def __init__(self, directorio: str):
+        self.directorio = directorio
+        self.lock_path = os.path.join(directorio, ".lock")
+        self.points_path = os.path.join(directorio, "points.json")
+        self.config_path = os.path.join(directorio, "config.json")
+        self._mtime = None
+        self.generacion = 0
+        self.config = {}
+        self.ids = []
+        self.payloads = []
+        self.vectores = {}
+        self._posiciones = {}
+
+    def _vectores_path(self, nombre: str, generacion: int) -> str:
+        return os.path.join(self.directorio, f"vectors_{nombre}.{generacion}.npy" if nombre else f"vectors.{generacion}.npy")
+
+    def recargar_si_cambio(self, bloquear: bool = True):
+        """
+        Vuelve a leer la colección si otro proceso la ha modificado (se compara el mtime de points.json).
+        Con 'bloquear', la lectura espera a que termine cualquier escritura en curso de otro proceso.
+        """
+        try:
+            mtime = os.stat(self.points_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime and self.config:
+            return
+        if bloquear:
+            with portalocker.Lock(self.lock_path, timeout=30):
+                self._leer()
+        else:
+            self._leer()
+
+    def _leer(self):
+        try:
+            mtime = os.stat(self.points_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with open(self.config_path, "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        if mtime is None:
+            self.ids, self.payloads, self.generacion = [], [], 0
+        else:
+            with open(self.points_path, "r", encoding="utf-8") as f:
+                datos = json.load(f)
+            self.ids, self.payloads, self.generacion = datos["ids"], datos["payloads"], datos.get("generation", 0)
+        self.vectores = {}
+        for nombre, params in self.config["vectors"].items():
+            path = self._vectores_path(nombre, self.generacion)
+            if self.ids and os.path.exists(path):
+                self.vectores[nombre] = np.load(path, mmap_mode="r")
+            else:
+                self.vectores[nombre] = np.zeros((0, params["size"]), dtype=np.float32)
+        self._posiciones = {point_id: i for i, point_id in enumerate(self.ids)}
+        self._mtime = mtime
+
+    def guardar(self):
+        """
+        Escribe vectores y payloads. points.json se escribe el último: es el punto de confirmación.
+        """
+        self.generacion += 1
+        for nombre, matriz in self.vectores.items():
+            matriz = np.array(matriz, dtype=np.float32) # Materializar en RAM (puede venir de un memory-map)
+            self.vectores[nombre] = matriz
+            np.save(self._vectores_path(nombre, self.generacion), matriz)
+        tmp_path = self.points_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"generation": self.generacion, "ids": self.ids, "payloads": self.payloads}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.points_path)
+        self._mtime = os.stat(self.points_path).st_mtime_ns
+        self._posiciones = {point_id: i for i, point_id in enumerate(self.ids)}
+        # Borrar generaciones antiguas (si otro proceso aún las tiene mapeadas, se borrarán en la próxima escritura)
+        for archivo in os.listdir(self.directorio):
+            if archivo.endswith(".npy") and not archivo.endswith(f".{self.generacion}.npy"):
+                try:
+                    os.remove(os.path.join(self.directorio, archivo))
+                except OSError:
+                    pass
+
+
+class NumpyVectorStore:
+    """
+    Almacén vectorial embebido para bases de conocimiento pequeñas (miles de vectores): búsqueda
+    coseno exacta sobre matrices NumPy en disco, sin servidor. Implementa el subconjunto de la API
+    de QdrantClient que usa knowledge_manager (crear colecciones, upsert, retrieve, set_payload,
+    query_points, query_batch_points, scroll, delete, count), devolviendo los mismos modelos de qdrant_client.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._colecciones = {}
+        self._lock = threading.RLock()
+
+    # --- Gestión de colecciones ---
+    def _coleccion(self, collection_name: str, bloquear: bool = True) -> _Coleccion:
+        coleccion = self._colecciones.get(collection_name)
+        if coleccion is None:
+            directorio = os.path.join(self.path, collection_name)
+            if not os.path.exists(os.path.join(directorio, "config.json")):
+                raise ValueError(f"La colección '{collection_name}' no existe en el almacén local '{self.path}'.")
+            coleccion = self._colecciones[collection_name] = _Coleccion(directorio)
+        coleccion.recargar_si_cambio(bloquear)
+        return coleccion
+
+    def get_collections(self):
+        nombres = sorted(d for d in os.listdir(self.path) if os.path.exists(os.path.join(self.path, d, "config.json")))
+        return models.CollectionsResponse(collections=[models.CollectionDescription(name=n) for n in nombres])
+
+    def collection_exists(self, collection_name: str) -> bool:
+        return os.path.exists(os.path.join(self.path, collection_name, "config.json"))
+
+    def create_collection(self, collection_name: str, vectors_config, **kwargs) -> bool:
+        if isinstance(vectors_config, models.VectorParams):
+            vectors_config = {"": vectors_config}
+        for params in vectors_config.values():
+            if params.distance != models.Distance.COSINE:
+                raise NotImplementedError("El almacén local solo soporta distancia coseno.")
+        directorio = os.path.join(self.path, collection_name)
+        os.makedirs(directorio, exist_ok=True)
+        with open(os.path.join(directorio, "config.json"), "w", encoding="utf-8") as f:
+            json.dump({"vectors": {nombre: {"size": p.size} for nombre, p in vectors_config.items()}}, f)
+        self._colecciones.pop(collection_name, None)
+        return True
+
+    def delete_collection(self, collection_name: str, **kwargs) -> bool:
+        self._colecciones.pop(collection_name, None)
+        shutil.rmtree(os.path.join(self.path, collection_name), ignore_errors=True)
+        return True
+
+    def get_collection(self, collection_name: str):
+        coleccion = self._coleccion(collection_name)
+        return {"points_count": len(coleccion.ids), "vectors": coleccion.config["vectors"]}
+
+    def create_payload_index(self, collection_name: str, field_name: str, field_schema=None, **kwargs):
+        # La búsqueda es exhaustiva: los índices de payload no son necesarios.
+        return models.UpdateResult(operation_id=0, status=models.UpdateStatus.COMPLETED)
+
+    # --- Escritura ---
+    def _escribir(self, collection_name: str, operacion):
+        with self._lock:
+            directorio = os.path.join(self.path, collection_name)
+            with portalocker.Lock(os.path.join(directorio, ".lock"), timeout=30):
+                coleccion = self._coleccion(collection_name, bloquear=False)
+                operacion(coleccion)
+                coleccion.guardar()
+        return models.UpdateResult(operation_id=0, status=models.UpdateStatus.COMPLETED)
+
+    def upsert(self, collection_name: str, points, wait: bool = True, **kwargs):
+        if isinstance(points, models.Batch):
+            points = [models.PointStruct(id=i, vector=v, payload=p)
+                      for i, v, p in zip(points.ids, points.vectors, points.payloads or [None] * len(points.ids))]
+
+        def operacion(coleccion):
+            nuevos = {nombre: [] for nombre in coleccion.config["vectors"]}
+            for point in points:
+                point_id = _normalizar_id(point.id)
+                vectores = point.vector if isinstance(point.vector, dict) else {"": point.vector}
+                filas = {}
+                for nombre, params in coleccion.config["vectors"].items():
+                    vector = np.asarray(vectores.get(nombre, np.zeros(params["size"])), dtype=np.float32)
+                    norma = np.linalg.norm(vector)
+                    filas[nombre] = vector / norma if norma > 0 else vector
+                posicion = coleccion._posiciones.get(point_id)
+                if posicion is None:
+                    coleccion._posiciones[point_id] = len(coleccion.ids)
+                    coleccion.ids.append(point_id)
+                    coleccion.payloads.append(point.payload or {})
+                    for nombre in nuevos:
+                        nuevos[nombre].append(filas[nombre])
+                else:
+                    coleccion.payloads[posicion] = point.payload or {}
+                    for nombre in nuevos:
+                        matriz = np.array(coleccion.vectores[nombre], dtype=np.float32)
+                        matriz[posicion] = filas[nombre]
+                        coleccion.vectores[nombre] = matriz
+            for nombre, filas in nuevos.items():
+                if filas:
+                    coleccion.vectores[nombre] = np.vstack([coleccion.vectores[nombre], np.stack(filas)])
+        return self._escribir(collection_name, operacion)
+
+    def update_vectors(self, collection_name: str, points, wait: bool = True, **kwargs):
+        """Sustituye solo los vectores indicados (PointVectors) de puntos existentes; el resto y el payload no cambian."""
+        def operacion(coleccion):
+            for point in points:
+                posicion = coleccion._posiciones.get(_normalizar_id(point.id))
+                if posicion is None:
+                    continue
+                vectores = point.vector if isinstance(point.vector, dict) else {"": point.vector}
+                for nombre, vector in vectores.items():
+                    vector = np.asarray(vector, dtype=np.float32)
+                    norma = np.linalg.norm(vector)
+                    matriz = np.array(coleccion.vectores[nombre], dtype=np.float32)
+                    matriz[posicion] = vector / norma if norma > 0 else vector
+                    coleccion.vectores[nombre] = matriz
+        return self._escribir(collection_name, operacion)
+
+    def _posiciones_de(self, coleccion, points) -> list:
+        if isinstance(points, models.FilterSelector):
+            return [i for i, (pid, payload) in enumerate(zip(coleccion.ids, coleccion.payloads))
+                    if _cumple_filtro(pid, payload, points.filter)]
+        if isinstance(points, models.Filter):
+            return [i for i, (pid, payload) in enumerate(zip(coleccion.ids, coleccion.payloads))
+                    if _cumple_filtro(pid, payload, points)]
+        if isinstance(points, models.PointIdsList):
+            points = points.points
+        return [coleccion._posiciones[_normalizar_id(p)] for p in points if _normalizar_id(p) in coleccion._posiciones]
+
+    def set_payload(self, collection_name: str, payload: dict, points, wait: bool = True, **kwargs):
+        def operacion(coleccion):
+            for posicion in self._posiciones_de(coleccion, points):
+                coleccion.payloads[posicion] = {**coleccion.payloads[posicion], **payload}
+        return self._escribir(collection_name, operacion)
+
+    def delete(self, collection_name: str, points_selector, wait: bool = True, **kwargs):
+        def operacion(coleccion):
+            borrar = set(self._posiciones_de(coleccion, points_selector))
+            conservar = [i for i in range(len(coleccion.ids)) if i not in borrar]
+            coleccion.ids = [coleccion.ids[i] for i in conservar]
+            coleccion.payloads = [coleccion.payloads[i] for i in conservar]
+            for nombre in coleccion.vectores:
+                coleccion.vectores[nombre] = np.asarray(coleccion.vectores[nombre])[conservar]
+        return self._escribir(collection_name, operacion)
+
+    # --- Lectura ---
+    def _registro(self, coleccion, posicion, with_payload=True, with_vectors=False, score=None):
+        vector = None
+        if with_vectors:
+            vectores = {n: np.asarray(m[posicion]).tolist() for n, m in coleccion.vectores.items()}
+            vector = vectores[""] if list(vectores) == [""] else vectores
+        payload = coleccion.payloads[posicion] if with_payload else None
+        if score is None:
+            return models.Record(id=coleccion.ids[posicion], payload=payload, vector=vector)
+        return models.ScoredPoint(id=coleccion.ids[posicion], version=0, score=score, payload=payload, vector=vector)
+
+    def retrieve(self, collection_name: str, ids, with_payload=True, with_vectors=False, **kwargs):
+        with self._lock:
+            coleccion = self._coleccion(collection_name)
+            return [self._registro(coleccion, p, with_payload, with_vectors) for p in self._posiciones_de(coleccion, ids)]
+
+    def query_points(self, collection_name: str, query=None, using: str = None, query_filter=None, limit: int = 10,
+                     score_threshold: float = None, with_payload=True, with_vectors=False, **kwargs):
+        with self._lock:
+            coleccion = self._coleccion(collection_name)
+            candidatos = np.array([i for i, (pid, payload) in enumerate(zip(coleccion.ids, coleccion.payloads))
+                                   if _cumple_filtro(pid, payload, query_filter)], dtype=np.int64)
+            if query is None or len(candidatos) == 0:
+                puntos = [self._registro(coleccion, int(i), with_payload, with_vectors, score=0.0) for i in candidatos[:limit]]
+                return models.QueryResponse(points=puntos)
+            vector = np.asarray(query, dtype=np.float32)
+            norma = np.linalg.norm(vector)
+            if norma > 0:
+                vector = vector / norma
+            matriz = np.asarray(coleccion.vectores[using or ""])[candidatos]
+            scores = matriz @ vector
+            scores[~matriz.any(axis=1)] = -np.inf # Puntos sin ese vector (p. ej. elementos sin imagen de referencia)
+            orden = np.argsort(-scores)[:limit]
+            puntos = []
+            for i in orden:
+                if scores[i] == -np.inf or (score_threshold is not None and scores[i] < score_threshold):
+                    break
+                puntos.append(self._registro(coleccion, int(candidatos[i]), with_payload, with_vectors, score=float(scores[i])))
+            return models.QueryResponse(points=puntos)
+
+    def query_batch_points(self, collection_name: str, requests, **kwargs):
+        """
+        Equivalente al endpoint de consultas en lote: una QueryResponse por cada QueryRequest.
+        """
+        with self._lock:
+            return [self.query_points(collection_name, query=r.query, using=r.using, query_filter=r.filter,
+                                      limit=r.limit or 10, score_threshold=r.score_threshold,
+                                      with_payload=True if r.with_payload is None else r.with_payload,
+                                      with_vectors=bool(r.with_vector))
+                    for r in requests]
+
+    def scroll(self, collection_name: str, scroll_filter=None, limit: int = 10, offset=None,
+               with_payload=True, with_vectors=False, **kwargs):
+        with self._lock:
+            coleccion = self._coleccion(collection_name)
+            inicio = int(offset or 0)
+            posiciones = [i for i, (pid, payload) in enumerate(zip(coleccion.ids, coleccion.payloads))
+                          if i >= inicio and _cumple_filtro(pid, payload, scroll_filter)]
+            pagina = posiciones[:limit]
+            siguiente = posiciones[limit] if len(posiciones) > limit else None
+            return [self._registro(coleccion, i, with_payload, with_vectors) for i in pagina], siguiente
+
+    def count(self, collection_name: str, count_filter=None, exact: bool = True, **kwargs):
+        with self._lock:
+            coleccion = self._coleccion(collection_name)
+            total = sum(1 for pid, payload in zip(coleccion.ids, coleccion.payloads) if _cumple_filtro(pid, payload, count_filter))
+            return models.CountResult(count=total)
+
+    def close(self):
+        self._colecciones.clear()
@@ -4,6 +4,7 @@ import sys
 import json
 import time
 import shutil # Necesario para shutil.copy
+import threading
 
 
 
@@ -67,6 +68,57 @@ except ImportError:
     print("WARNING: No se pudo importar 'generic_reminders'. La gestión de recordatorios no funcionará.", flush=True)
     generic_reminders = None # Establecer a None para manejarlo más tarde
 
+# Diario de escrituras diferidas en la base de conocimiento (lo vacía un worker en segundo plano)
+try:
+    import kb_journal
+except ImportError as e:
+    print(f"WARNING: No se pudo importar 'kb_journal' ({e}). Las escrituras en la base de conocimiento serán síncronas.", flush=True)
+    kb_journal = None
+
+# Esquema tipado de los pasos (verb, element_type, target, text, keys, wait_seconds) y conversor de planes antiguos
+from script import step_schema
+
+# Planificador local por reglas (clic / doble clic / abre / escribe / presiona sin llamar al LLM)
+try:
+    from script import rule_planner
+except ImportError as e:
+    print(f"WARNING: No se pudo importar 'rule_planner' ({e}). Todas las instrucciones pasarán por el planificador.", flush=True)
+    rule_planner = None
+
+# Caché local de planes (órdenes repetidas o casi idénticas); la escribe text_to_steps.py con la revisión del prompt,
+# y se abre con esa misma revisión para no servir planes de un prompt, esquema o PLANNER_BACKENDS anteriores
+try:
+    from script import plan_cache, planner_prompt
+    plan_cache_local = plan_cache.PlanCache(revision=planner_prompt.PROMPT_REVISION) if plan_cache.PLAN_CACHE_ENABLED else None
+except Exception as e:
+    print(f"WARNING: No se pudo abrir la caché de planes ({e}). Las órdenes repetidas pasarán por el planificador.", flush=True)
+    plan_cache_local = None
+
+# Plantillas de flujos de tarea con huecos (planes reutilizables sin llamar al LLM)
+try:
+    import task_templates
+except ImportError as e:
+    print(f"WARNING: No se pudo importar 'task_templates' ({e}). Todas las instrucciones pasarán por el planificador.", flush=True)
+    task_templates = None
+
+# Herramientas de mantenimiento de la base de conocimiento (limpieza periódica por estadísticas de uso
+# y reconciliación del almacén de imágenes)
+import kb_tools
+
+# Capturador continuo de pantalla (opcional, se activa con FRAME_GRABBER_ENABLED=true)
+try:
+    from script import frame_grabber
+except ImportError as e:
+    print(f"WARNING: No se pudo importar 'frame_grabber' ({e}). Se usarán capturas puntuales.", flush=True)
+    frame_grabber = None
+
+# Esperas visuales basadas en condiciones (sustituyen a los time.sleep fijos de los pasos "espera")
+try:
+    from script import visual_waits
+except ImportError as e:
+    print(f"WARNING: No se pudo importar 'visual_waits' ({e}). Las esperas serán de tiempo fijo.", flush=True)
+    visual_waits = None
+
 
 # --- Configuración de rutas ---
 project_root = os.path.dirname(__file__) # La raíz del proyecto es la carpeta donde está main.py
@@ -78,9 +130,17 @@ SCREENSHOT_SCRIPT = os.path.join(project_root, 'script', 'screenshot.py')
 ANALIZAR_ICONOS_SCRIPT = os.path.join(project_root, 'recorte', 'analizar_iconos.py')
 EXECUTE_ACTIONS_SCRIPT = os.path.join(project_root, 'script', 'execute_actions.py')
 
+# Monitores en orden de prioridad (ej. "2,1" o "all"). Con más de uno, analizar_iconos.py captura
+# cada monitor por su cuenta y se detiene en el primero donde encuentre el elemento.
+SCREENSHOT_MONITORS = os.getenv("SCREENSHOT_MONITORS", "1")
+
 # Umbral de similitud para la búsqueda en Qdrant
 QDRANT_UI_SEARCH_THRESHOLD = 0.7 # Ajusta este valor según la precisión deseada. Considerar 0.6 si es demasiado estricto.
 
+# Tipo de elemento de los pasos -> tipo guardado en Qdrant (usar 'boton' sin tilde para consistencia con lo ya guardado)
+TIPOS_ELEMENTO_KB = {"icono": "icono", "acceso directo": "icono", "botón": "boton", "boton": "boton", "pestaña": "pestaña",
+                     "campo de entrada": "campo_entrada", "campo de texto": "campo_entrada"}
+
 
 def execute_command(command_list):
     """
@@ -140,14 +200,28 @@ def _perform_full_analysis_and_click(element_description_query, add_to_knowledge
     Realiza la captura de pantalla, análisis de elementos UI con GPT-4o y el clic.
     Retorna True si la secuencia de análisis y clic fue exitosa, False en caso contrario.
     """
-    print("📸 Tomando captura de pantalla...", flush=True)
-    sys.stdout.flush()
-    try:
-        execute_command(["python", SCREENSHOT_SCRIPT])
-    except Exception as e:
-        print(f"❌ Fallo en la captura de pantalla: {e}. No se puede continuar con el análisis.", flush=True)
+    multi_monitor = SCREENSHOT_MONITORS.strip() != "1"
+    grabber = frame_grabber.get_grabber() if frame_grabber else None
+    capturado = False
+    if not multi_monitor and grabber and grabber.running:
+        # El capturador continuo ya tiene el frame en memoria: solo hace falta volcarlo a disco
+        # (esperando un frame posterior a este momento para no analizar una pantalla antigua).
+        print("📸 Usando el último frame del capturador continuo...", flush=True)
+        if grabber.wait_for_frame(after=time.time(), timeout=1.0) is None:
+            print("⚠️ El capturador continuo no ha entregado un frame nuevo. Usando una captura normal.", flush=True)
+        elif grabber.save_latest() is None:
+            print("⚠️ El capturador continuo no tiene frames. Usando una captura normal.", flush=True)
+        else:
+            capturado = True
+    if not multi_monitor and not capturado:
+        print("📸 Tomando captura de pantalla...", flush=True)
         sys.stdout.flush()
-        return False # Indica que falló
+        try:
+            execute_command(["python", SCREENSHOT_SCRIPT])
+        except Exception as e:
+            print(f"❌ Fallo en la captura de pantalla: {e}. No se puede continuar con el análisis.", flush=True)
+            sys.stdout.flush()
+            return False # Indica que falló
 
     print(f"🔎 Analizando elementos UI para: '{element_description_query}'", flush=True)
     sys.stdout.flush()
@@ -161,8 +235,14 @@ def _perform_full_analysis_and_click(element_description_query, add_to_knowledge
             command.extend(["--element_type", element_type])
         if point_id: # Si estamos actualizando un elemento existente
             command.extend(["--point_id", str(point_id)]) # Convertir a string para el argparse
+        if multi_monitor: # El analizador captura cada monitor en orden de prioridad
+            command.extend(["--monitors", SCREENSHOT_MONITORS])
 
         execute_command(command)
+        if kb_journal and kb_journal.KB_JOURNAL_ENABLED:
+            # El analizador acaba de encolar el elemento aprendido: enviarlo ya a Qdrant y no en el próximo vaciado
+            # periódico, para que una búsqueda inmediata del mismo elemento lo encuentre sin otro análisis con GPT.
+            kb_journal.get_worker(km, start=False).avisar()
     except Exception as e:
         print(f"❌ Fallo en el análisis de elementos UI: {e}. No se puede continuar con la acción de clic.", flush=True)
         sys.stdout.flush()
@@ -194,24 +274,48 @@ def process_instruction(instruction: str):
     print(f"💾 Instrucción guardada en: {INPUT_ORDER_FILE}", flush=True)
     sys.stdout.flush()
 
-    # 2. Convertir la instrucción en pasos usando text_to_steps.py
+    # 2. Convertir la instrucción en pasos: primero con el planificador por reglas, la caché de planes y las
+    # plantillas de flujo aprendidas (todos sin LLM) y, si nada encaja, con text_to_steps.py
     print("\n[1] Generando pasos a partir de la instrucción...", flush=True)
     sys.stdout.flush()
-    try:
-        execute_command(["python", TEXT_TO_STEPS_SCRIPT, "--input", INPUT_ORDER_FILE, "--output", PARSED_STEPS_FILE])
-    except Exception as e:
-        print(f"❌ Fallo al generar pasos: {e}", flush=True)
-        sys.stdout.flush()
-        return
+    steps = rule_planner.planificar(instruction) if rule_planner else None
+    if steps is None and plan_cache_local is not None:
+        steps = plan_cache_local.buscar(instruction)
+    if steps is None and task_templates:
+        try:
+            steps = task_templates.plan_desde_plantilla(km, instruction)
+        except Exception as e:
+            print(f"WARNING: Fallo al buscar una plantilla de flujo: {e}. Se usará el planificador.", flush=True)
+
+    if steps is not None:
+        steps = step_schema.normalizar_plan(steps) # Las plantillas y la caché pueden guardar planes del formato antiguo
+        os.makedirs(os.path.dirname(PARSED_STEPS_FILE), exist_ok=True)
+        with open(PARSED_STEPS_FILE, "w", encoding="utf-8") as f:
+            json.dump(steps, f, indent=2, ensure_ascii=False)
+    else:
+        try:
+            execute_command(["python", TEXT_TO_STEPS_SCRIPT, "--input", INPUT_ORDER_FILE, "--output", PARSED_STEPS_FILE]
+                            + (["--no-rules"] if rule_planner else []))
+        except Exception as e:
+            print(f"❌ Fallo al generar pasos: {e}", flush=True)
+            sys.stdout.flush()
+            return
 
-    # 3. Leer los pasos generados
-    if not os.path.exists(PARSED_STEPS_FILE):
-        print(f"❌ Error: No se generó el archivo de pasos: {PARSED_STEPS_FILE}", flush=True)
-        sys.stdout.flush()
-        return
+        # 3. Leer los pasos generados
+        if not os.path.exists(PARSED_STEPS_FILE):
+            print(f"❌ Error: No se generó el archivo de pasos: {PARSED_STEPS_FILE}", flush=True)
+            sys.stdout.flush()
+            return
+
+        with open(PARSED_STEPS_FILE, "r", encoding="utf-8") as f:
+            steps = step_schema.normalizar_plan(json.load(f))
 
-    with open(PARSED_STEPS_FILE, "r", encoding="utf-8") as f:
-        steps = json.load(f)
+        # Guardar el plan como plantilla para las próximas órdenes de la misma forma
+        if task_templates:
+            try:
+                task_templates.aprender(km, instruction, steps, kb_journal)
+            except Exception as e:
+                print(f"WARNING: No se pudo guardar la plantilla de flujo: {e}", flush=True)
     print(f"📋 Pasos generados: {json.dumps(steps, indent=2, ensure_ascii=False)}", flush=True)
     sys.stdout.flush()
 
@@ -220,30 +324,18 @@ def process_instruction(instruction: str):
     sys.stdout.flush()
     for step_data in steps:
         step_num = step_data.get("step")
-        action = step_data.get("action", "").lower() # Convertir a minúsculas para facilitar el matching
+        verb = step_data.get("verb")
+        action = step_data.get("action", "")
 
         print(f"\n[Paso {step_num}] Acción: '{action}'", flush=True)
         sys.stdout.flush()
 
-        # Identificar el tipo de elemento para una búsqueda/cacheo más preciso
-        element_type = None
-        if "icono de" in action:
-            element_type = "icono"
-        elif "botón de" in action:
-            element_type = "boton" # Usar 'boton' para consistencia en Qdrant
-        elif "pestaña de" in action:
-            element_type = "pestaña"
-        elif "campo de entrada de" in action:
-            element_type = "campo_entrada"
-
-        if action.startswith("busca el icono de") or \
-            action.startswith("busca el botón de") or \
-            action.startswith("busca la pestaña de") or \
-            action.startswith("busca el campo de entrada de"):
-
-            element_description_query = action.replace("busca el icono de", "").replace("busca el botón de", "").replace("busca la pestaña de", "").replace("busca el campo de entrada de", "").strip()
-            if element_description_query.startswith("'") and element_description_query.endswith("'"):
-                element_description_query = element_description_query[1:-1]
+        # Tipo de elemento tal como se guarda en Qdrant, para una búsqueda/cacheo más preciso
+        element_type = TIPOS_ELEMENTO_KB.get((step_data.get("element_type") or "").lower())
+
+        if verb == "busca":
+            # Las descripciones de la base de conocimiento se han guardado siempre en minúsculas
+            element_description_query = (step_data.get("target") or "").lower()
 
             print(f"INFO: Buscando elemento UI: '{element_description_query}' en Qdrant...", flush=True)
             sys.stdout.flush()
@@ -260,6 +352,7 @@ def process_instruction(instruction: str):
                 # Se asume que image_path en Qdrant es relativa a project_root
                 cached_image_path = os.path.join(project_root, cached_element['image_path'])
                 cached_point_id = cached_element.get('id')
+                km.registrar_uso(cached_point_id, "hit")
 
                 # Verificar si la imagen en caché realmente existe en el disco
                 if os.path.exists(cached_image_path):
@@ -277,10 +370,12 @@ def process_instruction(instruction: str):
                         print("INFO: Ejecutando acción de clic en el elemento encontrado (desde caché)...", flush=True)
                         sys.stdout.flush()
                         execute_command(["python", EXECUTE_ACTIONS_SCRIPT, "click"])
+                        km.registrar_uso(cached_point_id, "success")
                         
                         # Si todo fue bien, no necesitamos el análisis completo. Pasamos al siguiente paso.
                         continue 
                     except Exception as e:
+                        km.registrar_uso(cached_point_id, "failure") # Baja su fiabilidad: pierde posiciones en próximas búsquedas
                         print(f"ERROR: Fallo al usar imagen de caché o ejecutar acción: {e}. Procediendo con análisis completo...", flush=True)
                         sys.stdout.flush()
                 else:
@@ -294,10 +389,7 @@ def process_instruction(instruction: str):
             # También pasamos el element_type y el point_id si ya existía para que se actualice.
             _perform_full_analysis_and_click(element_description_query, add_to_knowledge=True, element_type=element_type, point_id=cached_point_id)
 
-        elif action.startswith("haz clic en el icono de") or \
-            action.startswith("haz clic en el botón de") or \
-            action.startswith("haz clic en la pestaña de") or \
-            action.startswith("haz clic en el campo de entrada de"):
+        elif verb == "clic":
             print("🎯 Intentando ejecutar acción de clic en el elemento previamente encontrado o implícito...", flush=True)
             sys.stdout.flush()
             try:
@@ -307,8 +399,7 @@ def process_instruction(instruction: str):
                 sys.stdout.flush()
                 continue
 
-        elif action.startswith("haz doble clic en el icono de") or \
-            action.startswith("haz doble clic en el botón de"):
+        elif verb == "doble_clic":
             print("⚠️ Acción de doble clic no implementada directamente en execute_actions.py aún. Se realizará un clic simple.", flush=True)
             sys.stdout.flush()
             try:
@@ -318,7 +409,7 @@ def process_instruction(instruction: str):
                 sys.stdout.flush()
                 continue
 
-        elif action.startswith("haz clic derecho en"):
+        elif verb == "clic_derecho":
             print("⚠️ Acción de clic derecho no implementada directamente en execute_actions.py aún. Se realizará un clic simple.", flush=True)
             sys.stdout.flush()
             try:
@@ -328,8 +419,8 @@ def process_instruction(instruction: str):
                 sys.stdout.flush()
                 continue
 
-        elif action.startswith("escribe"):
-            text_to_write = action.replace("escribe", "").strip().strip("'\"")
+        elif verb == "escribe":
+            text_to_write = step_data.get("text") or ""
             print(f"⌨️ Escribiendo texto: '{text_to_write}'", flush=True)
             sys.stdout.flush()
             try:
@@ -339,8 +430,8 @@ def process_instruction(instruction: str):
                 sys.stdout.flush()
                 continue
 
-        elif action.startswith("presiona"):
-            key_to_press = action.replace("presiona", "").strip().strip("'\"").lower()
+        elif verb == "presiona":
+            key_to_press = (step_data.get("keys") or "").lower()
             print(f"⬇️ Presionando tecla: '{key_to_press}'", flush=True)
             sys.stdout.flush()
             try:
@@ -350,39 +441,39 @@ def process_instruction(instruction: str):
                 sys.stdout.flush()
                 continue
 
-        elif action.startswith("espera"):
-            if "segundos" in action:
-                try:
-                    delay_str = action.split("espera")[1].split("segundos")[0].strip()
-                    delay = float(delay_str)
+        elif verb == "espera":
+            # Ventana/menú esperado (ej. 'Configuración') o, si no lo hay, un tiempo de espera en segundos
+            nombre_esperado = step_data.get("target")
+            delay = step_data.get("wait_seconds")
+
+            if nombre_esperado is None and delay is not None:
+                if visual_waits:
+                    # Los segundos indicados son el tiempo máximo: se sigue en cuanto la pantalla cambia y deja de cambiar.
+                    # Justo después de un clic la pantalla aún no ha empezado a cambiar: primero se espera a que lo haga
+                    print(f"⏳ Esperando a que la pantalla se estabilice (máximo {delay} segundos)...", flush=True)
+                    visual_waits.esperar_pantalla_estable(timeout=delay, esperar_cambio=min(delay, visual_waits.VISUAL_WAIT_CHANGE_TIMEOUT))
+                else:
                     print(f"⏳ Esperando {delay} segundos...", flush=True)
-                    sys.stdout.flush()
                     time.sleep(delay)
-                except ValueError:
-                    print("⚠️ No se pudo parsear el tiempo de espera. Esperando 1 segundo por defecto.", flush=True)
-                    sys.stdout.flush()
-                    time.sleep(1)
-            elif "a que se abra la ventana" in action:
-                print("⏳ Esperando a que se abra la ventana... (simulado con 2 segundos)", flush=True)
-                sys.stdout.flush()
-                time.sleep(2) # Placeholder, en el futuro podría haber una detección de ventana
+            elif visual_waits:
+                # "a que se abra la ventana/el menú/la aplicación ...": por título de ventana o por cambio + estabilidad
+                print(f"⏳ Esperando a que se abra {nombre_esperado or 'la ventana'}...", flush=True)
+                visual_waits.esperar_ventana(nombre_esperado, timeout=delay or visual_waits.VISUAL_WAIT_TIMEOUT)
             else:
-                print("⏳ Espera no especificada. Esperando 1 segundo por defecto.", flush=True)
-                sys.stdout.flush()
-                time.sleep(1)
+                print("⏳ Esperas visuales no disponibles. Esperando 2 segundos.", flush=True)
+                time.sleep(2)
+            sys.stdout.flush()
 
-        elif action.startswith("haz scroll en"):
+        elif verb == "scroll":
             print("⚠️ Acción de scroll no implementada aún.", flush=True)
             sys.stdout.flush()
-            time.sleep(1) # Pequeña pausa para simular
 
-        elif action.startswith("selecciona"):
+        elif verb == "selecciona":
             print(f"⚠️ Acción de selección '{action}' no implementada aún.", flush=True)
             sys.stdout.flush()
-            time.sleep(1) # Pequeña pausa para simular
 
-        elif action.startswith("busca en google"):
-            query = action.replace("busca en google", "").strip().strip("'\"")
+        elif verb == "busca_en_google":
+            query = step_data.get("text") or ""
             print(f"🌐 Realizando búsqueda en Google para: '{query}'", flush=True)
             sys.stdout.flush()
             if google_search:
@@ -402,10 +493,9 @@ def process_instruction(instruction: str):
             else:
                 print("ERROR: 'google_search' no está disponible. No se puede realizar la búsqueda.", flush=True)
             sys.stdout.flush()
-            time.sleep(1)
 
-        elif action.startswith("recuérdame"):
-            reminder_text = action.replace("recuérdame", "").strip().strip("'\"")
+        elif verb == "recuerda":
+            reminder_text = step_data.get("text") or ""
             print(f"⏰ Creando recordatorio: '{reminder_text}'", flush=True)
             sys.stdout.flush()
             if generic_reminders:
@@ -417,9 +507,8 @@ def process_instruction(instruction: str):
             else:
                 print("ERROR: 'generic_reminders' no está disponible. No se puede crear el recordatorio.", flush=True)
             sys.stdout.flush()
-            time.sleep(1)
 
-        elif action.startswith("muestra mis recordatorios"):
+        elif verb == "muestra_recordatorios":
             print("📅 Mostrando recordatorios...", flush=True)
             sys.stdout.flush()
             if generic_reminders:
@@ -436,18 +525,14 @@ def process_instruction(instruction: str):
             else:
                 print("ERROR: 'generic_reminders' no está disponible. No se pueden mostrar los recordatorios.", flush=True)
             sys.stdout.flush()
-            time.sleep(1)
 
-        elif action.startswith("reconoce que la instrucción es una prueba de audio") or \
-            action.startswith("saluda al usuario"):
+        elif verb in ("prueba", "saluda"):
             print(f"✅ Acción de reconocimiento o saludo: '{action}'", flush=True)
             sys.stdout.flush()
-            time.sleep(1)
 
         else:
             print(f"🤷‍♂️ Acción no reconocida o no implementada: '{action}'", flush=True)
             sys.stdout.flush()
-            time.sleep(1)
 
     print("\n--- Ejecución de pasos finalizada ---", flush=True)
     sys.stdout.flush()
@@ -456,7 +541,29 @@ def process_instruction(instruction: str):
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         user_instruction = " ".join(sys.argv[1:])
-        process_instruction(user_instruction)
+        if frame_grabber:
+            frame_grabber.get_grabber() # Arranca el capturador continuo si está habilitado
+        try:
+            # Como mucho una vez cada KB_CLEANUP_INTERVAL_HOURS: borra elementos caducados y degrada los que fallan
+            kb_tools.limpiar_por_uso_si_toca()
+        except Exception as e:
+            print(f"WARNING: No se pudo hacer la limpieza por uso de la base de conocimiento: {e}", flush=True)
+        try:
+            # Como mucho una vez cada IMAGE_STORE_GC_INTERVAL_HOURS: deja la caché compacta y sin puntos rotos,
+            # en vez de descubrirlo al hacer clic (main.py se lanza una vez por instrucción)
+            kb_tools.reconciliar_imagenes_si_toca()
+        except Exception as e:
+            print(f"WARNING: No se pudo reconciliar el almacén de imágenes: {e}", flush=True)
+        if km.embedding_runtime.EMBEDDING_WARMUP:
+            # La carga del codificador se solapa con la planificación en lugar de retrasar la primera búsqueda
+            threading.Thread(target=km.calentar_modelo, name="embedding-warmup", daemon=True).start()
+        journal_worker = kb_journal.get_worker(km) if kb_journal else None
+        try:
+            process_instruction(user_instruction)
+        finally:
+            km.vaciar_uso()
+            if journal_worker:
+                journal_worker.stop(vaciar=True) # Lo que no se pueda enviar ahora queda en el diario para la próxima ejecución
     else:
         print("Uso: python main.py \"[tu instrucción aquí]\"", flush=True)
         print("Ej: python main.py \"abre la aplicación MicroWin\"", flush=True)
@@ -44,6 +44,18 @@ try:
         sys.stdout.flush()
         sys.exit(1)
 
+    # Diario de escrituras diferidas: las altas en la base de conocimiento no bloquean el clic
+    import kb_journal
+    # Almacén de imágenes de referencia direccionado por contenido (qdrant_ui_cache/<sha256>.png)
+    import image_store
+    # Contexto de la pantalla (aplicación, ventana, SO/tema, resolución) con el que se etiqueta cada elemento
+    import ui_context
+
+    # Importar el módulo de captura (multi-monitor y traducción de coordenadas)
+    from script import screenshot as screenshot_mod
+    # Índice de estados de pantalla: reutiliza ubicaciones ya resueltas sobre la misma pantalla
+    from script import screen_state_index
+
     # ==== CARGAR API KEY ====
     load_dotenv()
     API_KEY = os.getenv("API_KEY")
@@ -85,9 +97,12 @@ try:
         sys.exit(1)
 
     # ==== CONFIGURACION DE CARPETAS PERMANENTES Y TEMPORALES ====
-    QDRANT_UI_CACHE_DIR = os.path.join(project_root, "qdrant_ui_cache")
+    QDRANT_UI_CACHE_DIR = image_store.IMAGE_STORE_DIR # qdrant_ui_cache/, salvo que IMAGE_STORE_DIR diga otra cosa
     os.makedirs(QDRANT_UI_CACHE_DIR, exist_ok=True) # Asegurarse de que exista
 
+    SCREEN_STATE_INDEX_ENABLED = os.getenv("SCREEN_STATE_INDEX_ENABLED", "true").lower() == "true"
+    indice_estados = screen_state_index.ScreenStateIndex() if SCREEN_STATE_INDEX_ENABLED else None
+
     # ==== LIMPIAR DATOS ANTERIORES ====
     def limpiar_directorios_y_archivos():
         # Excluir QDRANT_UI_CACHE_DIR de la limpieza
@@ -148,7 +163,7 @@ try:
                 path = os.path.join(output_dir, nombre)
                 try:
                     cv2.imwrite(path, recorte)
-                    cuadrantes.append((nombre, path))
+                    cuadrantes.append((nombre, path, (x1, y1))) # Guardamos el origen del cuadrante en la captura
                 except Exception as e:
                     print(f"ERROR: No se pudo guardar el cuadrante '{nombre}': {e}", flush=True)
                     sys.stdout.flush()
@@ -172,7 +187,7 @@ try:
             {"type": "text", "text": f"Dada la descripción '{descripcion}', ¿en cuál de estos cuadrantes está el elemento? Responde SOLO con el número del cuadrante (del 1 al {len(cuadrantes)}) que contenga el elemento. Si el elemento no es visible o no estás seguro, responde con '0'. Analiza todos los cuadrantes antes de decidir."}
         ]
 
-        for idx, (_, path) in enumerate(cuadrantes): # Usar enumerate para obtener el índice y el número de cuadrante
+        for idx, (_, path, _) in enumerate(cuadrantes): # Usar enumerate para obtener el índice y el número de cuadrante
             try:
                 with open(path, "rb") as img_file:
                     imagen_b64 = base64.b64encode(img_file.read()).decode("utf-8")
@@ -315,6 +330,10 @@ try:
             return final
 
         def crop_icons(self, image, icons, output_dir_name="iconos_recortados"):
+            """
+            Recorta los iconos y devuelve una lista de tuplas (ruta, (x1, y1, x2, y2)),
+            con el rectángulo del recorte en coordenadas de la imagen de entrada.
+            """
             output_dir = os.path.join(project_root, output_dir_name)
             os.makedirs(output_dir, exist_ok=True)
             cropped = []
@@ -329,7 +348,7 @@ try:
                 filename = os.path.join(output_dir, f"icono_{i+1:03d}.png")
                 try:
                     cv2.imwrite(filename, recorte)
-                    cropped.append(filename)
+                    cropped.append((filename, (x1, y1, x2, y2)))
                 except Exception as e:
                     print(f"ERROR: No se pudo guardar el icono recortado '{filename}': {e}", flush=True)
                     sys.stdout.flush()
@@ -478,7 +497,7 @@ try:
                         "type": "text",
                         "text": f"Elemento ID {elemento_id} (Tipo: {elemento_tipo}): {final_desc_for_prompt if final_desc_for_prompt else 'Sin descripcion textual/OCR'}"
                     })
-                    elementos_info.append({"id": elemento_id, "path": elemento_path, "description": final_desc_for_prompt, "type": elemento_tipo})
+                    elementos_info.append({"id": elemento_id, "path": elemento_path, "description": final_desc_for_prompt, "type": elemento_tipo, "bbox": elemento.get('bbox')})
                 except Exception as e:
                     print(f"WARNING: Error al procesar elemento {elemento_path} para GPT: {e}. Saltando.", flush=True)
                     sys.stdout.flush()
@@ -531,8 +550,64 @@ try:
             traceback.print_exc()
             return None
 
+    # ==== UBICACION GLOBAL DEL ELEMENTO ====
+    def guardar_ubicacion_elemento(bbox_captura, monitor_meta, image_path):
+        """
+        Traduce el rectángulo del elemento (en píxeles de la captura) a coordenadas del
+        escritorio virtual y lo guarda en 'capture/location.json' para execute_actions.py,
+        junto con la huella del recorte para que solo se use con esa misma imagen.
+        """
+        bbox_virtual = screenshot_mod.to_virtual_bbox(bbox_captura, monitor_meta)
+        ubicacion = {
+            "monitor": monitor_meta.get("monitor", 1),
+            "bbox_captura": list(bbox_captura),
+            "bbox_virtual": list(bbox_virtual),
+            "center": [(bbox_virtual[0] + bbox_virtual[2]) // 2, (bbox_virtual[1] + bbox_virtual[3]) // 2],
+            "image_sha1": screenshot_mod.huella_archivo(image_path)
+        }
+        ubicacion_path = os.path.join(project_root, "capture", "location.json")
+        try:
+            os.makedirs(os.path.dirname(ubicacion_path), exist_ok=True)
+            with open(ubicacion_path, 'w', encoding='utf-8') as f:
+                json.dump(ubicacion, f, indent=2)
+            print(f"INFO: Ubicacion del elemento en el escritorio virtual: {ubicacion['bbox_virtual']} (monitor {ubicacion['monitor']}).", flush=True)
+        except Exception as e:
+            print(f"WARNING: No se pudo guardar la ubicacion del elemento: {e}", flush=True)
+        sys.stdout.flush()
+        return ubicacion
+
     # ==== FUNCIÓN PRINCIPAL DE ANÁLISIS ====
-    def analizar_pantalla_para_elemento(imagen_path, descripcion_buscada):
+    def almacenar_elemento_sincrono(elemento, final_description, point_id, metadata):
+        """
+        Alta síncrona en Qdrant (KB_JOURNAL_ENABLED=false): la imagen se guarda primero en el almacén
+        direccionado por contenido y el punto se crea (o actualiza) ya con su ruta y su hash. Devuelve (point_id, ruta permanente).
+        """
+        try:
+            image_hash, permanent_filepath = image_store.guardar_imagen(elemento['path'])
+        except Exception as e:
+            print(f"ERROR: No se pudo guardar el icono en el almacén de imágenes: {e}", flush=True)
+            sys.stdout.flush()
+            return None, None
+
+        # La función 'km.add_ui_element' espera la descripción y el tipo como primeros argumentos,
+        # y ya calcula el embedding internamente.
+        point_id = km.add_ui_element(
+            description=final_description,
+            element_type=elemento['type'],
+            image_path=image_store.ruta_relativa(permanent_filepath),
+            ocr_text=elemento.get('descripcion_texto'), # Usamos el texto OCR si existe
+            metadata=dict(metadata, image_hash=image_hash),
+            point_id=point_id
+        )
+        if not point_id:
+            print("ERROR: No se pudo obtener un ID de Qdrant para almacenar el elemento. Saliendo.", flush=True)
+            sys.stdout.flush()
+            return None, None
+
+        print(f"INFO: Elemento UI '{final_description}' añadido/actualizado en Qdrant con ID: {point_id} y ruta permanente.", flush=True)
+        return point_id, permanent_filepath
+
+    def analizar_pantalla_para_elemento(imagen_path, descripcion_buscada, monitor_meta=None, element_type=None, point_id=None):
         print(f"INFO: Verificando la imagen de pantalla en: {imagen_path}", flush=True)
         sys.stdout.flush()
 
@@ -544,6 +619,29 @@ try:
         print(f"INFO: Captura de pantalla encontrada en '{imagen_path}'. Procediendo...", flush=True)
         sys.stdout.flush()
 
+        if monitor_meta is None:
+            monitor_meta = screenshot_mod.load_screenshot_meta(imagen_path)
+
+        # Paso 0: Si esta misma pantalla ya se vio y el elemento ya se resolvió en ella, reutilizar la ubicación
+        huella = None
+        if indice_estados is not None:
+            imagen_pantalla = cv2.imread(imagen_path)
+            if imagen_pantalla is not None:
+                huella = screen_state_index.calcular_huella(imagen_pantalla)
+                entrada = indice_estados.buscar(huella, descripcion_buscada)
+                if entrada and screen_state_index.recorte_coincide(imagen_pantalla, entrada["bbox_captura"], entrada["image_path"]):
+                    final_capture_dir = os.path.join(project_root, "capture")
+                    os.makedirs(final_capture_dir, exist_ok=True)
+                    final_capture_path = os.path.join(final_capture_dir, "image.png")
+                    shutil.copy(entrada["image_path"], final_capture_path)
+                    guardar_ubicacion_elemento(entrada["bbox_captura"], monitor_meta, entrada["image_path"])
+                    print(f"\nPROCESO COMPLETADO (estado de pantalla en cache, sin llamadas a GPT). Elemento '{entrada.get('description')}' en '{final_capture_path}'", flush=True)
+                    sys.stdout.flush()
+                    return final_capture_path
+                elif entrada:
+                    print("INFO: La ubicacion guardada ya no coincide con la pantalla. Invalidando y analizando de nuevo.", flush=True)
+                    indice_estados.invalidar(huella, descripcion_buscada)
+
         # Limpiar directorios temporales
         limpiar_directorios_y_archivos()
 
@@ -566,17 +664,19 @@ try:
         # Paso 3: Analizar elementos visuales (iconos, texto, pestañas) en el cuadrante
         print(f"\nINFO: Paso 3/5: Analizando elementos visuales (iconos, texto, pestañas) en el cuadrante: {cuadrante_relevante_path}", flush=True)
         
+        origen_cuadrante = next(origen for _, path, origen in cuadrantes if path == cuadrante_relevante_path)
         imagen_cuadrante, iconos_bboxes = IconDetector().detect_icons(cuadrante_relevante_path)
-        iconos_recortados_paths = IconDetector().crop_icons(imagen_cuadrante, iconos_bboxes)
+        iconos_recortados = IconDetector().crop_icons(imagen_cuadrante, iconos_bboxes)
 
         elementos_detectados_para_gpt = []
 
         # Procesar iconos
-        for icono_path in iconos_recortados_paths:
+        for icono_path, icono_bbox in iconos_recortados:
             descripcion_gpt = analizar_icono_con_gpt(icono_path)
             elementos_detectados_para_gpt.append({
                 "type": "icono",
                 "path_imagen": icono_path,
+                "bbox": icono_bbox, # Rectángulo dentro del cuadrante
                 "descripcion_gpt": descripcion_gpt # Descripción generada por GPT
             })
         
@@ -593,6 +693,7 @@ try:
             elementos_detectados_para_gpt.append({
                 "type": "texto_ocr",
                 "path_imagen": cuadrante_relevante_path, # Se refiere al cuadrante completo con el texto
+                "bbox": (0, 0, imagen_cuadrante.shape[1], imagen_cuadrante.shape[0]),
                 "descripcion_texto": f"Texto OCR detectado: {texto_ocr_raw}"
             })
         
@@ -618,6 +719,12 @@ try:
         print(f"INFO: Elemento seleccionado: {os.path.basename(elemento_final_seleccionado['path'])} (Tipo: {elemento_final_seleccionado['type']}, Descripcion: {desc_para_log})", flush=True)
         sys.stdout.flush()
 
+        # Pasar el rectángulo del elemento de coordenadas del cuadrante a coordenadas de la captura
+        bx1, by1, bx2, by2 = elemento_final_seleccionado['bbox']
+        ox, oy = origen_cuadrante
+        bbox_captura = (bx1 + ox, by1 + oy, bx2 + ox, by2 + oy)
+        guardar_ubicacion_elemento(bbox_captura, monitor_meta, elemento_final_seleccionado['path'])
+
         # Paso 4.1: Analizar con GPT-4o el elemento seleccionado para una descripción detallada (si es un icono)
         # Re-evaluamos final_description para asegurarnos que sea la más completa
         final_description = elemento_final_seleccionado.get('descripcion_gpt')
@@ -639,44 +746,39 @@ try:
 
         # Paso 4.2: Almacenar el elemento en la base de conocimiento (Qdrant)
         print("\nINFO: Paso 4.2/5: Almacenando el elemento en la base de conocimiento (Qdrant)...", flush=True)
-        
-        # La función 'km.add_ui_element' espera la descripción y el tipo como primeros argumentos,
-        # y ya calcula el embedding internamente.
-        # También puede recibir 'image_path' y 'ocr_text' como argumentos opcionales.
-        point_id = km.add_ui_element(
-            description=final_description,
-            element_type=elemento_final_seleccionado['type'],
-            # La 'image_path' inicial puede ser None, ya que la actualizamos después de copiar la imagen permanente.
-            # No pasamos el 'embedding' directamente aquí, porque 'add_ui_element' lo genera.
-            # También podemos pasar el texto OCR si lo tenemos y es relevante para la entrada inicial
-            ocr_text=elemento_final_seleccionado.get('descripcion_texto') # Usamos el texto OCR si existe
-        )
-
-        if point_id:
-            # Una vez tenemos el point_id de Qdrant, construimos la ruta permanente para la imagen
-            extension = os.path.splitext(elemento_final_seleccionado['path'])[1] 
-            permanent_filename = f"{point_id}{extension}"
-            permanent_filepath = os.path.join(QDRANT_UI_CACHE_DIR, permanent_filename)
 
+        # El ID del punto es el que indica main.py (elemento ya conocido cuya imagen falta) o uno determinista
+        # derivado de lo que se buscó, de modo que volver a aprender el mismo elemento actualiza el punto existente.
+        # El contexto se captura ahora (con la aplicación aún en primer plano), no cuando el diario lo envíe a Qdrant.
+        tipo_elemento = element_type or elemento_final_seleccionado['type']
+        contexto = ui_context.contexto_actual()
+        point_id = point_id or km.id_determinista(descripcion_buscada, tipo_elemento, contexto.get("app"))
+        metadata_elemento = dict(contexto, query_description=descripcion_buscada)
+
+        if kb_journal.KB_JOURNAL_ENABLED:
+            # Escritura diferida: la imagen se guarda en el almacén direccionado por contenido y el alta
+            # (con la ruta incluida) se anota en el diario. El worker de main.py la envía a Qdrant en segundo plano.
             try:
-                # Copiamos la imagen temporal a la carpeta permanente de caché de Qdrant
-                shutil.copy(elemento_final_seleccionado['path'], permanent_filepath) 
-                print(f"INFO: Icono '{os.path.basename(elemento_final_seleccionado['path'])}' copiado a la cache permanente: {permanent_filepath}", flush=True)
-                
-                # Y AHORA SÍ, ACTUALIZAMOS el payload en Qdrant con la ruta permanente correcta
-                km.update_ui_element_payload(point_id, {"image_path": permanent_filepath})
-                print(f"INFO: Elemento UI '{final_description}' añadido/actualizado en Qdrant con ID: {point_id} y ruta permanente.", flush=True)
-
+                image_hash, permanent_filepath = image_store.guardar_imagen(elemento_final_seleccionado['path'])
+                kb_journal.encolar_ui_element(
+                    description=final_description,
+                    element_type=tipo_elemento,
+                    image_path=image_store.ruta_relativa(permanent_filepath),
+                    ocr_text=elemento_final_seleccionado.get('descripcion_texto'),
+                    metadata=dict(metadata_elemento, image_hash=image_hash),
+                    point_id=point_id
+                )
             except Exception as e:
-                print(f"ERROR: No se pudo copiar o actualizar la ruta del icono en Qdrant para el elemento ID {point_id}: {e}", flush=True)
+                print(f"ERROR: No se pudo guardar el icono o anotar el elemento ID {point_id} en el diario: {e}", flush=True)
                 sys.stdout.flush()
                 return None
         else:
-            print("ERROR: No se pudo obtener un ID de Qdrant para almacenar el elemento. Saliendo.", flush=True)
-            sys.stdout.flush()
-            return None
+            point_id, permanent_filepath = almacenar_elemento_sincrono(dict(elemento_final_seleccionado, type=tipo_elemento), final_description,
+                                                                      point_id, metadata_elemento)
+            if point_id is None:
+                return None
 
-        print(f"INFO: Elemento '{final_description}' almacenado en Qdrant.", flush=True)
+        print(f"INFO: Elemento '{final_description}' almacenado en Qdrant{' (via diario)' if kb_journal.KB_JOURNAL_ENABLED else ''}.", flush=True)
         sys.stdout.flush()
 
         # Paso 5: Preparar imagen final para clic automatizado (copiar a 'capture' para execute_actions.py)
@@ -705,6 +807,15 @@ try:
             print(f"WARNING: No se pudo guardar la descripción en el archivo JSON: {e}", flush=True)
             sys.stdout.flush()
 
+        # Registrar la ubicación en el índice de estados de pantalla para la próxima vez
+        if indice_estados is not None and huella:
+            indice_estados.registrar(huella, descripcion_buscada, {
+                "bbox_captura": list(bbox_captura),
+                "image_path": permanent_filepath,
+                "point_id": point_id,
+                "description": final_description
+            })
+
         print(f"\nPROCESO COMPLETADO. Elemento relevante guardado en '{final_capture_path}' y descripcion en '{iconos_descripciones_path}'", flush=True)
         sys.stdout.flush()
         
@@ -720,13 +831,27 @@ try:
         parser.add_argument("--element_type", type=str, default=None,
                             help="Tipo de elemento (ej. 'icono', 'boton', 'campo_entrada').")
         parser.add_argument("--point_id", type=str, default=None,
-                            help="ID del punto en Qdrant a actualizar, si existe.")
+                            help="ID del punto en Qdrant a actualizar, si existe. Si no, se usa un ID determinista (descripción, tipo, aplicación).")
+        parser.add_argument("--monitors", type=str, default=None,
+                            help="Monitores a analizar en orden de prioridad (ej. '2,1' o 'all'). Se captura cada uno y se para en el primero donde se encuentre el elemento. Por defecto se analiza la captura existente.")
         
         args = parser.parse_args()
 
-        screenshot_path = os.path.join(project_root, "screenshots", "pantalla.png")
-        
-        elemento_encontrado_path = analizar_pantalla_para_elemento(screenshot_path, args.descripcion)
+        screenshot_path = screenshot_mod.SCREENSHOT_PATH
+
+        elemento_encontrado_path = None
+        if args.monitors:
+            for monitor_index in screenshot_mod.parse_monitor_priority(args.monitors):
+                print(f"\nINFO: Analizando monitor {monitor_index}...", flush=True)
+                monitor_meta = screenshot_mod.take_screenshot(monitor_index, screenshot_path)
+                elemento_encontrado_path = analizar_pantalla_para_elemento(screenshot_path, args.descripcion, monitor_meta,
+                                                                           element_type=args.element_type, point_id=args.point_id)
+                if elemento_encontrado_path:
+                    break
+                print(f"INFO: Elemento no encontrado en el monitor {monitor_index}.", flush=True)
+        else:
+            elemento_encontrado_path = analizar_pantalla_para_elemento(screenshot_path, args.descripcion,
+                                                                       element_type=args.element_type, point_id=args.point_id)
 
         if elemento_encontrado_path:
             sys.exit(0)
@@ -1,8 +1,14 @@
 import pyautogui
 import os
 import sys
+import json
 import time
 import traceback # Import traceback for detailed error info
+import cv2
+import mss
+import numpy as np
+
+import screenshot # Configuración de monitores y traducción de coordenadas (script/screenshot.py)
 
 # --- Configurar la codificación de la salida de la consola al inicio ---
 try:
@@ -16,6 +22,55 @@ except Exception as e:
 # Ruta donde se espera encontrar la imagen a buscar y hacer clic
 # Asumiendo que execute_actions.py está en 'script' y 'capture' está en la raíz
 IMAGE_TO_CLICK_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'capture', 'image.png')
+# Ubicación (monitor y rectángulo global) escrita por analizar_iconos.py tras un análisis completo
+LOCATION_HINT_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'capture', 'location.json')
+
+def monitores_para_buscar(image_path: str = IMAGE_TO_CLICK_PATH) -> list:
+    """
+    Devuelve los monitores en orden de prioridad: primero el indicado por el último análisis
+    (si 'capture/location.json' corresponde a esta misma imagen y a un monitor configurado),
+    después los configurados en SCREENSHOT_MONITORS.
+    """
+    monitores = screenshot.parse_monitor_priority()
+    try:
+        with open(LOCATION_HINT_PATH, "r", encoding="utf-8") as f:
+            ubicacion = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return monitores
+    monitor_hint = ubicacion.get("monitor")
+    if monitor_hint is None or ubicacion.get("image_sha1") != screenshot.huella_archivo(image_path):
+        return monitores # Pista de otro análisis (o de una imagen sacada de la base de conocimiento)
+    if monitor_hint not in monitores and monitores != [0]:
+        print(f"WARNING: Ignorando la pista del monitor {monitor_hint}: no está en SCREENSHOT_MONITORS.", flush=True)
+        return monitores
+    return [monitor_hint] + [m for m in monitores if m != monitor_hint]
+
+def localizar_en_monitores(image_path: str, confidence: float, monitores: list):
+    """
+    Busca la imagen en cada monitor por orden de prioridad y se detiene en el primero donde aparezca.
+    Devuelve (x, y, monitor, confianza) con el centro en coordenadas del escritorio virtual, o None.
+    """
+    plantilla = cv2.imread(image_path)
+    if plantilla is None:
+        print(f"ERROR: No se pudo cargar la imagen de referencia: {image_path}", flush=True)
+        return None
+    alto, ancho = plantilla.shape[:2]
+    with mss.mss() as sct:
+        for monitor_index in monitores:
+            if monitor_index >= len(sct.monitors):
+                print(f"WARNING: El monitor {monitor_index} no existe. Saltando.", flush=True)
+                continue
+            monitor = sct.monitors[monitor_index]
+            frame = np.array(sct.grab(monitor))[:, :, :3] # BGRA -> BGR
+            if frame.shape[0] < alto or frame.shape[1] < ancho:
+                continue
+            resultado = cv2.matchTemplate(frame, plantilla, cv2.TM_CCOEFF_NORMED)
+            _, max_val, _, max_loc = cv2.minMaxLoc(resultado)
+            print(f"DEBUG: Monitor {monitor_index}: confianza maxima {max_val:.3f}", flush=True)
+            if max_val >= confidence:
+                x, y = screenshot.to_virtual_coords(max_loc[0] + ancho // 2, max_loc[1] + alto // 2, monitor)
+                return x, y, monitor_index, max_val
+    return None
 
 def click_on_image(image_path: str, confidence: float = 0.7): # Confianza reducida a 0.7
     """
@@ -26,6 +81,23 @@ def click_on_image(image_path: str, confidence: float = 0.7): # Confianza reduci
         sys.stdout.flush()
         sys.exit(1) # Salir con error si la imagen no existe
 
+    monitores = monitores_para_buscar(image_path)
+    if monitores != [1]:
+        # Configuración multi-monitor: pyautogui.locateOnScreen solo mira el monitor principal,
+        # así que buscamos en cada monitor con mss y traducimos a coordenadas globales.
+        print(f"INFO: Buscando imagen '{image_path}' en los monitores {monitores} con confianza {confidence}...", flush=True)
+        sys.stdout.flush()
+        encontrado = localizar_en_monitores(image_path, confidence, monitores)
+        if encontrado:
+            center_x, center_y, monitor_index, max_val = encontrado
+            print(f"INFO: Imagen encontrada en el monitor {monitor_index} (confianza {max_val:.3f}). Haciendo clic en ({center_x}, {center_y}).", flush=True)
+            sys.stdout.flush()
+            pyautogui.tripleClick(center_x, center_y)
+            return True
+        print(f"WARNING: No se pudo localizar la imagen '{image_path}' en ninguno de los monitores {monitores}.", flush=True)
+        sys.stdout.flush()
+        sys.exit(1)
+
     print(f"INFO: Buscando imagen '{image_path}' en pantalla con confianza {confidence}...", flush=True)
     sys.stdout.flush()
     try:
@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import time
+import threading
+from collections import deque
+
+import mss
+import mss.tools
+import numpy as np
+
+try:
+    from script import screenshot # Importado desde la raíz del proyecto (main.py)
+except ImportError:
+    import screenshot # Importado desde la carpeta 'script'
+
+# --- Configurar la codificación de la salida de la consola al inicio ---
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+except AttributeError:
+    pass
+except Exception as e:
+    print(f"WARNING: No se pudo reconfigurar la codificacion de la consola: {e}", flush=True)
+
+# --- Configuración del capturador continuo (opcional) ---
+FRAME_GRABBER_ENABLED = os.getenv("FRAME_GRABBER_ENABLED", "false").lower() == "true"
+FRAME_GRABBER_FPS = float(os.getenv("FRAME_GRABBER_FPS", "4")) # Capturas por segundo (frecuencia baja a propósito)
+FRAME_GRABBER_BUFFER_SIZE = int(os.getenv("FRAME_GRABBER_BUFFER_SIZE", "16")) # Nº de frames recientes en memoria
+
+
+class FrameGrabber:
+    """
+    Captura la pantalla de forma continua en un hilo de fondo con un único handle de mss abierto.
+    Los frames (arrays NumPy BGR) se guardan con su timestamp en un buffer circular de tamaño fijo,
+    así que los consumidores obtienen el último frame sin codificar ni decodificar PNG.
+    """
+
+    def __init__(self, monitor_index: int = None, fps: float = FRAME_GRABBER_FPS, buffer_size: int = FRAME_GRABBER_BUFFER_SIZE):
+        self.monitor_index = monitor_index if monitor_index is not None else screenshot.parse_monitor_priority()[0]
+        self.interval = 1.0 / max(fps, 0.1)
+        self.buffer = deque(maxlen=buffer_size)
+        self.monitor_meta = None
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return self
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="FrameGrabber", daemon=True)
+        self._thread.start()
+        # Esperar al primer frame para que latest() no devuelva None justo después de arrancar
+        self.wait_for_frame(after=0, timeout=2.0)
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        # El handle de mss se crea dentro del hilo: en Windows no puede compartirse entre hilos.
+        try:
+            with mss.mss() as sct:
+                if self.monitor_index >= len(sct.monitors):
+                    print(f"WARNING: El monitor {self.monitor_index} no existe. Usando el monitor principal.", flush=True)
+                    self.monitor_index = 1
+                monitor = sct.monitors[self.monitor_index]
+                self.monitor_meta = {"monitor": self.monitor_index, "left": monitor["left"], "top": monitor["top"],
+                                     "width": monitor["width"], "height": monitor["height"]}
+                print(f"INFO: Capturador continuo iniciado en el monitor {self.monitor_index} a {1.0 / self.interval:.1f} fps.", flush=True)
+                while not self._stop_event.is_set():
+                    inicio = time.monotonic()
+                    frame = np.array(sct.grab(monitor))[:, :, :3] # BGRA -> BGR
+                    with self._condition:
+                        self.buffer.append((time.time(), frame))
+                        self._condition.notify_all()
+                    self._stop_event.wait(max(0.0, self.interval - (time.monotonic() - inicio)))
+        except Exception as e:
+            print(f"ERROR: El capturador continuo se detuvo: {e}", flush=True)
+            sys.stdout.flush()
+
+    def latest(self):
+        """
+        Devuelve (timestamp, frame) del último frame capturado, o None si aún no hay ninguno.
+        """
+        with self._condition:
+            return self.buffer[-1] if self.buffer else None
+
+    def frames(self) -> list:
+        """
+        Devuelve una copia de la lista de (timestamp, frame) del buffer, del más antiguo al más reciente.
+        """
+        with self._condition:
+            return list(self.buffer)
+
+    def wait_for_frame(self, after: float, timeout: float = 1.0):
+        """
+        Espera a que haya un frame con timestamp posterior a 'after'. Devuelve (timestamp, frame) o None.
+        """
+        limite = time.monotonic() + timeout
+        with self._condition:
+            while not self.buffer or self.buffer[-1][0] <= after:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    return None
+                self._condition.wait(restante)
+            return self.buffer[-1]
+
+    def save_latest(self, output_path: str = screenshot.SCREENSHOT_PATH) -> dict:
+        """
+        Guarda el último frame como PNG (con sus metadatos de monitor), para los consumidores
+        que trabajan con archivos, como analizar_iconos.py. Devuelve los metadatos o None.
+        """
+        ultimo = self.latest()
+        if ultimo is None:
+            return None
+        timestamp, frame = ultimo
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        alto, ancho = frame.shape[:2]
+        mss.tools.to_png(np.ascontiguousarray(frame[:, :, ::-1]).tobytes(), (ancho, alto), output=output_path) # BGR -> RGB
+        monitor_meta = dict(self.monitor_meta, timestamp=timestamp)
+        with open(screenshot.meta_path_for(output_path), "w", encoding="utf-8") as f:
+            json.dump(monitor_meta, f, indent=2)
+        print(f"INFO: Último frame del capturador continuo guardado en: {output_path}", flush=True)
+        return monitor_meta
+
+
+def diferencia_entre_frames(frame_a, frame_b, region: tuple = None, escala: int = 4) -> float:
+    """
+    Diferencia media absoluta (0-255) entre dos frames, en escala de grises y submuestreados
+    para que la comparación sea barata. 'region' es un rectángulo opcional (x1, y1, x2, y2).
+    """
+    if frame_a is None or frame_b is None or frame_a.shape != frame_b.shape:
+        return 255.0
+    if region:
+        x1, y1, x2, y2 = region
+        frame_a = frame_a[y1:y2, x1:x2]
+        frame_b = frame_b[y1:y2, x1:x2]
+    gris_a = frame_a[::escala, ::escala].mean(axis=2)
+    gris_b = frame_b[::escala, ::escala].mean(axis=2)
+    return float(np.abs(gris_a - gris_b).mean())
+
+
+# Capturador compartido por el proceso (main.py lo arranca si FRAME_GRABBER_ENABLED=true)
+_grabber = None
+
+
+def get_grabber(start: bool = FRAME_GRABBER_ENABLED):
+    """
+    Devuelve el capturador continuo del proceso. Si 'start' es True y no existe, lo crea y arranca.
+    """
+    global _grabber
+    if _grabber is None and start:
+        _grabber = FrameGrabber().start()
+    return _grabber
+
+
+if __name__ == "__main__":
+    print("--- Probando el capturador continuo durante 3 segundos ---", flush=True)
+    with FrameGrabber(fps=FRAME_GRABBER_FPS) as grabber:
+        time.sleep(3)
+        frames = grabber.frames()
+        print(f"INFO: {len(frames)} frames en el buffer.", flush=True)
+        if len(frames) >= 2:
+            print(f"INFO: Diferencia entre los dos últimos frames: {diferencia_entre_frames(frames[-2][1], frames[-1][1]):.2f}", flush=True)
+    print("--- Prueba finalizada ---", flush=True)
@@ -0,0 +1,222 @@
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+import unicodedata
+
+# --- Configurar la codificación de la salida de la consola al inicio ---
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+except AttributeError:
+    pass
+except Exception as e:
+    print(f"WARNING: No se pudo reconfigurar la codificacion de la consola: {e}", flush=True)
+
+# --- Configuración ---
+# Caché local instrucción -> plan delante del planificador LLM: las órdenes idénticas o casi idénticas
+# ("clic en acceso directo a Ollama" / "Clic en acceso directo Ollama") reutilizan el plan ya generado.
+PLAN_CACHE_ENABLED = os.getenv("PLAN_CACHE_ENABLED", "true").lower() == "true"
+PLAN_CACHE_PATH = os.getenv("PLAN_CACHE_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "parsed_steps", "plan_cache.sqlite"))
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "2000")) # Se descartan los menos usados recientemente
+PLAN_CACHE_FUZZY_THRESHOLD = float(os.getenv("PLAN_CACHE_FUZZY_THRESHOLD", "0.85")) # Jaccard de trigramas mínimo (1.0 = solo exacta)
+PLAN_CACHE_TOUCH_SECONDS = 3600 # 'last_used' solo se reescribe en disco si ha pasado este tiempo (las consultas no escriben)
+
+# Palabras que no cambian el plan: artículos y las preposiciones de "acceso directo a/de X"
+_PALABRAS_VACIAS = {"el", "la", "los", "las", "un", "una", "unos", "unas", "lo", "al", "a", "de", "del"}
+_RE_NO_PALABRA = re.compile(r"[^\w+]+")
+_RE_CITADO = re.compile(r"'([^']+)'")
+
+
+def normalizar(instruccion: str) -> str:
+    """
+    Clave de la caché: minúsculas, sin acentos, sin comillas ni puntuación, sin artículos y con espacios colapsados.
+    """
+    texto = "".join(c for c in unicodedata.normalize("NFD", instruccion.lower()) if unicodedata.category(c) != "Mn")
+    return " ".join(palabra for palabra in _RE_NO_PALABRA.sub(" ", texto).split() if palabra not in _PALABRAS_VACIAS)
+
+
+def _trigramas(clave: str) -> set:
+    texto = f"  {clave} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def _valores_del_plan(instruccion: str, steps: list) -> list:
+    """
+    Valores entre comillas de los pasos que salen de la instrucción ('Ollama', 'MiProyecto'...). Una orden parecida
+    solo puede reutilizar el plan si contiene exactamente esos valores; si no, el plan haría otra cosa.
+    """
+    texto = " ".join(instruccion.lower().split())
+    valores = {v.lower() for step in steps for v in _RE_CITADO.findall(step.get("action", ""))}
+    return sorted(v for v in valores if v in texto)
+
+
+class PlanCache:
+    """
+    Tabla SQLite en disco (compartida entre main.py y text_to_steps.py) con una copia en memoria de las claves
+    y un índice invertido de trigramas, de modo que una consulta no toca el disco salvo si otro proceso ha escrito.
+    Cada plan guarda la revisión del prompt que lo generó; al abrirla con una revisión nueva se vacía lo anterior.
+    """
+
+    def __init__(self, ruta: str = PLAN_CACHE_PATH, revision: str = None, max_entradas: int = PLAN_CACHE_MAX_ENTRIES,
+                 umbral: float = PLAN_CACHE_FUZZY_THRESHOLD):
+        self.max_entradas = max_entradas
+        self.umbral = umbral
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        self._db = sqlite3.connect(ruta, check_same_thread=False, timeout=30)
+        self._db.execute("CREATE TABLE IF NOT EXISTS plans (key TEXT PRIMARY KEY, instruction TEXT NOT NULL, steps TEXT NOT NULL, "
+                         "revision TEXT NOT NULL, hits INTEGER NOT NULL DEFAULT 0, created REAL NOT NULL, last_used REAL NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        if revision is not None:
+            anterior = self._db.execute("SELECT value FROM meta WHERE name = 'revision'").fetchone()
+            if anterior is None or anterior[0] != revision:
+                borrados = self._db.execute("DELETE FROM plans WHERE revision != ?", (revision,)).rowcount
+                self._db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('revision', ?)", (revision,))
+                if borrados:
+                    print(f"INFO: Caché de planes: {borrados} planes de otra revisión del prompt descartados.", flush=True)
+        self._db.commit()
+        self.revision = revision
+        self._version_db = None
+        self._entradas = {}
+        self._indice = {}
+        self._tamanos = {}
+        self._hits_pendientes = {}
+        self.hits_exactos = 0
+        self.hits_aproximados = 0
+        self.misses = 0
+
+    def _indexar(self, clave: str, instruccion: str, steps: str, last_used: float):
+        self._entradas[clave] = (instruccion, steps, last_used)
+        trigramas = _trigramas(clave)
+        self._tamanos[clave] = len(trigramas)
+        for trigrama in trigramas:
+            self._indice.setdefault(trigrama, set()).add(clave)
+
+    def _sincronizar(self):
+        """Recarga la copia en memoria si otro proceso ha escrito en la base desde la última lectura."""
+        version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._version_db:
+            return
+        revision = self.revision or (self._db.execute("SELECT value FROM meta WHERE name = 'revision'").fetchone() or [None])[0]
+        self._entradas, self._indice, self._tamanos = {}, {}, {}
+        for fila in self._db.execute("SELECT key, instruction, steps, last_used FROM plans WHERE revision = ?", (revision,)):
+            self._indexar(*fila)
+        self._version_db = version
+
+    def _aproximada(self, clave: str):
+        trigramas = _trigramas(clave)
+        comunes = {}
+        for trigrama in trigramas:
+            for candidata in self._indice.get(trigrama, ()):
+                comunes[candidata] = comunes.get(candidata, 0) + 1
+        mejor, similitud = None, 0.0
+        for candidata, n in comunes.items():
+            if candidata not in self._entradas: # Descartada por el límite de tamaño
+                continue
+            jaccard = n / (len(trigramas) + self._tamanos[candidata] - n)
+            if jaccard > similitud:
+                mejor, similitud = candidata, jaccard
+        return (mejor, similitud) if similitud >= self.umbral else (None, similitud)
+
+    def buscar(self, instruccion: str) -> list | None:
+        """Plan guardado para la instrucción (coincidencia exacta de la clave o por trigramas), o None."""
+        clave = normalizar(instruccion)
+        if not clave:
+            return None
+        with self._lock:
+            self._sincronizar()
+            similitud = 1.0
+            encontrada = clave if clave in self._entradas else None
+            if encontrada is None and self.umbral < 1.0:
+                encontrada, similitud = self._aproximada(clave)
+            if encontrada is not None:
+                instruccion_guardada, steps_json, last_used = self._entradas[encontrada]
+                steps = json.loads(steps_json)
+                texto = " ".join(instruccion.lower().split())
+                if all(valor in texto for valor in _valores_del_plan(instruccion_guardada, steps)):
+                    if similitud == 1.0:
+                        self.hits_exactos += 1
+                    else:
+                        self.hits_aproximados += 1
+                    self._anotar_uso(encontrada, last_used)
+                    print(f"INFO: Plan reutilizado de la caché ('{instruccion_guardada}', similitud {similitud:.2f}).", flush=True)
+                    return steps
+            self.misses += 1
+            return None
+
+    def _anotar_uso(self, clave: str, last_used: float):
+        """Los aciertos se acumulan en memoria y se escriben junto con 'last_used' como mucho una vez por hora y plan."""
+        self._hits_pendientes[clave] = self._hits_pendientes.get(clave, 0) + 1
+        ahora = time.time()
+        if ahora - last_used < PLAN_CACHE_TOUCH_SECONDS:
+            return
+        try:
+            self._db.execute("UPDATE plans SET hits = hits + ?, last_used = ? WHERE key = ?", (self._hits_pendientes.pop(clave), ahora, clave))
+            self._db.commit()
+            instruccion, steps, _ = self._entradas[clave]
+            self._entradas[clave] = (instruccion, steps, ahora)
+        except sqlite3.Error as e:
+            print(f"WARNING: No se pudo actualizar el uso del plan en la caché: {e}", flush=True)
+
+    def guardar(self, instruccion: str, steps: list):
+        """Guarda el plan de la instrucción (con la revisión del prompt actual) y aplica el límite de tamaño."""
+        clave = normalizar(instruccion)
+        if not clave or not steps:
+            return
+        if self.revision is None:
+            raise ValueError("Para guardar planes hay que abrir la caché con la revisión del prompt")
+        ahora = time.time()
+        steps_json = json.dumps(steps, ensure_ascii=False)
+        with self._lock:
+            try:
+                self._sincronizar()
+                self._db.execute("INSERT OR REPLACE INTO plans (key, instruction, steps, revision, hits, created, last_used) "
+                                 "VALUES (?, ?, ?, ?, 0, ?, ?)",
+                                 (clave, instruccion, steps_json, self.revision, ahora, ahora))
+                descartadas = [k for (k,) in self._db.execute("SELECT key FROM plans ORDER BY last_used DESC LIMIT -1 OFFSET ?",
+                                                              (self.max_entradas,))]
+                self._db.executemany("DELETE FROM plans WHERE key = ?", [(k,) for k in descartadas])
+                self._db.commit()
+                # Las escrituras propias no cambian 'data_version': se reflejan a mano en la copia en memoria
+                self._indexar(clave, instruccion, steps_json, ahora)
+                for k in descartadas:
+                    self._entradas.pop(k, None)
+                    self._tamanos.pop(k, None)
+            except sqlite3.Error as e:
+                # La caché es una optimización: si falla, el plan ya se ha generado igualmente
+                print(f"WARNING: No se pudo guardar el plan en la caché: {e}", flush=True)
+
+    def estadisticas(self) -> dict:
+        total = self.hits_exactos + self.hits_aproximados + self.misses
+        return {
+            "hits_exactos": self.hits_exactos,
+            "hits_aproximados": self.hits_aproximados,
+            "misses": self.misses,
+            "hit_rate": (self.hits_exactos + self.hits_aproximados) / total if total else 0.0,
+            "entradas": len(self._entradas),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Caché local de planes (instrucción normalizada -> pasos).")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+    parser_lookup = subparsers.add_parser("lookup", help="Busca el plan de una instrucción y mide la consulta.")
+    parser_lookup.add_argument("instruction")
+    subparsers.add_parser("clear", help="Vacía la caché.")
+    args = parser.parse_args()
+
+    cache = PlanCache()
+    if args.comando == "lookup":
+        inicio = time.perf_counter()
+        plan = cache.buscar(args.instruction)
+        print(f"INFO: Consulta en {(time.perf_counter() - inicio) * 1e6:.0f} µs (incluida la carga inicial).", flush=True)
+        print(json.dumps(plan, indent=2, ensure_ascii=False), flush=True)
+    else:
+        cache._db.execute("DELETE FROM plans")
+        cache._db.commit()
+        print("INFO: Caché de planes vaciada.", flush=True)
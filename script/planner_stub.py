@@ -0,0 +1,103 @@
+import sys
+import json
+import time
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- Configurar la codificación de la salida de la consola al inicio ---
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+except AttributeError:
+    pass
+except Exception as e:
+    print(f"WARNING: No se pudo reconfigurar la codificacion de la consola: {e}", flush=True)
+
+# Servidor de pruebas que imita el endpoint /v1/chat/completions de Ollama o llama.cpp server, para probar los
+# backends del planificador de text_to_steps.py (incluida la alternativa por tiempo de espera) sin ningún modelo:
+#   python script/planner_stub.py --port 11434 --delay 20
+#   PLANNER_BACKENDS=local,openai PLANNER_LOCAL_URL=http://localhost:11434/v1 python script/text_to_steps.py ...
+PLAN_POR_DEFECTO = [
+    {"step": 1, "verb": "saluda", "element_type": None, "target": None, "text": None, "keys": None, "wait_seconds": None},
+]
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    plan = PLAN_POR_DEFECTO
+    retardo = 0.0
+    estado = 200
+
+    def _responder(self, estado: int, cuerpo: dict):
+        datos = json.dumps(cuerpo, ensure_ascii=False).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        try:
+            self.wfile.write(datos)
+        except (BrokenPipeError, ConnectionResetError):
+            pass # El cliente ya se ha ido (p. ej. por su tiempo de espera)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._responder(200, {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "planner_stub"}]})
+        else:
+            self._responder(404, {"error": {"message": f"Ruta desconocida: {self.path}"}})
+
+    def do_POST(self):
+        longitud = int(self.headers.get("Content-Length") or 0)
+        try:
+            peticion = json.loads(self.rfile.read(longitud) or b"{}")
+        except json.JSONDecodeError:
+            self._responder(400, {"error": {"message": "Cuerpo JSON no válido"}})
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._responder(404, {"error": {"message": f"Ruta desconocida: {self.path}"}})
+            return
+
+        mensajes = peticion.get("messages") or []
+        instruccion = mensajes[-1].get("content", "") if mensajes else ""
+        print(f"INFO: Petición para '{peticion.get('model')}' ({len(mensajes[0].get('content', '')) if mensajes else 0} caracteres de sistema): {instruccion}", flush=True)
+        if self.retardo:
+            time.sleep(self.retardo)
+        if self.estado != 200:
+            self._responder(self.estado, {"error": {"message": f"Error simulado {self.estado}"}})
+            return
+
+        contenido = json.dumps({"steps": self.plan}, ensure_ascii=False)
+        self._responder(200, {
+            "id": f"chatcmpl-stub-{int(time.time() * 1000)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": peticion.get("model") or "stub",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": contenido}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    def log_message(self, format, *args):
+        pass # Las peticiones ya se registran en do_POST
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor de pruebas compatible con /v1/chat/completions para el planificador.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434, help="Puerto (11434 es el de Ollama).")
+    parser.add_argument("--delay", type=float, default=0.0, help="Segundos de espera antes de responder (para simular un timeout).")
+    parser.add_argument("--status", type=int, default=200, help="Código HTTP de la respuesta (para simular errores del servidor).")
+    parser.add_argument("--plan", help="Archivo JSON con la lista de pasos a devolver (por defecto, un saludo).")
+    args = parser.parse_args()
+
+    _Manejador.retardo = args.delay
+    _Manejador.estado = args.status
+    if args.plan:
+        with open(args.plan, "r", encoding="utf-8") as f:
+            _Manejador.plan = json.load(f)
+
+    servidor = ThreadingHTTPServer((args.host, args.port), _Manejador)
+    print(f"INFO: Servidor de pruebas del planificador en http://{args.host}:{args.port}/v1 (retardo {args.delay:g} s, estado {args.status}).", flush=True)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print("INFO: Servidor de pruebas detenido.", flush=True)
+    finally:
+        servidor.server_close()
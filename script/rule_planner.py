@@ -0,0 +1,203 @@
+import os
+import re
+import sys
+import json
+import argparse
+from collections import Counter
+from datetime import datetime
+
+try:
+    from script import step_schema # Importado desde la raíz del proyecto (main.py)
+except ImportError:
+    import step_schema # Importado desde la carpeta 'script'
+
+# --- Configurar la codificación de la salida de la consola al inicio ---
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+except AttributeError:
+    pass
+except Exception as e:
+    print(f"WARNING: No se pudo reconfigurar la codificacion de la consola: {e}", flush=True)
+
+# --- Configuración ---
+# Planificador local por reglas: las órdenes de forma conocida ("clic en acceso directo a X", "doble clic en...",
+# "abre X", "escribe 'T' en...", "presiona Ctrl+S") se convierten en pasos al instante, sin llamar al LLM.
+# Lo que no encaje con seguridad en ningún patrón pasa al planificador LLM de text_to_steps.py.
+RULE_PLANNER_ENABLED = os.getenv("RULE_PLANNER_ENABLED", "true").lower() == "true"
+# Patrones adicionales (JSON: lista de {"name", "pattern", "steps"}); se prueban antes que los integrados
+RULE_PLANNER_PATTERNS_FILE = os.getenv("RULE_PLANNER_PATTERNS_FILE", "")
+# Registro de aciertos y fallos (JSON Lines) para ver la tasa de acierto y qué órdenes merecen un patrón nuevo
+RULE_PLANNER_LOG = os.getenv("RULE_PLANNER_LOG", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "parsed_steps", "rule_planner.jsonl"))
+RULE_PLANNER_MAX_TARGET_WORDS = int(os.getenv("RULE_PLANNER_MAX_TARGET_WORDS", "5")) # Objetivos más largos van al LLM
+
+# Piezas de los patrones. Los grupos con nombre se sustituyen en los pasos: {objetivo}, {tipo}, {texto}, {tecla}
+# Los pasos se escriben como acciones de texto y step_schema.desde_accion los convierte en pasos tipados
+_OBJETIVO = r"[\"'«“]?(?P<objetivo>[^\"'«»“”]+?)[\"'»”]?"
+_TEXTO = r"[\"'«“](?P<texto>[^\"'«»“”]+)[\"'»”]"
+_TIPO = r"(?:(?:el|la|al)\s+)?(?:(?P<tipo>icono|acceso\s+directo|bot[oó]n|pesta[ñn]a|campo\s+de\s+(?:entrada|texto))\s+)?(?:(?:de|del|a|al)\s+)?"
+_TECLA = r"(?:ctrl|control|alt|shift|may[uú]s(?:culas)?|win|windows|enter|intro|esc|escape|tab|tabulador|supr|suprimir|delete|retroceso|backspace|espacio|inicio|fin|arriba|abajo|izquierda|derecha|f\d{1,2}|[a-z0-9])"
+
+PATRONES_INTEGRADOS = [
+    {
+        "name": "doble_clic",
+        "pattern": rf"(?:haz\s+)?doble\s+(?:clic|click)\s+(?:en|sobre)\s+{_TIPO}{_OBJETIVO}",
+        "steps": ["busca el {tipo} de '{objetivo}'", "haz doble clic en el {tipo} de '{objetivo}'"],
+    },
+    {
+        "name": "clic",
+        "pattern": rf"(?:haz\s+)?(?:clic|click|pulsa)\s+(?:en|sobre)\s+{_TIPO}{_OBJETIVO}",
+        "steps": ["busca el {tipo} de '{objetivo}'", "haz clic en el {tipo} de '{objetivo}'"],
+    },
+    {
+        "name": "escribe_en",
+        "pattern": rf"escribe\s+{_TEXTO}\s+en\s+(?:el\s+)?(?P<tipo>campo\s+de\s+(?:entrada|texto))\s+(?:de\s+)?{_OBJETIVO}",
+        "steps": ["busca el {tipo} de '{objetivo}'", "haz clic en el {tipo} de '{objetivo}'", "escribe '{texto}'"],
+    },
+    {
+        "name": "escribe",
+        "pattern": rf"escribe\s+{_TEXTO}",
+        "steps": ["escribe '{texto}'"],
+    },
+    {
+        "name": "presiona",
+        "pattern": rf"(?:presiona|pulsa)\s+(?:la\s+tecla\s+|las\s+teclas\s+)?[\"']?(?P<tecla>{_TECLA}(?:\s*\+\s*{_TECLA})*)[\"']?",
+        "steps": ["presiona '{tecla}'"],
+    },
+    {
+        "name": "abre",
+        # Solo nombres de aplicación: "abre la ventana de..." o "abre el archivo..." no son un lanzamiento desde Inicio
+        "pattern": rf"abre\s+(?:la\s+aplicaci[oó]n\s+|el\s+programa\s+|la\s+app\s+)?(?!(?:el|la|los|las|un|una|mi|mis)\s){_OBJETIVO}",
+        "steps": ["busca el icono de 'Inicio'", "haz clic en el icono de 'Inicio'", "espera a que se abra el menú de 'Inicio'",
+                  "busca el icono de '{objetivo}'", "haz clic en el icono de '{objetivo}'", "espera a que se abra la aplicación {objetivo}"],
+    },
+]
+
+# Tipo de elemento tal como lo entiende el ejecutor de main.py (un acceso directo del escritorio es un icono)
+_TIPOS = {"acceso directo": "icono", "boton": "botón", "botón": "botón", "pestana": "pestaña", "pestaña": "pestaña",
+          "campo de texto": "campo de entrada", "campo de entrada": "campo de entrada", "icono": "icono"}
+_TECLAS = {"control": "Ctrl", "intro": "Enter", "escape": "Esc", "suprimir": "Supr", "delete": "Supr", "tabulador": "Tab",
+           "mayus": "Shift", "mayús": "Shift", "mayusculas": "Shift", "mayúsculas": "Shift", "windows": "Win",
+           "backspace": "Retroceso"}
+# Un objetivo con conectores suele ser una orden compuesta ("abre X y crea un proyecto"): mejor el LLM
+_RE_COMPUESTA = re.compile(r"\s(?:y|e|luego|después|despues|entonces)\s|[,;:]", re.IGNORECASE)
+
+_patrones = None
+_estadisticas = Counter()
+
+
+def _cargar_patrones() -> list:
+    patrones = []
+    if RULE_PLANNER_PATTERNS_FILE:
+        try:
+            with open(RULE_PLANNER_PATTERNS_FILE, "r", encoding="utf-8") as f:
+                patrones.extend(json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"WARNING: No se pudieron leer los patrones de {RULE_PLANNER_PATTERNS_FILE}: {e}", flush=True)
+    patrones.extend(PATRONES_INTEGRADOS)
+    compilados = []
+    for patron in patrones:
+        try:
+            compilados.append((patron["name"], re.compile(rf"^\s*{patron['pattern']}\s*[.!?]?\s*$", re.IGNORECASE), patron["steps"]))
+        except (KeyError, re.error) as e:
+            print(f"WARNING: Patrón del planificador por reglas no válido ({patron.get('name')}): {e}", flush=True)
+    return compilados
+
+
+def _tecla(combinacion: str) -> str:
+    partes = []
+    for parte in re.split(r"\s*\+\s*", combinacion.strip()):
+        clave = parte.lower()
+        partes.append(_TECLAS.get(clave) or (clave.upper() if re.fullmatch(r"f\d{1,2}", clave) else clave.capitalize()))
+    return "+".join(partes)
+
+
+def _valores(coincidencia) -> dict | None:
+    """Valores normalizados de los grupos del patrón, o None si no son fiables."""
+    valores = {nombre: (valor or "").strip() for nombre, valor in coincidencia.groupdict().items()}
+    objetivo = valores.get("objetivo")
+    if objetivo is not None:
+        if not objetivo or _RE_COMPUESTA.search(f" {objetivo} ") or len(objetivo.split()) > RULE_PLANNER_MAX_TARGET_WORDS:
+            return None
+    if "tipo" in valores:
+        valores["tipo"] = _TIPOS.get(re.sub(r"\s+", " ", valores["tipo"].lower()), "icono")
+    if valores.get("tecla"):
+        valores["tecla"] = _tecla(valores["tecla"])
+    return valores
+
+
+def _registrar(instruccion: str, nombre: str | None):
+    _estadisticas["aciertos" if nombre else "fallos"] += 1
+    total = _estadisticas["aciertos"] + _estadisticas["fallos"]
+    if nombre:
+        print(f"INFO: Planificador por reglas: patrón '{nombre}' (sin LLM). Tasa de acierto de la sesión: {_estadisticas['aciertos']}/{total}.", flush=True)
+    else:
+        print(f"INFO: Planificador por reglas: sin patrón para la orden, se usará el LLM. Tasa de acierto de la sesión: {_estadisticas['aciertos']}/{total}.", flush=True)
+    try:
+        os.makedirs(os.path.dirname(RULE_PLANNER_LOG), exist_ok=True)
+        with open(RULE_PLANNER_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"timestamp": datetime.now().isoformat(), "instruction": instruccion, "pattern": nombre}, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"WARNING: No se pudo escribir el registro del planificador por reglas en {RULE_PLANNER_LOG}: {e}", flush=True)
+
+
+def planificar(instruccion: str) -> list | None:
+    """
+    Pasos para la instrucción si encaja con seguridad en un patrón conocido, o None para recurrir al LLM.
+    Los pasos tienen el mismo esquema tipado que los de text_to_steps.py (ver step_schema.py).
+    """
+    global _patrones
+    if not RULE_PLANNER_ENABLED:
+        return None
+    if _patrones is None:
+        _patrones = _cargar_patrones()
+    texto = " ".join(instruccion.split())
+    for nombre, patron, plantillas in _patrones:
+        coincidencia = patron.match(texto)
+        if not coincidencia:
+            continue
+        valores = _valores(coincidencia)
+        if valores is None:
+            continue
+        try:
+            steps = step_schema.normalizar_plan([{"step": i, "action": plantilla.format(**valores)} for i, plantilla in enumerate(plantillas, start=1)])
+        except (KeyError, IndexError) as e:
+            print(f"WARNING: Los pasos del patrón '{nombre}' usan un grupo que no define: {e}", flush=True)
+            continue
+        _registrar(instruccion, nombre)
+        return steps
+    _registrar(instruccion, None)
+    return None
+
+
+def resumen(ruta: str = RULE_PLANNER_LOG, top: int = 20) -> dict:
+    """Tasa de acierto total y por patrón, y las órdenes sin patrón más frecuentes (candidatas a uno nuevo)."""
+    registros = []
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            registros = [json.loads(linea) for linea in f if linea.strip()]
+    except OSError:
+        pass
+    aciertos = Counter(r["pattern"] for r in registros if r["pattern"])
+    fallos = Counter(" ".join(r["instruction"].lower().split()) for r in registros if not r["pattern"])
+    return {
+        "ordenes": len(registros),
+        "tasa_acierto": round(sum(aciertos.values()) / len(registros), 3) if registros else 0.0,
+        "por_patron": dict(aciertos.most_common()),
+        "sin_patron": fallos.most_common(top),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Planificador local por reglas para órdenes de forma conocida.")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+    parser_plan = subparsers.add_parser("plan", help="Muestra los pasos que generaría para una orden.")
+    parser_plan.add_argument("instruction")
+    parser_stats = subparsers.add_parser("stats", help="Tasa de acierto y órdenes más frecuentes sin patrón.")
+    parser_stats.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.comando == "plan":
+        print(json.dumps(planificar(args.instruction), indent=2, ensure_ascii=False), flush=True)
+    else:
+        print(json.dumps(resumen(top=args.top), indent=2, ensure_ascii=False), flush=True)
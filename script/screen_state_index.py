@@ -0,0 +1,143 @@
+import os
+import sys
+import json
+import time
+import threading
+
+import cv2
+import numpy as np
+
+# --- Configurar la codificación de la salida de la consola al inicio ---
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+except AttributeError:
+    pass
+except Exception as e:
+    print(f"WARNING: No se pudo reconfigurar la codificacion de la consola: {e}", flush=True)
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SCREEN_STATE_INDEX_PATH = os.getenv("SCREEN_STATE_INDEX_PATH", os.path.join(project_root, 'screen_states', 'index.json'))
+
+# Fracción inferior de la pantalla que se ignora al calcular la huella (barra de tareas y reloj)
+SCREEN_STATE_IGNORE_BOTTOM = float(os.getenv("SCREEN_STATE_IGNORE_BOTTOM", "0.06"))
+# Distancia de Hamming máxima (sobre 256 bits) para considerar que es el mismo estado de pantalla
+SCREEN_STATE_MATCH_DISTANCE = int(os.getenv("SCREEN_STATE_MATCH_DISTANCE", "8"))
+# Nº máximo de estados guardados (se descartan los menos usados recientemente)
+SCREEN_STATE_MAX_STATES = int(os.getenv("SCREEN_STATE_MAX_STATES", "200"))
+# Diferencia media (0-255) máxima entre el recorte guardado y el de la captura actual para dar la ubicación por buena
+SCREEN_STATE_VERIFY_THRESHOLD = float(os.getenv("SCREEN_STATE_VERIFY_THRESHOLD", "12"))
+
+_HASH_SIZE = 16 # dHash de 16x16 = 256 bits
+
+
+def calcular_huella(imagen, ignorar_inferior: float = SCREEN_STATE_IGNORE_BOTTOM) -> str:
+    """
+    Huella perceptual (dHash de 256 bits, en hexadecimal) de una captura BGR.
+    Se ignora la franja inferior (barra de tareas/reloj) para que la hora no cambie la huella.
+    """
+    alto = imagen.shape[0]
+    recorte = imagen[:max(1, int(alto * (1.0 - ignorar_inferior)))]
+    gris = cv2.cvtColor(recorte, cv2.COLOR_BGR2GRAY)
+    reducida = cv2.resize(gris, (_HASH_SIZE + 1, _HASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = (reducida[:, 1:] > reducida[:, :-1]).flatten()
+    return "%064x" % int("".join("1" if b else "0" for b in bits), 2)
+
+
+def distancia_hamming(huella_a: str, huella_b: str) -> int:
+    return bin(int(huella_a, 16) ^ int(huella_b, 16)).count("1")
+
+
+def normalizar_descripcion(descripcion: str) -> str:
+    return " ".join(descripcion.lower().strip().strip("'\"").split())
+
+
+def recorte_coincide(imagen, bbox: list, referencia_path: str, umbral: float = SCREEN_STATE_VERIFY_THRESHOLD) -> bool:
+    """
+    Comprueba que el recorte de 'imagen' en 'bbox' sigue pareciéndose a la imagen de referencia guardada.
+    """
+    referencia = cv2.imread(referencia_path) if referencia_path and os.path.exists(referencia_path) else None
+    if referencia is None:
+        return False
+    x1, y1, x2, y2 = bbox
+    actual = imagen[y1:y2, x1:x2]
+    if actual.shape != referencia.shape:
+        return False
+    return float(np.abs(actual.astype(np.int16) - referencia.astype(np.int16)).mean()) <= umbral
+
+
+class ScreenStateIndex:
+    """
+    Índice de estados de pantalla: para cada huella guarda la ubicación resuelta de cada elemento
+    consultado en ese estado, de modo que la misma descripción sobre el mismo estado se resuelve
+    sin llamadas a GPT. Se persiste en un JSON pequeño junto al proyecto.
+    """
+
+    def __init__(self, path: str = SCREEN_STATE_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.states = self._cargar()
+
+    def _cargar(self) -> list:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f).get("states", [])
+        except (OSError, json.JSONDecodeError):
+            return []
+
+    def guardar(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"states": self.states}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path) # Escritura atómica
+
+    def _estado_mas_cercano(self, huella: str):
+        mejor, mejor_distancia = None, None
+        for estado in self.states:
+            distancia = distancia_hamming(huella, estado["hash"])
+            if mejor_distancia is None or distancia < mejor_distancia:
+                mejor, mejor_distancia = estado, distancia
+        return mejor, mejor_distancia
+
+    def buscar(self, huella: str, descripcion: str):
+        """
+        Devuelve la entrada guardada para 'descripcion' en el estado de pantalla 'huella', o None.
+        Un estado parecido pero distinto no se toca: cada ubicación se comprueba con recorte_coincide
+        antes de usarla y se invalida con invalidar() si ya no coincide.
+        """
+        with self._lock:
+            estado, distancia = self._estado_mas_cercano(huella)
+            if estado is None or distancia > SCREEN_STATE_MATCH_DISTANCE:
+                return None
+            estado["last_used"] = time.time()
+            entrada = estado["elements"].get(normalizar_descripcion(descripcion))
+            if entrada:
+                print(f"INFO: Estado de pantalla reconocido (distancia {distancia}). Ubicacion de '{descripcion}' en cache.", flush=True)
+            return entrada
+
+    def registrar(self, huella: str, descripcion: str, entrada: dict):
+        """
+        Guarda la ubicación resuelta de 'descripcion' en el estado 'huella' (o en el estado equivalente ya conocido).
+        """
+        with self._lock:
+            estado, distancia = self._estado_mas_cercano(huella)
+            if estado is None or distancia > SCREEN_STATE_MATCH_DISTANCE:
+                estado = {"hash": huella, "elements": {}}
+                self.states.append(estado)
+            estado["last_used"] = time.time()
+            estado["elements"][normalizar_descripcion(descripcion)] = entrada
+            if len(self.states) > SCREEN_STATE_MAX_STATES:
+                self.states.sort(key=lambda e: e.get("last_used", 0), reverse=True)
+                del self.states[SCREEN_STATE_MAX_STATES:]
+            self.guardar()
+
+    def invalidar(self, huella: str, descripcion: str):
+        """
+        Elimina la ubicación de 'descripcion' en el estado 'huella' (p. ej. porque ya no coincide en pantalla).
+        """
+        with self._lock:
+            estado, distancia = self._estado_mas_cercano(huella)
+            if estado is not None and distancia <= SCREEN_STATE_MATCH_DISTANCE:
+                if estado["elements"].pop(normalizar_descripcion(descripcion), None) is not None:
+                    self.guardar()
@@ -2,7 +2,10 @@ import mss
 import mss.tools
 import os
 import sys # Importar sys para reconfigurar stdout/stderr
+import json
+import argparse
 import time
+import hashlib
 
 # --- Configurar la codificación de la salida de la consola al inicio ---
 try:
@@ -19,35 +22,136 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..')) #
 SCREENSHOT_DIR = os.path.join(project_root, 'screenshots')
 SCREENSHOT_FILENAME = 'pantalla.png'
 SCREENSHOT_PATH = os.path.join(SCREENSHOT_DIR, SCREENSHOT_FILENAME)
+# Junto a cada captura se guarda un JSON con el monitor capturado y su origen en el escritorio virtual,
+# para poder traducir las coordenadas de la imagen a coordenadas globales de pyautogui.
+SCREENSHOT_META_SUFFIX = '.json'
 
-def take_screenshot():
+# Orden de prioridad de monitores para capturar/buscar, ej. "2,1" (primero el monitor 2).
+# "all" (o "0") captura el escritorio virtual completo (todos los monitores combinados).
+SCREENSHOT_MONITORS = os.getenv("SCREENSHOT_MONITORS", "1")
+
+
+def parse_monitor_priority(value: str = None) -> list:
     """
-    Toma una captura de pantalla del monitor principal y la guarda.
+    Convierte una cadena tipo "2,1" o "all" en una lista de índices de monitor de mss.
+    El índice 0 representa todos los monitores combinados.
     """
-    os.makedirs(SCREENSHOT_DIR, exist_ok=True)
+    value = (value if value is not None else SCREENSHOT_MONITORS).strip().lower()
+    if value in ("all", "todos", "0"):
+        return [0]
+    monitors = []
+    for part in value.split(","):
+        part = part.strip()
+        if part.isdigit() and int(part) not in monitors:
+            monitors.append(int(part))
+    return monitors or [1]
+
 
+def listar_monitores() -> list:
+    """
+    Devuelve la lista de monitores de mss (el índice 0 es el escritorio virtual completo).
+    """
     with mss.mss() as sct:
-        # Get information of monitor 1 (primary monitor)
-        # sct.monitors[0] is all monitors combined
-        # sct.monitors[1] is typically the primary monitor
-        # If you have multiple monitors and want to target a specific one,
-        # you might need to adjust this index (e.g., sct.monitors[2] for a second external monitor)
-        # For most single-monitor setups, [1] is the correct choice.
-        monitor = sct.monitors[1] # Cambiado de [2] a [1]
+        return [dict(m) for m in sct.monitors]
+
+
+def meta_path_for(image_path: str) -> str:
+    """
+    Ruta del JSON de metadatos asociado a una captura.
+    """
+    return os.path.splitext(image_path)[0] + SCREENSHOT_META_SUFFIX
+
+
+def load_screenshot_meta(image_path: str = SCREENSHOT_PATH) -> dict:
+    """
+    Lee los metadatos de monitor de una captura. Si no existen (capturas antiguas),
+    asume el monitor principal con origen (0, 0).
+    """
+    try:
+        with open(meta_path_for(image_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {"monitor": 1, "left": 0, "top": 0}
+
+
+def to_virtual_coords(x: int, y: int, monitor_meta: dict) -> tuple:
+    """
+    Traduce coordenadas relativas a la captura de un monitor a coordenadas
+    del escritorio virtual (las que usa pyautogui para hacer clic).
+    """
+    return int(x + monitor_meta.get("left", 0)), int(y + monitor_meta.get("top", 0))
+
+
+def to_virtual_bbox(bbox: tuple, monitor_meta: dict) -> tuple:
+    """
+    Traduce un rectángulo (x1, y1, x2, y2) de la captura al escritorio virtual.
+    """
+    x1, y1 = to_virtual_coords(bbox[0], bbox[1], monitor_meta)
+    x2, y2 = to_virtual_coords(bbox[2], bbox[3], monitor_meta)
+    return x1, y1, x2, y2
+
+
+def huella_archivo(path: str) -> str:
+    """
+    SHA-1 del contenido de un archivo (o None si no se puede leer). Sirve para saber si
+    'capture/location.json' corresponde a la imagen que hay ahora en 'capture/image.png'.
+    """
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def take_screenshot(monitor_index: int = None, output_path: str = SCREENSHOT_PATH) -> dict:
+    """
+    Toma una captura de pantalla del monitor indicado (por defecto, el primero de
+    SCREENSHOT_MONITORS) y la guarda junto con sus metadatos de posición.
+    Devuelve los metadatos del monitor capturado.
+    """
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    if monitor_index is None:
+        monitor_index = parse_monitor_priority()[0]
+
+    with mss.mss() as sct:
+        # sct.monitors[0] es el escritorio virtual completo (todos los monitores combinados)
+        # sct.monitors[1] suele ser el monitor principal, sct.monitors[2] el segundo, etc.
+        if monitor_index >= len(sct.monitors):
+            print(f"WARNING: El monitor {monitor_index} no existe (hay {len(sct.monitors) - 1}). Usando el monitor principal.", flush=True)
+            monitor_index = 1
+        monitor = sct.monitors[monitor_index]
 
         # Grab the data
         sct_img = sct.grab(monitor)
 
         # Save to the picture file
-        mss.tools.to_png(sct_img.rgb, sct_img.size, output=SCREENSHOT_PATH)
-    
-    print(f"INFO: Captura de pantalla guardada en: {SCREENSHOT_PATH}", flush=True)
+        mss.tools.to_png(sct_img.rgb, sct_img.size, output=output_path)
+
+    monitor_meta = {
+        "monitor": monitor_index,
+        "left": monitor["left"],
+        "top": monitor["top"],
+        "width": monitor["width"],
+        "height": monitor["height"],
+        "timestamp": time.time()
+    }
+    with open(meta_path_for(output_path), "w", encoding="utf-8") as f:
+        json.dump(monitor_meta, f, indent=2)
+
+    print(f"INFO: Captura de pantalla del monitor {monitor_index} ({monitor['width']}x{monitor['height']} en {monitor['left']},{monitor['top']}) guardada en: {output_path}", flush=True)
     sys.stdout.flush() # Forzar el flush
-    
+    return monitor_meta
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Toma una captura de pantalla de un monitor o de todos.")
+    parser.add_argument("--monitor", type=str, default=None,
+                        help="Índice del monitor a capturar (1, 2, ...) o 'all' para todos. Por defecto, el primero de SCREENSHOT_MONITORS.")
+    parser.add_argument("--output", type=str, default=SCREENSHOT_PATH, help="Ruta de la imagen de salida.")
+    args = parser.parse_args()
+
     print("--- Tomando captura de pantalla ---", flush=True)
     sys.stdout.flush()
-    take_screenshot()
+    take_screenshot(parse_monitor_priority(args.monitor)[0] if args.monitor else None, args.output)
     print("--- Captura de pantalla finalizada ---", flush=True)
     sys.stdout.flush()
@@ -0,0 +1,198 @@
+import re
+import sys
+import json
+import argparse
+
+# --- Configurar la codificación de la salida de la consola al inicio ---
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+except AttributeError:
+    pass
+except Exception as e:
+    print(f"WARNING: No se pudo reconfigurar la codificacion de la consola: {e}", flush=True)
+
+# --- Esquema de pasos ---
+# Cada paso del plan es un objeto con campos tipados, de modo que main.py no tiene que volver a interpretar texto:
+#   step          número de paso (1, 2, ...)
+#   verb          uno de VERBOS
+#   element_type  tipo de elemento de la interfaz ("icono", "botón", "campo de entrada"...) o null
+#   target        nombre visible del elemento, de la ventana esperada o del menú, o null
+#   text          texto a escribir, opción a seleccionar, dirección del scroll, consulta o mensaje, o null
+#   keys          tecla o combinación ("Enter", "Ctrl+S"), o null
+#   wait_seconds  segundos de espera (máximo, con esperas visuales), o null
+#   action        descripción legible generada a partir de los campos (para registros, plantillas y cachés)
+VERBOS = (
+    "busca", "clic", "doble_clic", "clic_derecho", "escribe", "presiona", "espera", "scroll", "selecciona",
+    "busca_en_google", "recuerda", "muestra_recordatorios", "saluda", "prueba", "sin_accion", "pide_detalles",
+)
+CAMPOS = ("element_type", "target", "text", "keys", "wait_seconds")
+
+_NULABLE = {"type": ["string", "null"]}
+# Esquema estricto para las salidas estructuradas del planificador (todas las claves obligatorias, null si no aplica)
+STEP_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "steps": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "step": {"type": "integer"},
+                    "verb": {"type": "string", "enum": list(VERBOS)},
+                    "element_type": _NULABLE,
+                    "target": _NULABLE,
+                    "text": _NULABLE,
+                    "keys": _NULABLE,
+                    "wait_seconds": {"type": ["number", "null"]},
+                },
+                "required": ["step", "verb"] + list(CAMPOS),
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["steps"],
+    "additionalProperties": False,
+}
+
+_FEMENINOS = ("pestaña", "ventana", "casilla", "aplicación", "barra", "lista")
+
+
+def _con_articulo(element_type: str) -> str:
+    return f"{'la' if element_type.startswith(_FEMENINOS) else 'el'} {element_type}"
+
+
+def a_accion(step: dict) -> str:
+    """Descripción legible del paso, con el mismo estilo que las acciones de texto libre de antes."""
+    verbo, tipo, objetivo, texto = step.get("verb"), step.get("element_type") or "elemento", step.get("target"), step.get("text")
+    if verbo in ("busca", "clic", "doble_clic", "clic_derecho"):
+        prefijo = {"busca": "busca", "clic": "haz clic en", "doble_clic": "haz doble clic en", "clic_derecho": "haz clic derecho en"}[verbo]
+        return f"{prefijo} {_con_articulo(tipo)} de '{objetivo}'"
+    if verbo == "escribe":
+        return f"escribe '{texto}'" + (f" en {_con_articulo(tipo)} de '{objetivo}'" if objetivo else "")
+    if verbo == "presiona":
+        return f"presiona '{step.get('keys')}'"
+    if verbo == "espera":
+        if objetivo:
+            return f"espera a que se abra '{objetivo}'" + (f" (máximo {step['wait_seconds']:g} segundos)" if step.get("wait_seconds") else "")
+        return f"espera {step.get('wait_seconds') or 1:g} segundos"
+    if verbo == "scroll":
+        return f"haz scroll {texto or 'abajo'} en {_con_articulo(tipo)} de '{objetivo}'"
+    if verbo == "selecciona":
+        return f"selecciona '{texto}'" + (f" en {_con_articulo(tipo)} de '{objetivo}'" if objetivo else "")
+    if verbo == "busca_en_google":
+        return f"busca en google '{texto}'"
+    if verbo == "recuerda":
+        return f"recuérdame '{texto}'"
+    if verbo == "muestra_recordatorios":
+        return "muestra mis recordatorios"
+    if verbo == "saluda":
+        return "saluda al usuario"
+    if verbo == "prueba":
+        return f"reconoce que la instrucción es una prueba de {texto or 'configuración'}"
+    if verbo == "pide_detalles":
+        return "solicita más detalles sobre la tarea a automatizar"
+    return "la instrucción no implica una acción de automatización de GUI específica"
+
+
+def _paso(verbo: str, **campos) -> dict:
+    paso = {"verb": verbo}
+    paso.update({campo: campos.get(campo) for campo in CAMPOS})
+    return paso
+
+
+_TIPOS_ELEMENTO = r"(?:el|la)\s+(?P<tipo>.+?)\s+de\s+"
+_CITADO = r"'(?P<objetivo>.*)'"
+# Conversión de las acciones de texto libre (planes antiguos, plantillas y patrones del planificador por reglas)
+_ACCIONES = [
+    (re.compile(rf"^haz doble clic en {_TIPOS_ELEMENTO}{_CITADO}$"), "doble_clic"),
+    (re.compile(rf"^haz clic derecho en {_TIPOS_ELEMENTO}{_CITADO}$"), "clic_derecho"),
+    (re.compile(rf"^haz clic en {_TIPOS_ELEMENTO}{_CITADO}$"), "clic"),
+    (re.compile(rf"^busca {_TIPOS_ELEMENTO}{_CITADO}$"), "busca"),
+]
+
+
+def desde_accion(action: str) -> dict:
+    """
+    Convierte una acción de texto libre ("haz clic en el icono de 'Ollama'") en un paso tipado.
+    Conserva mayúsculas y acentos de los valores; lo que no se reconoce queda como "sin_accion".
+    """
+    texto = " ".join(action.split())
+    minusculas = texto.lower()
+    for patron, verbo in _ACCIONES:
+        coincidencia = patron.match(minusculas)
+        if coincidencia:
+            inicio, fin = coincidencia.span("objetivo")
+            return _paso(verbo, element_type=coincidencia.group("tipo"), target=texto[inicio:fin])
+    coincidencia = re.match(r"^escribe\s+['\"](?P<texto>.*?)['\"](?:\s+en\s+" + _TIPOS_ELEMENTO + r"'(?P<objetivo>.*)')?$", minusculas)
+    if coincidencia:
+        objetivo = texto[coincidencia.start("objetivo"):coincidencia.end("objetivo")] if coincidencia.group("objetivo") is not None else None
+        return _paso("escribe", text=texto[coincidencia.start("texto"):coincidencia.end("texto")],
+                     element_type=coincidencia.group("tipo"), target=objetivo)
+    if minusculas.startswith("escribe"):
+        return _paso("escribe", text=texto[len("escribe"):].strip().strip("'\""))
+    if minusculas.startswith("presiona"):
+        return _paso("presiona", keys=texto[len("presiona"):].strip().strip("'\""))
+    if minusculas.startswith("cierra la ventana"):
+        return _paso("presiona", keys="Alt+F4")
+    if minusculas.startswith("espera"):
+        segundos = re.search(r"(\d+(?:[.,]\d+)?)\s*segundos?", minusculas)
+        citado = re.search(r"'([^']+)'", texto)
+        objetivo = citado.group(1) if citado else None
+        if objetivo is None and not segundos:
+            # "espera a que se abra la aplicación MicroWin": el nombre es lo que sigue al tipo de ventana
+            nombre = re.search(r"a que se abra (?:el|la)\s+(?:aplicación|ventana|menú|diálogo|cuadro de diálogo)\s+(?:de\s+)?(.+)$", texto, re.IGNORECASE)
+            objetivo = nombre.group(1).strip() if nombre else None
+        return _paso("espera", target=objetivo, wait_seconds=float(segundos.group(1).replace(",", ".")) if segundos else None)
+    coincidencia = re.match(r"^haz scroll (?:hacia )?(?P<dir>arriba|abajo|izquierda|derecha)?\s*en\s+" + _TIPOS_ELEMENTO + _CITADO + "$", minusculas)
+    if coincidencia:
+        return _paso("scroll", text=coincidencia.group("dir") or "abajo", element_type=coincidencia.group("tipo"),
+                     target=texto[coincidencia.start("objetivo"):coincidencia.end("objetivo")])
+    coincidencia = re.match(r"^selecciona\s+'(?P<texto>[^']*)'(?:\s+en\s+(?:el|la)\s+(?P<tipo>.+?)(?:\s+de\s+'(?P<objetivo>.*)')?)?$", minusculas)
+    if coincidencia:
+        return _paso("selecciona", text=texto[coincidencia.start("texto"):coincidencia.end("texto")], element_type=coincidencia.group("tipo"),
+                     target=texto[coincidencia.start("objetivo"):coincidencia.end("objetivo")] if coincidencia.group("objetivo") is not None else None)
+    if minusculas.startswith("busca en google"):
+        return _paso("busca_en_google", text=texto[len("busca en google"):].strip().strip("'\""))
+    if minusculas.startswith("recuérdame"):
+        return _paso("recuerda", text=texto[len("recuérdame"):].strip().strip("'\""))
+    if minusculas.startswith("muestra mis recordatorios"):
+        return _paso("muestra_recordatorios")
+    if minusculas.startswith("saluda al usuario"):
+        return _paso("saluda")
+    if minusculas.startswith("reconoce que la instrucción es una prueba de"):
+        return _paso("prueba", text=texto[len("reconoce que la instrucción es una prueba de"):].strip())
+    if minusculas.startswith("solicita más detalles"):
+        return _paso("pide_detalles")
+    return _paso("sin_accion", text=texto)
+
+
+def normalizar_paso(step: dict, numero: int) -> dict:
+    """Paso en el esquema tipado: los pasos antiguos (solo 'action') se convierten; a todos se les añade 'action'."""
+    if step.get("verb") in VERBOS:
+        paso = _paso(step["verb"], **{campo: step.get(campo) for campo in CAMPOS})
+    else:
+        paso = desde_accion(step.get("action", ""))
+    paso = {"step": step.get("step") or numero, **paso}
+    paso["action"] = a_accion(paso)
+    return paso
+
+
+def normalizar_plan(steps: list) -> list:
+    """Plan completo en el esquema tipado (acepta planes antiguos, nuevos o mezclados)."""
+    return [normalizar_paso(step, i) for i, step in enumerate(steps or [], start=1)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Esquema tipado de los pasos del plan.")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+    parser_convert = subparsers.add_parser("convert", help="Convierte un plan antiguo (acciones de texto libre) al esquema tipado.")
+    parser_convert.add_argument("input", help="Archivo JSON con la lista de pasos.")
+    parser_convert.add_argument("--output", help="Archivo de destino (por defecto, el mismo).")
+    args = parser.parse_args()
+
+    with open(args.input, "r", encoding="utf-8") as f:
+        plan = normalizar_plan(json.load(f))
+    with open(args.output or args.input, "w", encoding="utf-8") as f:
+        json.dump(plan, f, indent=2, ensure_ascii=False)
+    print(f"INFO: {len(plan)} pasos convertidos al esquema tipado en {args.output or args.input}.", flush=True)
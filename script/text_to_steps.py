@@ -1,10 +1,19 @@
 import os
 import sys
 import json
+import time
 import argparse
+from datetime import datetime
 from dotenv import load_dotenv
 from openai import OpenAI
 from openai import OpenAIError # Import specific OpenAI error for better catching
+from openai import APITimeoutError, APIConnectionError
+
+import rule_planner # Planificador local por reglas (órdenes de forma conocida, sin LLM)
+import plan_cache # Caché local instrucción normalizada -> plan
+import step_schema # Esquema tipado de los pasos (verb, element_type, target, text, keys, wait_seconds)
+from planner_prompt import (PLANNER_BACKENDS, PLANNER_PROMPT_PROFILE, PLANNER_LOCAL_PROMPT_PROFILE, # Prompt y su revisión
+                            SYSTEM_PROMPT, PROMPT_PROFILES, PERFIL_POR_BACKEND, PROMPT_REVISION)
 
 # --- Configurar la codificación de la salida de la consola al inicio ---
 try:
@@ -20,195 +29,177 @@ except Exception as e:
 load_dotenv()
 OPENAI_API_KEY = os.getenv("API_KEY") # Usar la variable de entorno para OpenAI
 
-if not OPENAI_API_KEY:
-    print("ERROR: La variable de entorno API_KEY (para OpenAI) no esta configurada. Por favor, configurala en tu archivo .env", flush=True)
-    sys.exit(1)
+# ==== BACKENDS DEL PLANIFICADOR ====
+# PLANNER_BACKENDS y los perfiles de prompt están en planner_prompt.py (entran en PROMPT_REVISION)
+PLANNER_MODEL = os.getenv("PLANNER_MODEL", "gpt-4o")
+PLANNER_TIMEOUT = float(os.getenv("PLANNER_TIMEOUT", "30")) # Segundos por llamada a OpenAI
+PLANNER_LOCAL_URL = os.getenv("PLANNER_LOCAL_URL", "http://localhost:11434/v1") # Ollama; llama.cpp server: http://localhost:8080/v1
+PLANNER_LOCAL_MODEL = os.getenv("PLANNER_LOCAL_MODEL", "qwen2.5:3b")
+PLANNER_LOCAL_TIMEOUT = float(os.getenv("PLANNER_LOCAL_TIMEOUT", "15"))
 
-client = None # Initialize client to None
-try:
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    # Opcional: Puedes añadir una pequeña prueba de conexión aquí si quieres,
-    # pero ten cuidado con los límites de tasa y el tiempo de respuesta.
-    # Por ejemplo: client.models.list()
-except OpenAIError as e:
-    print(f"ERROR: Error al inicializar el cliente de OpenAI o al conectar con la API: {e}", flush=True)
-    sys.stdout.flush() # Asegurar que el error se imprima antes de salir
-    sys.exit(1)
-except Exception as e:
-    print(f"ERROR: Error inesperado al inicializar el cliente de OpenAI: {e}", flush=True)
-    sys.stdout.flush() # Asegurar que el error se imprima antes de salir
-    sys.exit(1)
+# Salida estructurada estricta: el modelo solo puede devolver pasos que cumplan el esquema (verbos de la lista cerrada)
+RESPONSE_FORMAT = {"type": "json_schema", "json_schema": {"name": "plan_de_pasos", "strict": True, "schema": step_schema.STEP_JSON_SCHEMA}}
 
-def generate_steps_from_instruction(instruction):
-  """
-  Genera una lista de pasos de automatización a partir de una instrucción dada,
-  utilizando un modelo de lenguaje.
+# Registro de uso de tokens por llamada (JSON Lines), para confirmar que el prefijo se sirve desde la caché
+PLANNER_USAGE_LOG = os.getenv("PLANNER_USAGE_LOG", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "parsed_steps", "planner_usage.jsonl"))
+
+
+class BackendPlanificador:
   """
-  # Construye el prompt para el modelo de lenguaje
-  # Se ha añadido una guía explícita sobre cómo manejar instrucciones de prueba o declaraciones,
-  # y se han refinado las acciones y ejemplos para mayor claridad y consistencia.
-  prompt = f"""
-  Eres un asistente experto en **automatización de interfaces gráficas (GUI)**, especializado en entornos de **sistemas PLC** y aplicaciones relacionadas.
-  Tu objetivo es transformar una instrucción de usuario en una secuencia de pasos atómicos y ejecutables para la automatización.
-  Cada paso debe describir una acción clara sobre un elemento de la interfaz de usuario o una operación de sistema, enfocada en la interacción directa con la GUI.
-
-  La respuesta **DEBE** ser un objeto JSON con una única clave "steps", cuyo valor es un array de objetos de paso. El formato estricto es:
-  {{{{
-    "steps": [
-      {{{{ "step": INTEGER, "action": "STRING" }}}},
-      {{{{ "step": INTEGER, "action": "STRING" }}}},
-      // ...
-    ]
-  }}}}
-
-  ---
-  **Reglas y Formato de Acciones:**
-
-  1.  **Prioriza la interacción con elementos de la GUI.** Piensa en términos de "buscar", "hacer clic", "escribir", "seleccionar".
-  2.  **Precisión en la Identificación de Elementos:** Al referirte a un elemento, sé lo más descriptivo posible. Usa "[tipo de elemento] de '[texto/nombre visible]'".
-      * **Tipos de Elementos comunes:** `icono`, `botón`, `campo de texto`, `pestaña`, `ventana`, `menú desplegable`, `enlace`, `casilla de verificación`, `elemento de lista`, `área de texto`, `campo de número`, `control deslizante`.
-  3.  **Lista de Acciones Atómicas y Ejecutables:** Utiliza **SOLO** las siguientes estructuras de acción. Si una instrucción no encaja, intenta simplificarla o recurre a la acción "instrucción no clara".
-
-      * **Búsqueda:** `busca el [tipo de elemento] de '[texto/nombre del elemento]'`
-          * Ej: "busca el icono de 'Inicio'", "busca el botón de 'Aceptar'", "busca el campo de texto de 'Nombre de usuario'"
-      * **Clic:** `haz clic en el [tipo de elemento] de '[texto/nombre del elemento]'`
-          * Ej: "haz clic en el botón de 'Cancelar'", "haz clic en el icono de 'Mi PC'"
-      * **Doble Clic:** `haz doble clic en el [tipo de elemento] de '[texto/nombre del elemento]'`
-          * Ej: "haz doble clic en el icono de 'Documentos'"
-      * **Escribir:** `escribe '[texto a introducir]' en el [tipo de elemento] de '[texto/nombre del elemento]'`
-          * Ej: "escribe 'mi_proyecto_final' en el campo de texto de 'Nombre del proyecto'", "escribe 'contraseña123' en el campo de texto de 'Contraseña'"
-      * **Seleccionar (en listas/menús):** `selecciona '[opción deseada]' en el [tipo de elemento] de '[nombre del menú/lista]'`
-          * Ej: "selecciona 'Configuración Avanzada' en el menú desplegable de 'Opciones'"
-      * **Presionar Tecla/Combinación:** `presiona '[tecla]'` o `presiona '[tecla1]+[tecla2]'`
-          * Ej: "presiona 'Enter'", "presiona 'Alt+F4'", "presiona 'Ctrl+S'"
-      * **Esperar:** `espera a que se abra la [ventana/diálogo] '[Nombre de la ventana]'` o `espera X segundos`
-          * Ej: "espera a que se abra la ventana 'Configuración'", "espera 5 segundos"
-      * **Scroll:** `haz scroll [arriba/abajo/izquierda/derecha] en el [tipo de elemento] de '[texto/nombre del elemento]'`
-          * Ej: "haz scroll abajo en el área de texto de 'Log'"
-      * **Cierre genérico:** `cierra la ventana actual` (para casos como Alt+F4 si el modelo no lo infiere bien)
-
-  4.  **Manejo de Instrucciones no Automatizables/Claras:**
-      Si la instrucción es una simple declaración, una prueba, un saludo, una pregunta, o no implica una serie de acciones de automatización concretas sobre una GUI, genera **UN ÚNICO paso** utilizando una de las siguientes acciones genéricas:
-      * `reconoce que la instrucción es una prueba de [tipo de prueba]` (ej. "prueba de audio", "prueba de configuración")
-      * `saluda al usuario`
-      * `la instrucción no implica una acción de automatización de GUI específica` (para instrucciones vagas o irrelevantes)
-      * `solicita más detalles sobre la tarea a automatizar` (si la instrucción es ambigua pero podría ser automatizable con más info)
-
-  ---
-  **Ejemplos para el Modelo:**
-
-  -   **Instrucción:** "abre la aplicación MicroWin"
-      **Respuesta JSON esperada:**
-      {{{{
-        "steps": [
-          {{{{ "step": 1, "action": "busca el icono de 'Inicio'" }}}},
-          {{{{ "step": 2, "action": "haz clic en el icono de 'Inicio'" }}}},
-          {{{{ "step": 3, "action": "espera a que se abra el menú de 'Inicio'" }}}},
-          {{{{ "step": 4, "action": "busca el icono de 'MicroWin'" }}}},
-          {{{{ "step": 5, "action": "haz clic en el icono de 'MicroWin'" }}}},
-          {{{{ "step": 6, "action": "espera a que se abra la aplicación MicroWin" }}}}
-        ]
-      }}}}
-
-  -   **Instrucción:** "Quiero crear un nuevo programa en STEP 7."
-      **Respuesta JSON esperada:**
-      {{{{
-        "steps": [
-          {{{{ "step": 1, "action": "busca el icono de 'Inicio'" }}}},
-          {{{{ "step": 2, "action": "haz clic en el icono de 'Inicio'" }}}},
-          {{{{ "step": 3, "action": "espera a que se abra el menú de 'Inicio'" }}}},
-          {{{{ "step": 4, "action": "busca el icono de 'SIMATIC Manager'" }}}},
-          {{{{ "step": 5, "action": "haz clic en el icono de 'SIMATIC Manager'" }}}},
-          {{{{ "step": 6, "action": "espera a que se abra la ventana de 'SIMATIC Manager'" }}}},
-          {{{{ "step": 7, "action": "haz clic en el menú de 'Archivo'" }}}},
-          {{{{ "step": 8, "action": "selecciona 'Nuevo' en el menú" }}}},
-          {{{{ "step": 9, "action": "espera a que se abra el cuadro de diálogo 'Nuevo Proyecto'" }}}},
-          {{{{ "step": 10, "action": "escribe 'MiNuevoProyectoPLC' en el campo de texto de 'Nombre del Proyecto'" }}}},
-          {{{{ "step": 11, "action": "haz clic en el botón de 'Crear'" }}}}
-        ]
-      }}}}
-
-  -   **Instrucción:** "probando la nueva configuración del audio"
-      **Respuesta JSON esperada:**
-      {{{{
-        "steps": [
-          {{{{ "step": 1, "action": "reconoce que la instrucción es una prueba de audio" }}}}
-        ]
-      }}}}
-
-  -   **Instrucción:** "Hola"
-      **Respuesta JSON esperada:**
-      {{{{
-        "steps": [
-          {{{{ "step": 1, "action": "saluda al usuario" }}}}
-        ]
-      }}}}
-
-  -   **Instrucción:** "Cierra la ventana actual"
-      **Respuesta JSON esperada:**
-      {{{{
-        "steps": [
-          {{{{ "step": 1, "action": "presiona 'Alt+F4'" }}}}
-        ]
-      }}}}
-
-  -   **Instrucción:** "Qué hora es?"
-      **Respuesta JSON esperada:**
-      {{{{
-        "steps": [
-          {{{{ "step": 1, "action": "la instrucción no implica una acción de automatización de GUI específica" }}}}
-        ]
-      }}}}
-
-  ---
-  **Instrucción del Usuario:** "{instruction}"
+  Un endpoint de chat completions compatible con OpenAI (la propia API o un servidor local), con su modelo,
+  su perfil de prompt y su tiempo máximo de respuesta.
   """
-  
 
-  try:
-      response = client.chat.completions.create(
-          model="gpt-4o", # O el modelo de OpenAI que prefieras
+  def __init__(self, nombre: str, model: str, perfil: str, timeout: float, api_key: str, base_url: str = None):
+      if perfil not in PROMPT_PROFILES:
+          raise ValueError(f"Perfil de prompt desconocido para el backend '{nombre}': {perfil}")
+      self.nombre = nombre
+      self.model = model
+      self.perfil = perfil
+      self.system_prompt = PROMPT_PROFILES[perfil]
+      # Con otro backend detrás no se reintenta: pasar al siguiente es más rápido que repetir la llamada
+      self.client = OpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0 if len(PLANNER_BACKENDS) > 1 else 2)
+
+  def completar(self, user_message: str):
+      return self.client.chat.completions.create(
+          model=self.model,
           messages=[
-              {"role": "system", "content": "Genera pasos de automatizacion en formato JSON. La respuesta debe ser un objeto JSON con una clave 'steps' que contiene una lista de objetos de paso."},
-              {"role": "user", "content": prompt}
+              {"role": "system", "content": self.system_prompt},
+              {"role": "user", "content": user_message}
           ],
-          response_format={"type": "json_object"}, # Solicitar respuesta en formato JSON de nivel superior
+          response_format=RESPONSE_FORMAT, # Objeto {"steps": [...]} validado contra el esquema de pasos
           temperature=0.2,
-          max_tokens=500
+          max_tokens=1000 # Los pasos tipados ocupan más tokens que las acciones de texto libre
       )
-      
-      json_response_str = response.choices[0].message.content
-      
-      print(f"DEBUG: Raw JSON response from model: {json_response_str}", flush=True)
-      sys.stdout.flush() # Ensure this debug print is flushed
 
-      parsed_json = json.loads(json_response_str)
 
-      # Validar y extraer la lista de pasos de la clave "steps"
-      if isinstance(parsed_json, dict) and "steps" in parsed_json and \
-          isinstance(parsed_json["steps"], list) and \
-          all(isinstance(item, dict) for item in parsed_json["steps"]):
-          return parsed_json["steps"]
-      else:
-          print(f"ERROR: El modelo no devolvio un objeto JSON con la clave 'steps' conteniendo una lista de objetos. Tipo recibido: {type(parsed_json)}", flush=True)
-          sys.stdout.flush()
-          return []
+def crear_backends() -> list:
+  """Backends de PLANNER_BACKENDS que se pueden usar, en orden de preferencia."""
+  backends = []
+  for nombre in PLANNER_BACKENDS:
+      try:
+          if nombre == "openai":
+              if not OPENAI_API_KEY:
+                  print("WARNING: La variable de entorno API_KEY (para OpenAI) no esta configurada. Se omite el backend 'openai'.", flush=True)
+                  continue
+              backends.append(BackendPlanificador("openai", PLANNER_MODEL, PLANNER_PROMPT_PROFILE, PLANNER_TIMEOUT, OPENAI_API_KEY))
+          elif nombre == "local":
+              # Ollama y llama.cpp server no comprueban la clave, pero el cliente exige una
+              backends.append(BackendPlanificador("local", PLANNER_LOCAL_MODEL, PLANNER_LOCAL_PROMPT_PROFILE, PLANNER_LOCAL_TIMEOUT,
+                                                  os.getenv("PLANNER_LOCAL_API_KEY", "local"), base_url=PLANNER_LOCAL_URL))
+          else:
+              print(f"WARNING: Backend del planificador desconocido: '{nombre}'. Opciones: openai, local.", flush=True)
+      except (OpenAIError, ValueError) as e:
+          print(f"ERROR: Error al inicializar el backend '{nombre}' del planificador: {e}", flush=True)
+  return backends
+
+
+backends = crear_backends()
+if not backends:
+    print("ERROR: No hay ningún backend del planificador disponible. Revisa PLANNER_BACKENDS y la API_KEY en tu archivo .env", flush=True)
+    sys.stdout.flush() # Asegurar que el error se imprima antes de salir
+    sys.exit(1)
+
+
+def registrar_uso(response, latencia_ms: float, backend: BackendPlanificador):
+  """
+  Registra los tokens de la respuesta (incluidos los servidos desde la caché de prompts) en PLANNER_USAGE_LOG.
+  """
+  usage = getattr(response, "usage", None)
+  if usage is None:
+      return
+  detalles = getattr(usage, "prompt_tokens_details", None)
+  cached_tokens = (getattr(detalles, "cached_tokens", None) or 0) if detalles is not None else 0
+  registro = {
+      "timestamp": datetime.now().isoformat(),
+      "backend": backend.nombre,
+      "model": backend.model,
+      "prompt_profile": backend.perfil,
+      "prompt_revision": PROMPT_REVISION,
+      "prompt_tokens": usage.prompt_tokens,
+      "cached_tokens": cached_tokens,
+      "completion_tokens": usage.completion_tokens,
+      "latency_ms": round(latencia_ms, 1),
+  }
+  print(f"INFO: [{backend.nombre}] Tokens de entrada: {usage.prompt_tokens} ({cached_tokens} desde la caché de prompts), "
+        f"de salida: {usage.completion_tokens}, {latencia_ms:.0f} ms.", flush=True)
+  try:
+      os.makedirs(os.path.dirname(PLANNER_USAGE_LOG), exist_ok=True)
+      with open(PLANNER_USAGE_LOG, "a", encoding="utf-8") as f:
+          f.write(json.dumps(registro) + "\n")
+  except OSError as e:
+      print(f"WARNING: No se pudo escribir el registro de uso de tokens en {PLANNER_USAGE_LOG}: {e}", flush=True)
+
+
+def _planificar_con(backend: BackendPlanificador, user_message: str) -> list:
+  """
+  Pasos generados por un backend, o [] si su respuesta no es un plan válido.
+  Los errores de conexión y de tiempo de espera se propagan para pasar al siguiente backend.
+  """
+  inicio = time.perf_counter()
+  response = backend.completar(user_message)
 
-  except json.JSONDecodeError as e:
+  registrar_uso(response, (time.perf_counter() - inicio) * 1000, backend)
+  json_response_str = response.choices[0].message.content
+
+  print(f"DEBUG: Raw JSON response from model: {json_response_str}", flush=True)
+  sys.stdout.flush() # Ensure this debug print is flushed
+
+  try:
+      parsed_json = json.loads(json_response_str)
+  except (json.JSONDecodeError, TypeError) as e:
       print(f"ERROR: Error al parsear la respuesta JSON del modelo: {e}", flush=True)
       print(f"DEBUG: JSON string que causo el error: {json_response_str}", flush=True)
       sys.stdout.flush()
       return []
-  except Exception as e:
-      print(f"ERROR: Error al generar pasos con el modelo de lenguaje: {e}", flush=True)
-      print(f"Detalles de la respuesta (si existe): {getattr(e, 'response', 'No response attribute')}", flush=True)
-      sys.stdout.flush()
-      return []
+
+  # Validar y extraer la lista de pasos de la clave "steps"
+  if isinstance(parsed_json, dict) and "steps" in parsed_json and \
+      isinstance(parsed_json["steps"], list) and parsed_json["steps"] and \
+      all(isinstance(item, dict) and item.get("verb") in step_schema.VERBOS for item in parsed_json["steps"]):
+      return step_schema.normalizar_plan(parsed_json["steps"])
+  print(f"ERROR: El modelo no devolvio un objeto JSON con la clave 'steps' conteniendo una lista de pasos del esquema. Tipo recibido: {type(parsed_json)}", flush=True)
+  sys.stdout.flush()
+  return []
+
+
+def generate_steps_from_instruction(instruction):
+  """
+  Genera una lista de pasos de automatización a partir de una instrucción dada,
+  utilizando el primer backend del planificador que responda con un plan válido.
+  """
+  # Solo la instrucción varía entre llamadas: las reglas y los ejemplos están en el mensaje de sistema (prefijo cacheable)
+  user_message = f'**Instrucción del Usuario:** "{instruction}"'
+
+  for i, backend in enumerate(backends):
+      siguiente = f" Probando con '{backends[i + 1].nombre}'." if i + 1 < len(backends) else ""
+      try:
+          steps = _planificar_con(backend, user_message)
+      except APITimeoutError:
+          print(f"WARNING: El planificador '{backend.nombre}' ({backend.model}) no respondió en {backend.client.timeout:.0f} s.{siguiente}", flush=True)
+          continue
+      except APIConnectionError as e:
+          print(f"WARNING: No se pudo conectar con el planificador '{backend.nombre}' ({backend.model}): {str(e).rstrip('.')}.{siguiente}", flush=True)
+          continue
+      except Exception as e:
+          print(f"ERROR: Error al generar pasos con el modelo de lenguaje ({backend.nombre}): {e}", flush=True)
+          print(f"Detalles de la respuesta (si existe): {getattr(e, 'response', 'No response attribute')}", flush=True)
+          sys.stdout.flush()
+          continue
+      if steps:
+          return steps
+      if siguiente:
+          print(f"WARNING: El planificador '{backend.nombre}' no devolvió un plan válido.{siguiente}", flush=True)
+
+  print("ERROR: Ningún backend del planificador generó un plan.", flush=True)
+  sys.stdout.flush()
+  return []
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Genera pasos de automatizacion a partir de una instruccion de texto.")
     parser.add_argument("--input", required=True, help="Ruta al archivo de texto con la instruccion.")
     parser.add_argument("--output", required=True, help="Ruta al archivo JSON donde se guardaran los pasos generados.")
+    parser.add_argument("--no-rules", action="store_true", help="No probar el planificador por reglas (el llamador ya lo ha hecho).")
     args = parser.parse_args()
 
     input_path = args.input
@@ -224,7 +215,19 @@ if __name__ == "__main__":
 
     print("[INFO] Generando pasos...", flush=True)
     sys.stdout.flush()
-    steps = generate_steps_from_instruction(instruction)
+    steps = None if args.no_rules else rule_planner.planificar(instruction)
+    if steps is None:
+        cache = None
+        if plan_cache.PLAN_CACHE_ENABLED:
+            try:
+                cache = plan_cache.PlanCache(revision=PROMPT_REVISION)
+                steps = cache.buscar(instruction)
+            except Exception as e:
+                print(f"WARNING: No se pudo usar la caché de planes: {e}", flush=True)
+        if steps is None:
+            steps = generate_steps_from_instruction(instruction)
+            if cache is not None:
+                cache.guardar(instruction, steps)
 
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     with open(output_path, "w", encoding="utf-8") as f:
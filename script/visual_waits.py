@@ -0,0 +1,224 @@
+import os
+import sys
+import time
+
+import cv2
+import mss
+import numpy as np
+
+try:
+    from script import screenshot, frame_grabber # Importado desde la raíz del proyecto (main.py)
+except ImportError:
+    import screenshot # Importado desde la carpeta 'script'
+    import frame_grabber
+
+# Dependencias opcionales: OCR y títulos de ventana
+try:
+    import pytesseract
+    pytesseract.pytesseract.tesseract_cmd = os.getenv("TESSERACT_CMD", r'C:\Program Files\Tesseract-OCR\tesseract.exe')
+except ImportError:
+    pytesseract = None
+
+try:
+    import pygetwindow
+except (ImportError, NotImplementedError):
+    pygetwindow = None # pygetwindow solo está implementado en Windows
+
+# --- Configurar la codificación de la salida de la consola al inicio ---
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+except AttributeError:
+    pass
+except Exception as e:
+    print(f"WARNING: No se pudo reconfigurar la codificacion de la consola: {e}", flush=True)
+
+# --- Configuración de las esperas visuales ---
+VISUAL_WAIT_TIMEOUT = float(os.getenv("VISUAL_WAIT_TIMEOUT", "10")) # Tiempo máximo por defecto (s)
+VISUAL_WAIT_POLL = float(os.getenv("VISUAL_WAIT_POLL", "0.15")) # Intervalo entre comprobaciones (s)
+VISUAL_WAIT_STABLE_THRESHOLD = float(os.getenv("VISUAL_WAIT_STABLE_THRESHOLD", "1.0")) # Diferencia media (0-255) considerada "sin cambios"
+VISUAL_WAIT_STABLE_TIME = float(os.getenv("VISUAL_WAIT_STABLE_TIME", "0.4")) # Tiempo que la pantalla debe permanecer sin cambios (s)
+# Tras un clic, tiempo máximo que se espera a que la pantalla empiece a cambiar antes de esperar a que se estabilice (s)
+VISUAL_WAIT_CHANGE_TIMEOUT = float(os.getenv("VISUAL_WAIT_CHANGE_TIMEOUT", "2.0"))
+VISUAL_WAIT_OCR_POLL = float(os.getenv("VISUAL_WAIT_OCR_POLL", "0.75")) # El OCR es caro: se comprueba con menos frecuencia
+
+
+class FuenteDeFrames:
+    """
+    Entrega frames de pantalla para las esperas. Usa el capturador continuo si está en marcha
+    (sin coste de captura) y, si no, mantiene un handle de mss abierto durante la espera.
+    """
+
+    def __init__(self, monitor_index: int = None):
+        self.grabber = frame_grabber.get_grabber(start=False)
+        if self.grabber and not self.grabber.running:
+            self.grabber = None
+        self.monitor_index = monitor_index if monitor_index is not None else screenshot.parse_monitor_priority()[0]
+        self._sct = None
+        self._ultimo_ts = 0.0
+
+    def __enter__(self):
+        if self.grabber is None:
+            self._sct = mss.mss()
+            if self.monitor_index >= len(self._sct.monitors):
+                self.monitor_index = 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self._sct:
+            self._sct.close()
+            self._sct = None
+
+    def siguiente(self, timeout: float = 1.0):
+        """
+        Devuelve el siguiente frame (array BGR) posterior al anterior, o None si no llega a tiempo.
+        """
+        if self.grabber:
+            resultado = self.grabber.wait_for_frame(after=self._ultimo_ts, timeout=timeout)
+            if resultado is None:
+                return None
+            self._ultimo_ts, frame = resultado
+            return frame
+        return np.array(self._sct.grab(self._sct.monitors[self.monitor_index]))[:, :, :3]
+
+
+def esperar_hasta(condicion, timeout: float = VISUAL_WAIT_TIMEOUT, intervalo: float = VISUAL_WAIT_POLL, descripcion: str = "condicion") -> bool:
+    """
+    Evalúa 'condicion()' cada 'intervalo' segundos hasta que devuelva True o se agote 'timeout'.
+    """
+    inicio = time.monotonic()
+    while True:
+        try:
+            if condicion():
+                print(f"INFO: Espera completada ({descripcion}) en {time.monotonic() - inicio:.2f} s.", flush=True)
+                return True
+        except Exception as e:
+            print(f"WARNING: Error al evaluar la condicion de espera ({descripcion}): {e}", flush=True)
+        if time.monotonic() - inicio >= timeout:
+            print(f"WARNING: Tiempo de espera agotado ({timeout:.1f} s) esperando: {descripcion}.", flush=True)
+            return False
+        time.sleep(intervalo)
+
+
+def esperar_pantalla_estable(region: tuple = None, timeout: float = VISUAL_WAIT_TIMEOUT, umbral: float = VISUAL_WAIT_STABLE_THRESHOLD,
+                             estable_durante: float = VISUAL_WAIT_STABLE_TIME, esperar_cambio: float = 0.0) -> bool:
+    """
+    Espera a que la pantalla (o la región (x1, y1, x2, y2)) deje de cambiar durante 'estable_durante' segundos.
+    Si 'esperar_cambio' > 0, primero espera hasta ese tiempo a que la pantalla empiece a cambiar
+    (útil justo después de un clic, antes de que la ventana empiece a abrirse).
+    """
+    inicio = time.monotonic()
+    with FuenteDeFrames() as fuente:
+        referencia = fuente.siguiente()
+        if esperar_cambio > 0:
+            while time.monotonic() - inicio < esperar_cambio:
+                time.sleep(VISUAL_WAIT_POLL)
+                frame = fuente.siguiente()
+                if frame_grabber.diferencia_entre_frames(referencia, frame, region) > umbral:
+                    referencia = frame
+                    break
+
+        estable_desde = time.monotonic()
+        while time.monotonic() - inicio < timeout:
+            time.sleep(VISUAL_WAIT_POLL)
+            frame = fuente.siguiente()
+            if frame is None:
+                continue
+            if frame_grabber.diferencia_entre_frames(referencia, frame, region) > umbral:
+                estable_desde = time.monotonic()
+            elif time.monotonic() - estable_desde >= estable_durante:
+                print(f"INFO: Pantalla estable tras {time.monotonic() - inicio:.2f} s.", flush=True)
+                return True
+            referencia = frame
+    print(f"WARNING: La pantalla no se estabilizo en {timeout:.1f} s.", flush=True)
+    return False
+
+
+def esperar_elemento(image_path: str, timeout: float = VISUAL_WAIT_TIMEOUT, confidence: float = 0.8) -> bool:
+    """
+    Espera a que aparezca en pantalla un elemento conocido (p. ej. una imagen de la caché de Qdrant).
+    """
+    plantilla = cv2.imread(image_path)
+    if plantilla is None:
+        print(f"WARNING: No se pudo cargar la imagen del elemento a esperar: {image_path}", flush=True)
+        return False
+    with FuenteDeFrames() as fuente:
+        def aparece():
+            frame = fuente.siguiente()
+            if frame is None or frame.shape[0] < plantilla.shape[0] or frame.shape[1] < plantilla.shape[1]:
+                return False
+            return cv2.minMaxLoc(cv2.matchTemplate(frame, plantilla, cv2.TM_CCOEFF_NORMED))[1] >= confidence
+        return esperar_hasta(aparece, timeout, descripcion=f"elemento '{os.path.basename(image_path)}'")
+
+
+def esperar_texto(texto: str, region: tuple = None, timeout: float = VISUAL_WAIT_TIMEOUT) -> bool:
+    """
+    Espera a que el OCR detecte 'texto' en la pantalla (o en la región indicada).
+    """
+    if pytesseract is None:
+        print("WARNING: pytesseract no está disponible. No se puede esperar por texto OCR.", flush=True)
+        return False
+    buscado = texto.lower()
+    with FuenteDeFrames() as fuente:
+        def aparece():
+            frame = fuente.siguiente()
+            if frame is None:
+                return False
+            if region:
+                x1, y1, x2, y2 = region
+                frame = frame[y1:y2, x1:x2]
+            return buscado in pytesseract.image_to_string(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), lang='spa').lower()
+        return esperar_hasta(aparece, timeout, intervalo=VISUAL_WAIT_OCR_POLL, descripcion=f"texto '{texto}'")
+
+
+def hay_ventana_con_titulo(titulo: str) -> bool:
+    """
+    True si alguna ventana abierta contiene 'titulo' en su título (sin distinguir mayúsculas).
+    """
+    buscado = titulo.lower()
+    return any(buscado in t.lower() for t in pygetwindow.getAllTitles())
+
+
+def esperar_titulo_ventana(titulo: str, timeout: float = VISUAL_WAIT_TIMEOUT) -> bool:
+    """
+    Espera a que exista una ventana cuyo título contenga 'titulo'. Devuelve False sin esperar si
+    pygetwindow no está disponible, para que el llamador pueda recurrir a otra condición.
+    """
+    if pygetwindow is None:
+        return False
+    return esperar_hasta(lambda: hay_ventana_con_titulo(titulo), timeout, descripcion=f"ventana '{titulo}'")
+
+
+def esperar_ventana(nombre: str = None, timeout: float = VISUAL_WAIT_TIMEOUT, umbral: float = VISUAL_WAIT_STABLE_THRESHOLD,
+                    esperar_cambio: float = VISUAL_WAIT_CHANGE_TIMEOUT) -> bool:
+    """
+    Espera a que se abra una ventana/menú. Termina en cuanto ocurra lo primero de:
+    - aparece una ventana cuyo título contiene 'nombre' (si pygetwindow está disponible) y la pantalla se estabiliza,
+    - la pantalla cambia y después permanece estable durante VISUAL_WAIT_STABLE_TIME, o
+    - la pantalla no cambia en 'esperar_cambio' segundos (la ventana ya se había dibujado antes de empezar a esperar).
+    """
+    inicio = time.monotonic()
+    ha_cambiado = False
+    with FuenteDeFrames() as fuente:
+        referencia = fuente.siguiente()
+        estable_desde = time.monotonic()
+        while time.monotonic() - inicio < timeout:
+            time.sleep(VISUAL_WAIT_POLL)
+            if nombre and pygetwindow is not None and hay_ventana_con_titulo(nombre):
+                print(f"INFO: Ventana '{nombre}' detectada tras {time.monotonic() - inicio:.2f} s.", flush=True)
+                return esperar_pantalla_estable(timeout=max(0.0, timeout - (time.monotonic() - inicio)))
+            frame = fuente.siguiente()
+            if frame is None:
+                continue
+            if frame_grabber.diferencia_entre_frames(referencia, frame) > umbral:
+                ha_cambiado = True
+                estable_desde = time.monotonic()
+            elif ha_cambiado and time.monotonic() - estable_desde >= VISUAL_WAIT_STABLE_TIME:
+                print(f"INFO: La pantalla cambio y se estabilizo tras {time.monotonic() - inicio:.2f} s.", flush=True)
+                return True
+            elif not ha_cambiado and time.monotonic() - inicio >= esperar_cambio:
+                print(f"INFO: La pantalla no cambio en {esperar_cambio:.1f} s; se da por abierta la ventana {nombre or ''}.", flush=True)
+                return True
+            referencia = frame
+    print(f"WARNING: Tiempo de espera agotado ({timeout:.1f} s) esperando la ventana {nombre or ''}.", flush=True)
+    return False
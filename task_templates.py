@@ -0,0 +1,213 @@
+import os
+import re
+import sys
+import uuid
+import unicodedata
+
+# --- Configurar la codificación de la salida de la consola al inicio ---
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+except AttributeError:
+    pass
+except Exception as e:
+    print(f"WARNING: No se pudo reconfigurar la codificacion de la consola: {e}", flush=True)
+
+# --- Configuración ---
+# Plantillas de flujos de tarea: un plan aprendido ("escribe 'MiProyecto' en ...") se guarda con huecos tipados
+# ("escribe '{s1}' en ...") y sirve para cualquier orden de la misma forma con otros valores, sin llamar al LLM.
+TASK_TEMPLATES_ENABLED = os.getenv("TASK_TEMPLATES_ENABLED", "true").lower() == "true"
+TASK_TEMPLATE_SEARCH_THRESHOLD = float(os.getenv("TASK_TEMPLATE_SEARCH_THRESHOLD", "0.6"))
+TASK_TEMPLATE_CANDIDATES = int(os.getenv("TASK_TEMPLATE_CANDIDATES", "5")) # Flujos similares cuyo patrón se prueba
+TASK_TEMPLATE_MAX_SLOT_LENGTH = int(os.getenv("TASK_TEMPLATE_MAX_SLOT_LENGTH", "120"))
+TASK_TEMPLATE_MAX_ELEMENT_WORDS = int(os.getenv("TASK_TEMPLATE_MAX_ELEMENT_WORDS", "5")) # Etiquetas más largas no son un elemento
+
+# Tipos de hueco (texto a escribir, nombre de archivo, etiqueta de un elemento de la interfaz) y lo que aceptan
+_PATRON_SLOT = {
+    "texto": r".+?",
+    "archivo": r"[^\s'\"]+\.\w{1,5}",
+    "elemento": r".+?",
+}
+_COMILLAS = "'\"«»“”‘’"
+_RE_ARCHIVO = re.compile(r"\.\w{1,5}$")
+_RE_CITADO = re.compile(r"'([^']+)'")
+# Un hueco sin comillas con conectores es el resto de una orden compuesta ("hola y pulsa enter"), no un valor
+# (el mismo criterio que rule_planner._RE_COMPUESTA)
+_RE_COMPUESTA = re.compile(r"\s(?:y|e|luego|después|despues|entonces)\s|[,;:]", re.IGNORECASE)
+# Planes que no conviene reutilizar: respuestas genéricas a órdenes que no son de automatización
+_ACCIONES_GENERICAS = ("reconoce que la instrucción", "saluda al usuario", "la instrucción no implica", "solicita más detalles")
+# Espacio de nombres de los IDs de plantilla (uuid5): la misma plantilla aprendida dos veces es el mismo punto
+_ID_NAMESPACE = uuid.UUID("3b8e4c1a-7d2f-5e6a-9b0c-1d2e3f4a5b6c")
+# Campos de texto de los pasos tipados (ver script/step_schema.py) en los que puede aparecer un hueco
+_CAMPOS_CON_HUECOS = ("target", "text", "keys")
+_VARIANTES = {"a": "aáàä", "e": "eéèë", "i": "iíìï", "o": "oóòö", "u": "uúùü", "n": "nñ", "c": "cç"}
+
+
+def _sin_acentos(texto: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFD", texto) if unicodedata.category(c) != "Mn")
+
+
+def _literal_tolerante(texto: str) -> str:
+    """Patrón para un tramo literal: sin distinguir acentos, con espacios flexibles y comillas opcionales."""
+    partes = []
+    for c in texto:
+        base = _sin_acentos(c).lower()
+        if c.isspace():
+            if not partes or partes[-1] != r"\s+":
+                partes.append(r"\s+")
+        elif c in _COMILLAS:
+            partes.append(f"[{re.escape(_COMILLAS)}]?")
+        elif base in _VARIANTES:
+            partes.append(f"[{_VARIANTES[base]}]")
+        else:
+            partes.append(re.escape(c))
+    return "".join(partes)
+
+
+def _buscar_en_instruccion(valor: str, instruccion: str):
+    """Posición (inicio, fin) de 'valor' en la instrucción, incluidas sus comillas si las tiene; None si no aparece."""
+    coincidencia = re.search(_literal_tolerante(valor), instruccion, re.IGNORECASE)
+    if not coincidencia:
+        return None
+    inicio, fin = coincidencia.span()
+    if inicio > 0 and fin < len(instruccion) and instruccion[inicio - 1] in _COMILLAS and instruccion[fin] in _COMILLAS:
+        inicio, fin = inicio - 1, fin + 1
+    return inicio, fin
+
+
+def _tipo_de_slot(valor: str, steps: list) -> str:
+    for step in steps:
+        if step.get("verb") == "escribe" and step.get("text") == valor:
+            return "texto"
+    return "archivo" if _RE_ARCHIVO.search(valor) else "elemento"
+
+
+def es_reutilizable(steps: list) -> bool:
+    """Un plan vacío o una respuesta genérica ("saluda al usuario"...) no se guarda como plantilla."""
+    return bool(steps) and not any(step.get("action", "").lower().startswith(_ACCIONES_GENERICAS) for step in steps)
+
+
+def crear_plantilla(instruccion: str, steps: list) -> dict:
+    """
+    Convierte (instrucción, pasos) en una plantilla. Cada valor entre comillas de los pasos que también aparece en
+    la instrucción pasa a ser un hueco {sN} en ambos; los que no aparecen (p. ej. 'Inicio') quedan literales.
+    Devuelve {"instruction": ..., "steps": [...], "slots": {"s1": {"type": ..., "example": ...}}}.
+    """
+    plantilla_instruccion = instruccion.strip()
+    plantilla_steps = [dict(step) for step in steps]
+    slots = {}
+    valores = []
+    for step in steps:
+        for valor in _RE_CITADO.findall(step.get("action", "")):
+            if valor.strip() and valor not in valores:
+                valores.append(valor)
+    # Los valores más largos primero, para que 'Proyecto' no se coma parte de 'Proyecto Final'
+    for valor in sorted(valores, key=len, reverse=True):
+        posicion = _buscar_en_instruccion(valor, plantilla_instruccion)
+        if posicion is None:
+            continue
+        nombre = f"s{len(slots) + 1}"
+        slots[nombre] = {"type": _tipo_de_slot(valor, steps), "example": valor}
+        inicio, fin = posicion
+        plantilla_instruccion = f"{plantilla_instruccion[:inicio]}{{{nombre}}}{plantilla_instruccion[fin:]}"
+        for step in plantilla_steps:
+            step["action"] = step.get("action", "").replace(f"'{valor}'", f"'{{{nombre}}}'")
+            for campo in _CAMPOS_CON_HUECOS:
+                if step.get(campo) == valor:
+                    step[campo] = f"{{{nombre}}}"
+    return {"instruction": plantilla_instruccion, "steps": plantilla_steps, "slots": slots}
+
+
+def _patron(plantilla: dict):
+    """Expresión regular de la instrucción de la plantilla, con un grupo con nombre por hueco."""
+    partes = re.split(r"\{(s\d+)\}", plantilla["instruction"].strip())
+    partes[-1] = partes[-1].rstrip(" .!?") # El punto final es opcional
+    comilla = f"[{re.escape(_COMILLAS)}]?"
+    patron = []
+    for i, parte in enumerate(partes):
+        if i % 2 == 0:
+            patron.append(_literal_tolerante(parte))
+        else:
+            patron.append(f"{comilla}(?P<{parte}>{_PATRON_SLOT[plantilla['slots'][parte]['type']]}){comilla}")
+    return re.compile(r"^\s*" + "".join(patron) + r"\s*[.!?]?\s*$", re.IGNORECASE)
+
+
+def extraer_slots(plantilla: dict, instruccion: str) -> dict | None:
+    """
+    Valores de los huecos de la plantilla en la instrucción, o None si la instrucción no tiene la misma forma.
+    """
+    coincidencia = _patron(plantilla).match(instruccion)
+    if not coincidencia:
+        return None
+    valores = {}
+    for nombre, valor in coincidencia.groupdict().items():
+        valor = valor.strip()
+        if not valor or len(valor) > TASK_TEMPLATE_MAX_SLOT_LENGTH or any(c in _COMILLAS for c in valor):
+            return None
+        inicio, fin = coincidencia.span(nombre)
+        entre_comillas = inicio > 0 and fin < len(instruccion) and instruccion[inicio - 1] in _COMILLAS and instruccion[fin] in _COMILLAS
+        # Entre comillas el valor está delimitado ("escribe 'pan y vino'"); sin ellas, un conector indica otra orden
+        if not entre_comillas and _RE_COMPUESTA.search(f" {valor} "):
+            return None
+        if plantilla["slots"][nombre]["type"] == "elemento" and len(valor.split()) > TASK_TEMPLATE_MAX_ELEMENT_WORDS:
+            return None
+        valores[nombre] = valor
+    return valores
+
+
+def rellenar(plantilla: dict, valores: dict) -> list:
+    """Pasos de la plantilla con los huecos sustituidos por 'valores'."""
+    steps = []
+    for step in plantilla["steps"]:
+        step = dict(step)
+        for campo in ("action",) + _CAMPOS_CON_HUECOS:
+            if isinstance(step.get(campo), str):
+                for nombre, valor in valores.items():
+                    step[campo] = step[campo].replace(f"{{{nombre}}}", valor)
+        steps.append(step)
+    return steps
+
+
+def id_de_plantilla(plantilla: dict) -> str:
+    clave = _sin_acentos(" ".join(plantilla["instruction"].lower().split()))
+    return uuid.uuid5(_ID_NAMESPACE, clave).hex
+
+
+def plan_desde_plantilla(km, instruccion: str) -> list | None:
+    """
+    Busca flujos de tarea parecidos a la instrucción y prueba sus plantillas con el emparejador local.
+    Devuelve los pasos rellenados de la primera que encaje, o None si hay que recurrir al planificador.
+    """
+    if not TASK_TEMPLATES_ENABLED:
+        return None
+    for flujo in km.search_task_flow(instruccion, limit=TASK_TEMPLATE_CANDIDATES, score_threshold=TASK_TEMPLATE_SEARCH_THRESHOLD):
+        plantilla = flujo.get("template")
+        if not plantilla:
+            continue
+        valores = extraer_slots(plantilla, instruccion)
+        if valores is None:
+            continue
+        print(f"INFO: Plan obtenido de la plantilla '{plantilla['instruction']}' con {valores} (sin LLM).", flush=True)
+        return rellenar(plantilla, valores)
+    return None
+
+
+def aprender(km, instruccion: str, steps: list, kb_journal=None) -> str | None:
+    """
+    Guarda el plan como plantilla en la colección de flujos de tarea (con el diario de escrituras si se indica).
+    Devuelve el ID del punto, o None si el plan no es reutilizable.
+    """
+    if not TASK_TEMPLATES_ENABLED or not es_reutilizable(steps):
+        return None
+    plantilla = crear_plantilla(instruccion, steps)
+    point_id = id_de_plantilla(plantilla)
+    if extraer_slots(plantilla, instruccion) is None:
+        print(f"WARNING: La plantilla '{plantilla['instruction']}' no reconoce su propia instrucción. No se guarda.", flush=True)
+        return None
+    flujo = {"task_description": instruccion, "steps": steps, "metadata": {"template": plantilla}, "point_id": point_id}
+    if kb_journal is not None and kb_journal.KB_JOURNAL_ENABLED:
+        kb_journal.encolar("add_task_flow", **flujo)
+    else:
+        km.add_task_flows([flujo])
+    print(f"INFO: Plantilla de flujo aprendida: '{plantilla['instruction']}' ({len(plantilla['slots'])} huecos).", flush=True)
+    return point_id
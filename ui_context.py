@@ -0,0 +1,98 @@
+import os
+import sys
+import platform
+
+# --- Configurar la codificación de la salida de la consola al inicio ---
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+except AttributeError:
+    pass
+except Exception as e:
+    print(f"WARNING: No se pudo reconfigurar la codificacion de la consola: {e}", flush=True)
+
+try:
+    import win32gui
+    import win32process
+except ImportError:
+    win32gui = None # Fuera de Windows (o sin pywin32) no se detecta la ventana en primer plano
+    win32process = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# --- Configuración ---
+# Campos de contexto que se guardan en el payload de cada elemento UI (todos con índice de palabra clave)
+CONTEXT_FIELDS = ("app", "window_class", "os", "theme", "resolution")
+# Aplicación fija (la misma variable que usa knowledge_manager); si está vacía se usa el proceso en primer plano
+KM_APPLICATION = os.getenv("KM_APPLICATION", "")
+
+
+def _ventana_en_primer_plano() -> tuple:
+    """(nombre del proceso sin extensión, clase de ventana) de la ventana en primer plano, o (None, None)."""
+    if win32gui is None:
+        return None, None
+    try:
+        hwnd = win32gui.GetForegroundWindow()
+        if not hwnd:
+            return None, None
+        clase = win32gui.GetClassName(hwnd) or None
+        proceso = None
+        if psutil is not None:
+            _, pid = win32process.GetWindowThreadProcessId(hwnd)
+            proceso = os.path.splitext(psutil.Process(pid).name())[0].lower()
+        return proceso, clase
+    except Exception as e:
+        print(f"DEBUG: No se pudo identificar la ventana en primer plano: {e}", flush=True)
+        return None, None
+
+
+def _tema() -> str | None:
+    """Tema de las aplicaciones de Windows ('light' / 'dark'); None si no se puede saber."""
+    if sys.platform != "win32":
+        return None
+    try:
+        import winreg
+        with winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Microsoft\Windows\CurrentVersion\Themes\Personalize") as clave:
+            valor, _ = winreg.QueryValueEx(clave, "AppsUseLightTheme")
+        return "light" if valor else "dark"
+    except OSError:
+        return None
+
+
+def _resolucion() -> str | None:
+    """Resolución del monitor principal como 'ANCHOxALTO'."""
+    try:
+        if sys.platform == "win32":
+            import ctypes
+            user32 = ctypes.windll.user32
+            return f"{user32.GetSystemMetrics(0)}x{user32.GetSystemMetrics(1)}"
+        import mss
+        with mss.mss() as sct:
+            monitor = sct.monitors[1]
+            return f"{monitor['width']}x{monitor['height']}"
+    except Exception:
+        return None
+
+
+def contexto_actual() -> dict:
+    """
+    Contexto de la pantalla en este momento: aplicación y clase de la ventana en primer plano, sistema operativo,
+    tema y resolución. Solo incluye los campos que se han podido determinar.
+    """
+    proceso, clase = _ventana_en_primer_plano()
+    contexto = {
+        "app": KM_APPLICATION or proceso,
+        "window_class": clase,
+        "os": f"{platform.system()}-{platform.release()}".lower(),
+        "theme": _tema(),
+        "resolution": _resolucion(),
+    }
+    return {campo: valor for campo, valor in contexto.items() if valor}
+
+
+if __name__ == "__main__":
+    # Muestra el contexto detectado: python ui_context.py
+    print(contexto_actual(), flush=True)